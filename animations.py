@@ -156,3 +156,55 @@ def load_knight_idle_animation(target_width, target_height):
         scaled_frame = pygame.transform.smoothscale(frame, (target_width, target_height))
         frames.append(scaled_frame)
     return frames
+
+
+# --- 動畫圖集清單 (給非同步資源載入使用) ---
+# 名稱: (路徑, 幀數, 是否垂直排列)
+KNIGHT_SHEETS = {
+    "walk": ("./plays_animation_art/Knight_WALK.png", 8, False),
+    "idle": ("./plays_animation_art/Knight_IDLE.png", 7, False),
+    "run": ("./plays_animation_art/Knight_RUN.png", 8, False),
+    "attack1": ("./plays_animation_art/Knight_ATTACK 1.png", 6, False),
+    "attack2": ("./plays_animation_art/Knight_ATTACK 2.png", 5, False),
+    "attack3": ("./plays_animation_art/Knight_ATTACK 3.png", 6, False),
+    "hurt": ("./plays_animation_art/Knight_HURT.png", 4, False),
+    "death": ("./plays_animation_art/Knight_DEATH.png", 12, False),
+    "jump": ("./plays_animation_art/Knight_JUMP.png", 5, False),
+    "defend": ("./plays_animation_art/Knight_DEFEND.png", 6, False),
+}
+WITCH_SHEETS = {
+    "walk": ("./plays_animation_art/B_witch_run.png", 8, True),
+    "idle": ("./plays_animation_art/B_witch_idle.png", 6, True),
+    "attack": ("./plays_animation_art/B_witch_attack.png", 9, True),
+    "charge": ("./plays_animation_art/B_witch_charge.png", 5, True),
+    "hurt": ("./plays_animation_art/B_witch_take_damage.png", 3, True),
+    "death": ("./plays_animation_art/B_witch_death.png", 10, True),
+}
+
+
+def slice_sprite_sheet(sprite_sheet, num_frames, vertical, target_width, target_height, name=""):
+    """
+    把已載入的精靈圖集切割成單獨的幀並縮放。
+    Args:
+        sprite_sheet (pygame.Surface): 已經 convert_alpha 的圖集。
+        num_frames (int): 幀數。
+        vertical (bool): True 表示幀是垂直排列，False 表示水平排列。
+        target_width (int): 最終縮放後的圖片寬度。
+        target_height (int): 最終縮放後的圖片高度。
+        name (str): 圖集名稱，只用於警告訊息。
+    Returns:
+        list: 包含所有縮放後動畫幀的列表。
+    """
+    sheet_length = sprite_sheet.get_height() if vertical else sprite_sheet.get_width()
+    if sheet_length % num_frames != 0:
+        print(f"警告：{name} 的{'高度' if vertical else '宽度'} {sheet_length} 不是帧数 {num_frames} 的整数倍，可能导致切割不准确！")
+    step = sheet_length // num_frames
+
+    frames = []
+    for i in range(num_frames):
+        if vertical:
+            frame = sprite_sheet.subsurface((0, i * step, sprite_sheet.get_width(), step))
+        else:
+            frame = sprite_sheet.subsurface((i * step, 0, step, sprite_sheet.get_height()))
+        frames.append(pygame.transform.smoothscale(frame, (target_width, target_height)))
+    return frames
@@ -0,0 +1,124 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+
+# --- 非同步資源載入 ---
+def _decode_image(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"圖片未找到: {path}")
+    return pygame.image.load(path)  # 解碼在背景執行緒，convert_alpha 留給主執行緒
+
+
+class AssetLoader:
+    """
+    用執行緒池在背景解碼圖片 (與其他不碰顯示的工作，例如編譯關卡)。
+    convert_alpha、切割、縮放等需要顯示格式的步驟由 LoadingJob 在主執行緒分幀完成。
+    Args:
+        max_workers (int): 背景執行緒數量。
+        track (callable): track(surface)，解碼出來的圖片交給它登記記憶體用量 (None 表示不登記)。
+    """
+
+    def __init__(self, max_workers=4, track=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asset")
+        self._images = {}  # path -> Future，同一張圖只解碼一次
+        self.track = track
+
+    def _decode(self, path):
+        surface = _decode_image(path)
+        return surface if self.track is None else self.track(surface)
+
+    def load_image(self, path):
+        """開始在背景解碼 path，回傳 Future (結果是尚未 convert 的 Surface)。"""
+        future = self._images.get(path)
+        if future is None:
+            future = self._executor.submit(self._decode, path)
+            self._images[path] = future
+        return future
+
+    def release_decoded(self):
+        """
+        丟掉已經解碼完成的圖片 (都已經 convert 成顯示格式，原始解碼結果只是為了重複使用)。
+        之後再 load_image 同一張圖會重新解碼。回傳是否丟掉了圖片。
+        """
+        done = [path for path, future in self._images.items() if future.done()]
+        for path in done:
+            del self._images[path]
+        return bool(done)
+
+    def forget(self, path):
+        """讓下次 load_image 重新從檔案解碼 (檔案修改後使用)。"""
+        self._images.pop(path, None)
+
+    def submit(self, fn, *args, **kwargs):
+        """在背景執行任意不碰顯示的工作。"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoadingJob:
+    """
+    一連串的載入步驟。每個步驟可以有一個背景 Future 與一個在主執行緒執行的 finalize(result)。
+    主迴圈每幀呼叫 poll(budget_ms)，只在時間預算內依序完成已就緒的步驟，所以畫面不會卡住。
+    Args:
+        on_error (callable): on_error(label, exception)，有提供時失敗的步驟只回報並略過 (熱重載用)，
+            None 表示在 poll 中重新拋出。
+    """
+
+    def __init__(self, on_error=None):
+        self._steps = []  # [label, future, finalize]
+        self._next = 0
+        self.on_error = on_error
+
+    def add(self, label, future=None, finalize=None):
+        """
+        加入一個步驟。
+        Args:
+            label (str): 顯示在載入畫面上的文字。
+            future (Future): 背景工作，None 表示只在主執行緒執行 finalize。
+            finalize (callable): 主執行緒上的收尾，future 為 None 時不帶參數呼叫，否則傳入 future 的結果。
+        """
+        self._steps.append([label, future, finalize])
+
+    @property
+    def done(self):
+        return self._next >= len(self._steps)
+
+    @property
+    def progress(self):
+        if not self._steps:
+            return 1.0
+        return self._next / len(self._steps)
+
+    @property
+    def current_label(self):
+        if self.done:
+            return ""
+        return self._steps[self._next][0]
+
+    def poll(self, budget_ms=4.0):
+        """在 budget_ms 內盡量完成步驟。背景工作拋出的例外會在這裡重新拋出 (或交給 on_error)。"""
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        while not self.done:
+            label, future, finalize = self._steps[self._next]
+            if future is not None and not future.done():
+                return
+            try:
+                result = future.result() if future is not None else None
+                if finalize is not None:
+                    if future is None:
+                        finalize()
+                    else:
+                        finalize(result)
+            except Exception as error:
+                if self.on_error is None:
+                    raise
+                self.on_error(label, error)
+            self._steps[self._next] = [label, None, None]  # 不再參照 Future，解碼結果可以被回收
+            self._next += 1
+            if time.perf_counter() >= deadline:
+                return
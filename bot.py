@@ -0,0 +1,492 @@
+import heapq
+import math
+import time
+
+import numpy as np
+
+from inputs import INPUT_UP, INPUT_DOWN, INPUT_LEFT, INPUT_RIGHT, INPUT_REVIVE, INPUT_MOVE_MASK, mirror_bits
+from levels import player_goal
+
+_INF = float("inf")
+_SQRT2 = math.sqrt(2.0)
+_DIRECTIONS = ((-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0),
+               (-1, -1, _SQRT2), (-1, 1, _SQRT2), (1, -1, _SQRT2), (1, 1, _SQRT2))
+
+
+# --- 導航格 ---
+class NavGrid:
+    """
+    把關卡切成 cell_size 的格子，記錄某個大小的角色「中心點」能不能待在每一格。
+    牆壁依角色大小膨脹後蓋到的格子 (整格都算) 永遠不能走，所以中心點在可走的格子之間移動就不會碰到牆。
+    箱子、流星等會變動的障礙物放在各自的圖層，圖層改變時回傳通行狀態真的改變的格子。
+    地刺格子可以走但有額外成本，spike_ids 記錄每格會碰到哪些地刺，實際踏上去前再看地刺時間。
+    Args:
+        world_size (tuple): 世界寬高。
+        wall_array (np.ndarray): (M, 4) 的 left, top, right, bottom (見 CompiledLevel)。
+        spike_table (np.ndarray): (K, 7) 的地刺參數 (見 CompiledLevel)。
+        agent_size (tuple): 角色碰撞矩形的寬高。
+        cell_size (int): 格子邊長。
+        margin (float): 額外保留的距離，避免取整誤差讓角色擦到牆。
+    """
+
+    def __init__(self, world_size, wall_array, spike_table, agent_size, cell_size=20, margin=2.0):
+        self.cell_size = cell_size
+        self.cols = int(math.ceil(world_size[0] / cell_size))
+        self.rows = int(math.ceil(world_size[1] / cell_size))
+        self.margin = margin
+        self.half_w = agent_size[0] / 2 + margin
+        self.half_h = agent_size[1] / 2 + margin
+
+        # 角色中心會被夾在世界範圍內，超出範圍的格子到不了
+        edges_x = np.arange(self.cols + 1) * cell_size
+        edges_y = np.arange(self.rows + 1) * cell_size
+        inside_x = (edges_x[:-1] >= agent_size[0] / 2) & (edges_x[1:] <= world_size[0] - agent_size[0] / 2)
+        inside_y = (edges_y[:-1] >= agent_size[1] / 2) & (edges_y[1:] <= world_size[1] - agent_size[1] / 2)
+        self.static_blocked = ~(inside_y[:, None] & inside_x[None, :])
+        self.static_blocked |= self.cells_touching(wall_array)
+
+        # 地刺：成本 = 伸出時間的比例，並記錄每格碰到的地刺 (地刺不擋路，不另外保留距離)
+        self.spike_cost = np.zeros((self.rows, self.cols), dtype=np.float64)
+        self.spike_ids = {}
+        for k, (x, y, w, h, out_time, in_time, _) in enumerate(np.asarray(spike_table).reshape(-1, 7)):
+            mask = self.cells_touching(((x, y, x + w, y + h),), margin=0.0)
+            self.spike_cost[mask] += out_time / (out_time + in_time)
+            for cell in np.flatnonzero(mask).tolist():
+                self.spike_ids.setdefault(cell, []).append(k)
+
+        self.layers = {}
+        self.blocked = self.static_blocked.copy()
+
+        # 八個方向的鄰居 (與斜走時要檢查的兩個轉角格) 攤平成 list，規劃時不必每次算座標
+        index = np.full((self.rows + 2, self.cols + 2), -1, dtype=np.int64)
+        index[1:-1, 1:-1] = np.arange(self.rows * self.cols).reshape(self.rows, self.cols)
+        self.edges = []
+        for dr, dc, length in _DIRECTIONS:
+            neighbor = index[1 + dr:1 + dr + self.rows, 1 + dc:1 + dc + self.cols].ravel().tolist()
+            if dr and dc:
+                corner_a = index[1 + dr:1 + dr + self.rows, 1:1 + self.cols].ravel().tolist()
+                corner_b = index[1:1 + self.rows, 1 + dc:1 + dc + self.cols].ravel().tolist()
+            else:
+                corner_a = corner_b = neighbor
+            self.edges.append((length, neighbor, corner_a, corner_b))
+
+    def cells_touching(self, rects, margin=None):
+        """
+        角色中心在哪些格子時會碰到 rects 中的任何一個矩形。
+        Args:
+            rects: (left, top, right, bottom) 的序列。
+            margin (float): 額外保留的距離，None 時用建構時的 margin。
+        Returns:
+            np.ndarray: (rows, cols) 的布林陣列。
+        """
+        mask = np.zeros((self.rows, self.cols), dtype=bool)
+        cs = self.cell_size
+        half_w, half_h = self.half_w, self.half_h
+        if margin is not None:
+            half_w += margin - self.margin
+            half_h += margin - self.margin
+        for left, top, right, bottom in rects:
+            c0 = max(int(math.floor((left - half_w) / cs)), 0)
+            c1 = min(int(math.ceil((right + half_w) / cs)), self.cols)
+            r0 = max(int(math.floor((top - half_h) / cs)), 0)
+            r1 = min(int(math.ceil((bottom + half_h) / cs)), self.rows)
+            if c0 < c1 and r0 < r1:
+                mask[r0:r1, c0:c1] = True
+        return mask
+
+    def set_layer(self, name, rects):
+        """
+        更新一個動態障礙物圖層。
+        Returns:
+            np.ndarray: 通行狀態改變的格子 (攤平後的索引)。
+        """
+        self.layers[name] = self.cells_touching(rects)
+        blocked = self.static_blocked.copy()
+        for layer in self.layers.values():
+            blocked |= layer
+        changed = np.flatnonzero(blocked != self.blocked)
+        self.blocked = blocked
+        return changed
+
+    def clear_layers(self):
+        self.layers.clear()
+        changed = np.flatnonzero(self.blocked != self.static_blocked)
+        self.blocked = self.static_blocked.copy()
+        return changed
+
+    def cell_of(self, x, y):
+        col = min(max(int(x // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return row * self.cols + col
+
+    def center_of(self, cell):
+        row, col = divmod(cell, self.cols)
+        return (col + 0.5) * self.cell_size, (row + 0.5) * self.cell_size
+
+    def clamp_to_cell(self, cell, x, y, inset=2.0):
+        """cell 裡離 (x, y) 最近的點 (往內縮 inset)。"""
+        row, col = divmod(cell, self.cols)
+        cs = self.cell_size
+        return (min(max(x, col * cs + inset), (col + 1) * cs - inset),
+                min(max(y, row * cs + inset), (row + 1) * cs - inset))
+
+    def nearest_free(self, x, y):
+        """離 (x, y) 最近的可走格子，全部都不能走時回傳 None。"""
+        rows, cols = np.nonzero(~self.blocked)
+        if not len(rows):
+            return None
+        cs = self.cell_size
+        dist = ((cols + 0.5) * cs - x) ** 2 + ((rows + 0.5) * cs - y) ** 2
+        i = int(np.argmin(dist))
+        return int(rows[i]) * self.cols + int(cols[i])
+
+
+# --- 增量路徑規劃 ---
+class DStarLite:
+    """
+    在 NavGrid 上的 D* Lite：從目標往回搜尋，角色移動或障礙物改變時只修正受影響的格子，
+    不必整張圖重新搜尋。compute 可以在時間預算用完時中斷，下一幀從原本的佇列繼續。
+    佇列用延遲刪除：過時的項目在取出時才檢查並丟掉。
+    Args:
+        grid (NavGrid): 導航格。
+        spike_weight (float): 地刺格子的額外成本倍率。
+    """
+
+    def __init__(self, grid, spike_weight=4.0):
+        self.grid = grid
+        n = grid.rows * grid.cols
+        self._blocked = grid.blocked.ravel().tolist()
+        self._cost = (grid.cell_size * (1.0 + spike_weight * grid.spike_cost)).ravel().tolist()
+        self.g = [_INF] * n
+        self.rhs = [_INF] * n
+        self._heap = []
+        self.km = 0.0
+        self.start = None
+        self.goal = None
+        self._last = None
+        self.expanded = 0  # 累計展開的格子數
+
+    def _h(self, a, b):
+        ar, ac = divmod(a, self.grid.cols)
+        br, bc = divmod(b, self.grid.cols)
+        dr, dc = abs(ar - br), abs(ac - bc)
+        return (max(dr, dc) + (_SQRT2 - 1.0) * min(dr, dc)) * self.grid.cell_size
+
+    def _key(self, s):
+        m = min(self.g[s], self.rhs[s])
+        return m + self._h(self.start, s) + self.km, m
+
+    def _best_successor(self, u):
+        """回傳 (min(c(u, v) + g(v)), v)。"""
+        blocked, g, cost = self._blocked, self.g, self._cost
+        best, best_v = _INF, -1
+        for length, neighbor, corner_a, corner_b in self.grid.edges:
+            v = neighbor[u]
+            if v < 0 or blocked[v] or blocked[corner_a[u]] or blocked[corner_b[u]]:
+                continue
+            total = g[v] + length * cost[v]
+            if total < best:
+                best, best_v = total, v
+        return best, best_v
+
+    def _update_vertex(self, u):
+        if u != self.goal:
+            self.rhs[u] = self._best_successor(u)[0]
+        if self.g[u] != self.rhs[u]:
+            heapq.heappush(self._heap, (self._key(u), u))
+
+    def _update_neighbors(self, u):
+        for _, neighbor, _, _ in self.grid.edges:
+            v = neighbor[u]
+            if v >= 0:
+                self._update_vertex(v)
+
+    def reset(self, start, goal):
+        """換目標：清掉所有搜尋結果重新開始。"""
+        n = len(self.g)
+        self.g = [_INF] * n
+        self.rhs = [_INF] * n
+        self._heap = []
+        self.km = 0.0
+        self.start = self._last = start
+        self.goal = goal
+        self.rhs[goal] = 0.0
+        heapq.heappush(self._heap, (self._key(goal), goal))
+
+    def set_start(self, start):
+        """角色移動到新的格子。"""
+        if start != self.start:
+            self.km += self._h(self._last, start)
+            self._last = self.start = start
+
+    def update_cells(self, changed):
+        """通行狀態改變的格子：只重新計算它們與鄰居的 rhs。"""
+        blocked = self.grid.blocked.ravel()
+        for cell in changed.tolist():
+            self._blocked[cell] = bool(blocked[cell])
+        if self.goal is None:
+            return
+        for cell in changed.tolist():
+            self._update_vertex(cell)
+            self._update_neighbors(cell)
+
+    def compute(self, deadline):
+        """
+        搜尋到起點的最短路徑穩定為止，或到 deadline (perf_counter 秒) 為止。
+        Returns:
+            bool: 是否已經穩定。
+        """
+        g, rhs, heap = self.g, self.rhs, self._heap
+        start = self.start
+        count = 0
+        while heap:
+            k_old, u = heap[0]
+            if not (k_old < self._key(start) or rhs[start] != g[start]):
+                return True
+            heapq.heappop(heap)
+            if g[u] == rhs[u]:
+                continue  # 過時的項目
+            k_new = self._key(u)
+            if k_old < k_new:
+                heapq.heappush(heap, (k_new, u))
+                continue
+            if g[u] > rhs[u]:
+                g[u] = rhs[u]
+            else:
+                g[u] = _INF
+                self._update_vertex(u)
+            self._update_neighbors(u)
+            self.expanded += 1
+            count += 1
+            if count % 16 == 0 and time.perf_counter() >= deadline:
+                return False
+        return True
+
+    def next_cell(self, cell):
+        """從 cell 出發的下一格，沒有路時回傳 None。"""
+        cost, v = self._best_successor(cell)
+        return v if cost < _INF else None
+
+    def path(self, cell, limit):
+        """從 cell 沿著目前的最佳路徑最多走 limit 格 (包含 cell)。"""
+        cells = [cell]
+        while len(cells) <= limit and cell != self.goal:
+            cell = self.next_cell(cell)
+            if cell is None or cell in cells:
+                break
+            cells.append(cell)
+        return cells
+
+
+# --- 電腦隊友 ---
+BOT_MODE_IDLE = "idle"
+BOT_MODE_GOAL = "goal"
+BOT_MODE_REVIVE = "revive"
+BOT_MODE_BOX = "box"
+BOT_MODE_FOLLOW = "follow"
+
+
+class BotController:
+    """
+    控制其中一位玩家的電腦隊友，每個 tick 輸出與網路連線相同的 INPUT_* 位元。
+    優先順序：隊友死亡時過去復活 → 隊友在推箱子時過去一起推 → 走向自己的終點。
+    隊友所在的位置讓自己不可能同時待在終點時改為跟隨隊友；鎖鏈拉緊時不會再往外走，避免拖著隊友跑。
+    路徑用 D* Lite 在導航格上規劃，每幀只用 budget_ms；箱子移動或出現流星警告時只增量修正。
+    每種模式各自保留一個規劃器，在模式之間切換時不必從頭搜尋。
+    Args:
+        player_id (int): 控制的玩家 (0 或 1)。
+        speed (float): 角色移動速度 (像素/秒)，用來估計何時踩到地刺。
+        revive_radius (float): 可以復活隊友的距離。
+        push_radius (float): 可以推箱子的距離。
+        leash (float): 鎖鏈長度。
+        goal_size (int): 終點方塊的邊長，角色矩形碰到就算到達。
+        cell_size (int): 導航格邊長。
+        budget_ms (float): 每幀路徑規劃的時間預算。
+    """
+
+    SPIKE_SAFETY_TIME = 0.05  # 每格的時間窗前後再多留的秒數
+    SPIKE_SAMPLE_DT = 1.0 / 30
+    RETARGET_CELLS = 4  # 跟隨/推箱時目標移動超過幾格才重新規劃
+
+    def __init__(self, player_id, speed, revive_radius, push_radius, leash, goal_size, cell_size=20, budget_ms=1.0):
+        self.player_id = player_id
+        self.speed = speed
+        self.revive_radius = revive_radius
+        self.push_radius = push_radius
+        self.leash = leash
+        self.goal_size = goal_size
+        self.cell_size = cell_size
+        self.budget_ms = budget_ms
+        self.grid = None
+        self.planners = {}  # 模式 -> DStarLite
+        self.planner = None  # 目前模式的規劃器
+        self.mode = BOT_MODE_IDLE
+        self.converged = False
+        self.plan_ms = 0.0  # 每幀規劃時間 (指數移動平均)
+        self.replans = 0
+        self._layer_keys = {}
+
+    def attach(self, compiled, agent_size):
+        """換關時呼叫。導航格依角色大小快取在 compiled.render_cache 中。"""
+        key = ("nav_grid", self.cell_size, tuple(agent_size))
+        grid = compiled.render_cache.get(key)
+        if grid is None:
+            grid = NavGrid((compiled.world_width, compiled.world_height), compiled.wall_array,
+                           compiled.spike_table, agent_size, self.cell_size)
+            compiled.render_cache[key] = grid
+        grid.clear_layers()
+        self.grid = grid
+        self.planners = {}
+        self.planner = None
+        self.goal_pos = player_goal(compiled.source, self.player_id)
+        # 角色中心離終點中心在這個範圍內，兩個矩形就會重疊
+        self.goal_slack = ((self.goal_size + agent_size[0]) / 2 - 4, (self.goal_size + agent_size[1]) / 2 - 4)
+        self.mode = BOT_MODE_IDLE
+        self.converged = False
+        self._layer_keys = {}
+
+    def _update_layer(self, name, rects):
+        rects = [tuple(int(v) for v in rect) for rect in rects]
+        if self._layer_keys.get(name) == rects:
+            return
+        self._layer_keys[name] = rects
+        changed = self.grid.set_layer(name, rects)
+        if changed.size:
+            for planner in self.planners.values():
+                planner.update_cells(changed)
+
+    def _choose_target(self, me, partner, boxes):
+        """回傳 (模式, 目標座標, 到達距離)。"""
+        if not partner.is_alive:
+            if partner.death_pos is None:
+                return BOT_MODE_IDLE, None, 0.0
+            return BOT_MODE_REVIVE, partner.death_pos, self.revive_radius * 0.8
+        for box in boxes:
+            if partner.pos.distance_to(box.pos) < self.push_radius:
+                return BOT_MODE_BOX, box.pos, self.push_radius * 0.9
+        # 開始跟隨後要靠近到一半鎖鏈長度才停止跟隨，避免在兩種模式之間來回切換
+        follow_distance = self.leash * (0.5 if self.mode == BOT_MODE_FOLLOW else 0.7)
+        if partner.pos.distance_to(self.goal_pos) > self.leash and me.pos.distance_to(partner.pos) > follow_distance:
+            return BOT_MODE_FOLLOW, partner.pos, self.leash * 0.5
+        # 終點範圍內離隊友最近的一點，鎖鏈比較不會拉緊
+        gx, gy = self.goal_pos
+        sx, sy = self.goal_slack
+        return BOT_MODE_GOAL, (min(max(partner.pos.x, gx - sx), gx + sx), min(max(partner.pos.y, gy - sy), gy + sy)), 0.0
+
+    @property
+    def expanded(self):
+        return sum(planner.expanded for planner in self.planners.values())
+
+    def _retarget(self, mode, target, start):
+        """切換到 mode 的規劃器；目標移動超過 RETARGET_CELLS 格 (或換了地方) 才重新搜尋。"""
+        goal = self.grid.cell_of(target[0], target[1])
+        if self.grid.blocked.flat[goal]:
+            goal = self.grid.nearest_free(target[0], target[1])
+        if goal is None:
+            return False
+        planner = self.planners.get(mode)
+        if planner is None:
+            planner = self.planners[mode] = DStarLite(self.grid)
+        self.planner = planner
+        self.mode = mode
+        if planner.goal is not None and planner._h(goal, planner.goal) < self.RETARGET_CELLS * self.cell_size:
+            return True
+        planner.reset(start, goal)
+        self.converged = False
+        self.replans += 1
+        return True
+
+    def _spikes_clear(self, cell, spike_scheduler, level_time):
+        """
+        沿著路徑走過前面連續的地刺格子時，每一格的地刺在角色待在那一格的期間是否都縮著。
+        每格只檢查自己的時間窗 (進入到離開這一格)，不要求整段路上所有地刺同時縮著。
+        """
+        path = self.planner.path(cell, 16)
+        distance = 0.0
+        for i in range(1, len(path)):
+            cell_ids = self.grid.spike_ids.get(path[i])
+            if not cell_ids:
+                break
+            step = self.planner._h(path[i - 1], path[i])
+            after = self.planner._h(path[i], path[i + 1]) if i + 1 < len(path) else self.cell_size
+            # 兩格中心連線的中點就是格子邊界
+            enter = level_time + (distance + step / 2) / self.speed - self.SPIKE_SAFETY_TIME
+            leave = level_time + (distance + step + after / 2) / self.speed + self.SPIKE_SAFETY_TIME
+            times = np.arange(max(enter, level_time), leave, self.SPIKE_SAMPLE_DT)
+            if spike_scheduler.states_at(times[:, None])[:, cell_ids].any():
+                return False
+            distance += step
+        return True
+
+    def think(self, me, partner, partner_bits, boxes, hazard_rects, spike_scheduler, level_time, mirror=False):
+        """
+        算出這個 tick 的輸入。
+        Args:
+            me, partner (Player): 控制的玩家與隊友。
+            partner_bits (int): 隊友這個 tick 的 INPUT_* 位元 (推箱時跟著同方向推)。
+            boxes: 箱子 (有 pos 與 rect)。
+            hazard_rects: 流星警告與流星的 (left, top, right, bottom)。
+            spike_scheduler (SpikeScheduler): 用來預測地刺狀態。
+            level_time (float): 目前的關卡時間。
+            mirror (bool): 自己是否在鏡像效果中 (輸入要先反過來)。
+        Returns:
+            int: INPUT_* 位元。
+        """
+        if self.grid is None or not me.is_alive:
+            return 0
+        started = time.perf_counter()
+        bits = self._think(me, partner, partner_bits, boxes, hazard_rects, spike_scheduler, level_time, mirror)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        self.plan_ms += (elapsed - self.plan_ms) * 0.05
+        return bits
+
+    def _think(self, me, partner, partner_bits, boxes, hazard_rects, spike_scheduler, level_time, mirror):
+        self._update_layer("boxes", [(box.rect.left, box.rect.top, box.rect.right, box.rect.bottom) for box in boxes])
+        self._update_layer("hazards", hazard_rects)
+
+        mode, target, arrive = self._choose_target(me, partner, boxes)
+        if target is None:
+            self.mode = mode
+            return 0
+        if arrive and me.pos.distance_to(target) <= arrive:
+            self.mode = mode
+            if mode == BOT_MODE_REVIVE:
+                return INPUT_REVIVE
+            if mode == BOT_MODE_BOX:
+                # 推箱方向看的是按鍵本身 (不受鏡像影響)，直接按和隊友一樣的方向
+                return partner_bits & INPUT_MOVE_MASK
+            return 0
+
+        start = self.grid.cell_of(me.pos.x, me.pos.y)
+        if not self._retarget(mode, target, start):
+            return 0
+        self.planner.set_start(start)
+        self.converged = self.planner.compute(time.perf_counter() + self.budget_ms / 1000.0)
+        if start == self.planner.goal:
+            # 已經在目標格：走向格子裡離目標點最近的位置 (整格都可以走)
+            cx, cy = self.grid.clamp_to_cell(start, target[0], target[1])
+        else:
+            next_cell = self.planner.next_cell(start)
+            if next_cell is None:
+                return 0
+            if self.grid.spike_ids.get(next_cell) and not self.grid.spike_ids.get(start) and \
+                    not self._spikes_clear(start, spike_scheduler, level_time):
+                return 0  # 在地刺外面等它縮回去
+            cx, cy = self.grid.center_of(next_cell)
+
+        dx, dy = cx - me.pos.x, cy - me.pos.y
+        bits = 0
+        if dx > 1.5:
+            bits |= INPUT_RIGHT
+        elif dx < -1.5:
+            bits |= INPUT_LEFT
+        if dy > 1.5:
+            bits |= INPUT_DOWN
+        elif dy < -1.5:
+            bits |= INPUT_UP
+        if bits and mode != BOT_MODE_FOLLOW and partner.is_alive and \
+                me.pos.distance_to(partner.pos) >= self.leash - 2 and \
+                (cx - me.pos.x) * (me.pos.x - partner.pos.x) + (cy - me.pos.y) * (me.pos.y - partner.pos.y) > 0:
+            return 0  # 鎖鏈已經拉緊，再往外走會拖動隊友
+        # 鏡像效果中按上會往下走，所以想往下走就要按上
+        return mirror_bits(bits) if mirror else bits
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+# --- 多人鎖鏈 ---
+class ChainGraph:
+    """
+    玩家之間的鎖鏈 (任意圖)：每條鎖鏈連接兩位玩家，有自己的最大長度。
+    約束對所有鎖鏈一次向量化求解 (Jacobi)，每次迭代的成本與鎖鏈數成正比：
+    超過長度的鎖鏈把兩端拉近，兩端都活著時各移動一半，一端是屍體時屍體不動、活著的一方移動全部的距離。
+    只有一條鎖鏈時結果與逐條計算完全相同 (同樣的浮點運算順序)。
+    Args:
+        player_count (int): 玩家數。
+        links (sequence): 每條鎖鏈連接的兩位玩家 [(a, b), ...]。
+        lengths (float or sequence): 每條鎖鏈的最大長度 (一個數字表示全部相同)。
+    """
+
+    def __init__(self, player_count, links, lengths):
+        links = np.asarray(links, dtype=np.intp).reshape(-1, 2)
+        if links.size and (links.min() < 0 or links.max() >= player_count):
+            raise ValueError(f"鎖鏈連接到不存在的玩家: {links.tolist()}")
+        if np.any(links[:, 0] == links[:, 1]):
+            raise ValueError("鎖鏈不能連接玩家自己")
+        self.player_count = player_count
+        self.first = links[:, 0].copy()
+        self.second = links[:, 1].copy()
+        self.lengths = np.broadcast_to(np.asarray(lengths, dtype=np.float64), (len(links),)).copy()
+        self.links = list(zip(self.first.tolist(), self.second.tolist()))  # [(a, b)]，繪圖與查詢用
+
+    def __len__(self):
+        return len(self.first)
+
+    def neighbours(self, player_id):
+        """與 player_id 直接相連的玩家 (依鎖鏈順序)。"""
+        return [b if a == player_id else a for a, b in self.links if player_id in (a, b)]
+
+    def solve(self, positions, alive, corpses, half_sizes, world_size, iterations):
+        """
+        就地修正活著的玩家位置，使每條鎖鏈都不超過最大長度，並限制在世界範圍內。
+        Args:
+            positions (np.ndarray): (N, 2) 玩家位置，會被修改。
+            alive (np.ndarray): (N,) 是否活著。
+            corpses (np.ndarray): (N, 2) 屍體位置，沒有屍體 (或還活著) 的玩家是 NaN。
+            half_sizes (np.ndarray): (N, 2) 玩家碰撞框的半寬、半高 (邊界限制用)。
+            world_size (tuple): 世界寬高。
+            iterations (int): 迭代次數。
+        Returns:
+            np.ndarray: (N,) 位置被鎖鏈修正過的玩家。
+        """
+        count = self.player_count
+        moved = np.zeros(count, dtype=bool)
+        if not len(self):
+            return moved
+        alive_first = alive[self.first]
+        alive_second = alive[self.second]
+        both = alive_first & alive_second
+        # 每一端分到的修正比例：兩端都活著各一半，對方是屍體時全部，自己是屍體時不動
+        share_first = np.where(both, 0.5, alive_first.astype(np.float64))
+        share_second = np.where(both, 0.5, alive_second.astype(np.float64))
+        low = half_sizes
+        high = np.asarray(world_size, dtype=np.float64) - half_sizes
+        pullable = alive_first | alive_second
+        for _ in range(iterations):
+            ends = np.where(alive[:, None], positions, corpses)
+            delta = ends[self.second] - ends[self.first]
+            distance = np.sqrt(delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1])
+            stretched = np.flatnonzero((distance > self.lengths) & pullable)  # 沒有屍體的一端是 NaN，比較為 False
+            if not stretched.size:
+                break
+            distance = distance[stretched]
+            diff = (distance - self.lengths[stretched]) / distance
+            delta = delta[stretched]
+            first = self.first[stretched]
+            second = self.second[stretched]
+            pull_first = delta * share_first[stretched, None] * diff[:, None]
+            pull_second = delta * share_second[stretched, None] * diff[:, None]
+            shift = np.empty((count, 2))
+            for axis in range(2):
+                shift[:, axis] = (np.bincount(first, pull_first[:, axis], count) -
+                                  np.bincount(second, pull_second[:, axis], count))
+            touched = np.zeros(count, dtype=bool)
+            touched[first] = True
+            touched[second] = True
+            touched &= alive
+            positions[touched] = np.maximum(low[touched], np.minimum(positions[touched] + shift[touched],
+                                                                     high[touched]))
+            moved |= touched
+        return moved
@@ -0,0 +1,86 @@
+import time
+
+
+# --- 每幀時間預算 ---
+class FrameBudget:
+    """
+    量測每幀更新 (update) 與繪製 (render) 的時間，連續超出預算時降低一級畫質，
+    長時間有餘裕時再回升一級。只決定畫質等級，實際要調整哪些工作由呼叫端依等級設定。
+    clock.tick 的等待時間不算在內，所以量到的是真正的工作量。
+    Args:
+        budget_ms (float): 每幀工作時間的預算。
+        level_count (int): 畫質等級數，第 0 級最高。
+        smoothing (float): 指數移動平均的權重。
+        headroom (float): 平均低於 budget_ms * headroom 才算有餘裕。
+        down_frames (int): 連續超出預算多少幀才降級。
+        up_frames (int): 連續有餘裕多少幀才升級 (比降級慢，避免來回切換)。
+    """
+
+    def __init__(self, budget_ms, level_count, smoothing=0.1, headroom=0.6, down_frames=15, up_frames=180):
+        self.budget_ms = budget_ms
+        self.level_count = level_count
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.down_frames = down_frames
+        self.up_frames = up_frames
+        self.level = 0
+        self.update_ms = 0.0  # 指數移動平均
+        self.render_ms = 0.0
+        self.level_changes = 0
+        self._over = 0
+        self._under = 0
+        self._frame_start = None
+        self._render_start = None
+
+    @property
+    def work_ms(self):
+        return self.update_ms + self.render_ms
+
+    def begin_update(self):
+        """clock.tick 之後呼叫。"""
+        self._frame_start = time.perf_counter()
+
+    def begin_render(self):
+        self._render_start = time.perf_counter()
+
+    def end_frame(self):
+        """
+        display.flip 之後呼叫。
+        Returns:
+            bool: 畫質等級是否改變。
+        """
+        now = time.perf_counter()
+        if self._frame_start is None or self._render_start is None:
+            return False
+        update_ms = (self._render_start - self._frame_start) * 1000.0
+        render_ms = (now - self._render_start) * 1000.0
+        self._frame_start = self._render_start = None
+        self.update_ms += (update_ms - self.update_ms) * self.smoothing
+        self.render_ms += (render_ms - self.render_ms) * self.smoothing
+
+        if self.work_ms > self.budget_ms:
+            self._over += 1
+            self._under = 0
+        elif self.work_ms < self.budget_ms * self.headroom:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.down_frames and self.level < self.level_count - 1:
+            return self._set_level(self.level + 1)
+        if self._under >= self.up_frames and self.level > 0:
+            return self._set_level(self.level - 1)
+        return False
+
+    def _set_level(self, level):
+        self.level = level
+        self.level_changes += 1
+        self._over = self._under = 0
+        return True
+
+    def reset(self):
+        """載入關卡等一次性的大量工作之後重新開始量測 (保留目前等級)，不讓載入的尖峰影響畫質。"""
+        self.update_ms = self.render_ms = 0.0
+        self._over = self._under = 0
+        self._frame_start = self._render_start = None
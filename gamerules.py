@@ -0,0 +1,22 @@
+# --- 遊戲規則參數 ---
+# main.py 與離線工具 (levelcheck、levelgen、telemetry) 共用的常數。
+# main.py 一匯入就會開視窗執行遊戲，所以這些數值放在這個不依賴 pygame 的小模組，兩邊都從這裡匯入。
+SCREEN_WIDTH = 1080
+SCREEN_HEIGHT = 720
+FPS = 60
+
+# 玩家參數
+PLAYER_RADIUS = 15
+PLAYER_SPEED = 3  # 每幀移動的像素
+CHAIN_MAX_LENGTH = 400
+KNIGHT_FRAME_SIZE = PLAYER_RADIUS * 8
+WITCH_FRAME_SIZE = PLAYER_RADIUS * 4
+PLAYER_SIZES = ((KNIGHT_FRAME_SIZE, KNIGHT_FRAME_SIZE), (WITCH_FRAME_SIZE, WITCH_FRAME_SIZE))  # 騎士、女巫的碰撞矩形
+
+# 協力推箱子
+COOP_BOX_SIZE = 40
+COOP_BOX_PUSH_RADIUS = 60
+
+# 終點與果實
+GOAL_SIZE = int(PLAYER_RADIUS * 2.5)
+FRUIT_RADIUS = 15
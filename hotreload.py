@@ -0,0 +1,73 @@
+import os
+import queue
+import threading
+
+
+# --- 檔案監看 (熱重載) ---
+class FileWatcher:
+    """
+    在背景執行緒定期比對檔案的修改時間與大小 (只用 os.scandir / os.stat，不需要額外套件)，
+    有變化的路徑放進佇列，主迴圈每幀用 changes() 取出。檔案要連續兩次檢查都沒有再改變才回報，
+    避免讀到編輯器還沒寫完的檔案。被刪除的檔案也會回報 (呼叫端自行檢查是否存在)。
+    Args:
+        paths (iterable): 要監看的檔案或資料夾 (資料夾只看第一層中符合 suffixes 的檔案)。
+        suffixes (tuple): 資料夾中要監看的副檔名。
+        interval (float): 檢查間隔 (秒)。
+    """
+
+    def __init__(self, paths, suffixes=(".png", ".json"), interval=0.25):
+        self.paths = [os.path.normpath(path) for path in paths]
+        self.suffixes = tuple(suffixes)
+        self.interval = interval
+        self._changes = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _scan(self):
+        signatures = {}  # 正規化路徑 -> (mtime_ns, size)
+        for path in self.paths:
+            try:
+                if os.path.isdir(path):
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if entry.name.endswith(self.suffixes) and entry.is_file():
+                                stat = entry.stat()
+                                signatures[os.path.normpath(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+                else:
+                    stat = os.stat(path)
+                    signatures[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue  # 檔案或資料夾暫時不存在 (例如編輯器先刪除再寫入)
+        return signatures
+
+    def _run(self):
+        previous = self._scan()
+        pending = set()  # 上一次檢查時有變化、等待確認寫完的路徑
+        while not self._stop.wait(self.interval):
+            current = self._scan()
+            changed = {path for path in current.keys() | previous.keys() if current.get(path) != previous.get(path)}
+            for path in pending - changed:
+                self._changes.put(path)
+            pending = changed
+            previous = current
+
+    def changes(self):
+        """取出目前累積的變更路徑 (不重複，依發生順序)。"""
+        paths = []
+        while True:
+            try:
+                path = self._changes.get_nowait()
+            except queue.Empty:
+                return paths
+            if path not in paths:
+                paths.append(path)
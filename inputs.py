@@ -0,0 +1,203 @@
+import pygame
+
+# --- 輸入位元 ---
+INPUT_UP = 1
+INPUT_DOWN = 2
+INPUT_LEFT = 4
+INPUT_RIGHT = 8
+INPUT_REVIVE = 16
+INPUT_MOVE_MASK = INPUT_UP | INPUT_DOWN | INPUT_LEFT | INPUT_RIGHT
+
+
+def input_bits_from_keys(keys, control_keys, revive_key):
+    """
+    把鍵盤狀態轉成一個位元組的輸入。
+    Args:
+        keys: pygame.key.get_pressed() 的結果 (或任何支援 keys[key] 的物件)。
+        control_keys (dict): {'up', 'down', 'left', 'right'} 對應的按鍵。
+        revive_key (int): 復活鍵。
+    Returns:
+        int: INPUT_* 位元的組合。
+    """
+    bits = 0
+    if keys[control_keys['up']]:
+        bits |= INPUT_UP
+    if keys[control_keys['down']]:
+        bits |= INPUT_DOWN
+    if keys[control_keys['left']]:
+        bits |= INPUT_LEFT
+    if keys[control_keys['right']]:
+        bits |= INPUT_RIGHT
+    if keys[revive_key]:
+        bits |= INPUT_REVIVE
+    return bits
+
+
+def mirror_bits(bits):
+    """上下、左右對調 (鏡像效果)，其他位元不變。"""
+    return ((bits & ~INPUT_MOVE_MASK) |
+            ((bits & INPUT_UP) << 1) | ((bits & INPUT_DOWN) >> 1) |
+            ((bits & INPUT_LEFT) << 1) | ((bits & INPUT_RIGHT) >> 1))
+
+
+def _axis(bits, negative, positive):
+    return (1 if bits & positive else 0) - (1 if bits & negative else 0)
+
+
+# --- 每個 tick 的輸入 ---
+class InputFrame:
+    """
+    一個 tick 所有玩家的輸入，建立後不能修改。模擬只讀這個物件，不直接讀鍵盤，
+    所以輸入可以來自鍵盤、手把、網路或電腦隊友，也可以用 pack 存下來重播。
+    Args:
+        bits (sequence): 每位玩家的原始 INPUT_* 位元 (推箱方向、面向都看原始輸入)。
+        moves (sequence): 每位玩家實際的移動方向 (套用鏡像之後)，None 表示與 bits 相同。
+        rewind (bool): 是否按住倒轉 (只在本機使用，不影響模擬)。
+    """
+
+    __slots__ = ("bits", "moves", "rewind")
+
+    def __init__(self, bits, moves=None, rewind=False):
+        object.__setattr__(self, "bits", tuple(bits))
+        object.__setattr__(self, "moves", self.bits if moves is None else tuple(moves))
+        object.__setattr__(self, "rewind", bool(rewind))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("InputFrame 建立後不能修改")
+
+    def __eq__(self, other):
+        return isinstance(other, InputFrame) and (self.bits, self.moves, self.rewind) == \
+            (other.bits, other.moves, other.rewind)
+
+    def __hash__(self):
+        return hash((self.bits, self.moves, self.rewind))
+
+    def __repr__(self):
+        return f"InputFrame(bits={self.bits}, moves={self.moves}, rewind={self.rewind})"
+
+    def with_mirror(self, mirrored):
+        """
+        套用鏡像效果 (每個 tick 只做一次)。
+        Args:
+            mirrored (sequence): 每位玩家是否在鏡像效果中。
+        """
+        moves = tuple(mirror_bits(bits) if flip else bits for bits, flip in zip(self.bits, mirrored))
+        return InputFrame(self.bits, moves, self.rewind)
+
+    def with_player(self, player_id, bits):
+        """把其中一位玩家的輸入換成 bits (例如由電腦隊友決定)。"""
+        new_bits = list(self.bits)
+        new_bits[player_id] = bits
+        return InputFrame(new_bits, rewind=self.rewind)
+
+    def combined(self):
+        """所有玩家輸入的聯集 (連線時本機玩家用哪一組按鍵或手把都可以)。"""
+        result = 0
+        for bits in self.bits:
+            result |= bits
+        return result
+
+    def move(self, player_id):
+        """套用鏡像後的移動方向 (dx, dy)，同時按住兩個相反方向時與鍵盤一樣以下、右為準。"""
+        bits = self.moves[player_id]
+        return (1 if bits & INPUT_RIGHT else (-1 if bits & INPUT_LEFT else 0),
+                1 if bits & INPUT_DOWN else (-1 if bits & INPUT_UP else 0))
+
+    def direction(self, player_id):
+        """原始輸入的方向 (dx, dy)，相反方向互相抵消。"""
+        bits = self.bits[player_id]
+        return _axis(bits, INPUT_LEFT, INPUT_RIGHT), _axis(bits, INPUT_UP, INPUT_DOWN)
+
+    def revive(self, player_id):
+        return bool(self.bits[player_id] & INPUT_REVIVE)
+
+    def pack(self):
+        """每位玩家一個位元組，最後一個位元組是倒轉旗標 (錄製輸入用，鏡像屬於模擬狀態不必存)。"""
+        return bytes(self.bits) + bytes((int(self.rewind),))
+
+    @classmethod
+    def unpack(cls, data):
+        return cls(data[:-1], rewind=bool(data[-1]))
+
+
+NO_INPUT = InputFrame((0, 0))
+
+
+# --- 鍵盤與手把 ---
+class InputDevices:
+    """
+    每個 tick 讀一次鍵盤與手把，轉成 InputFrame。
+    第 i 個連上的手把控制玩家 i：左類比搖桿或十字鍵移動，A 鍵 (按鈕 0) 復活；手把與鍵盤可以同時使用。
+    Args:
+        control_keys_by_player (list): 每位玩家的方向鍵設定，None 表示這位玩家只用手把。
+        revive_keys (list): 每位玩家的復活鍵 (只用手把的玩家為 None)。
+        rewind_key (int): 倒轉鍵，None 表示不使用。
+        deadzone (float): 類比搖桿超過這個值才算按下。
+        key_state (callable): 回傳鍵盤狀態的函式，None 表示 pygame.key.get_pressed (合成輸入時替換)。
+    """
+
+    def __init__(self, control_keys_by_player, revive_keys, rewind_key=None, deadzone=0.5, key_state=None):
+        self.control_keys_by_player = list(control_keys_by_player)
+        self.revive_keys = list(revive_keys)
+        self.rewind_key = rewind_key
+        self.deadzone = deadzone
+        self.key_state = key_state
+        self._game_keys = {key for control_keys in self.control_keys_by_player if control_keys
+                           for key in control_keys.values()}
+        self._game_keys.update(key for key in self.revive_keys if key is not None)
+        self._joysticks = {}  # instance_id -> Joystick，依連接順序
+        pygame.joystick.init()
+        for index in range(pygame.joystick.get_count()):
+            self._add_joystick(index)
+
+    def _add_joystick(self, device_index):
+        joystick = pygame.joystick.Joystick(device_index)
+        self._joysticks.setdefault(joystick.get_instance_id(), joystick)
+
+    @property
+    def gamepad_count(self):
+        return len(self._joysticks)
+
+    def handle_event(self, event):
+        """處理手把插拔事件 (在主迴圈的事件處理中呼叫)。"""
+        if event.type == pygame.JOYDEVICEADDED:
+            self._add_joystick(event.device_index)
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            self._joysticks.pop(event.instance_id, None)
+
+    def is_game_event(self, event):
+        """事件是否會改變遊戲輸入 (方向、復活；類比搖桿只算超過死區的)。"""
+        if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+            return event.key in self._game_keys
+        if event.type in (pygame.JOYHATMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP):
+            return True
+        return event.type == pygame.JOYAXISMOTION and event.axis < 2 and abs(event.value) > self.deadzone
+
+    def _gamepad_bits(self, joystick):
+        bits = 0
+        x = joystick.get_axis(0) if joystick.get_numaxes() > 0 else 0.0
+        y = joystick.get_axis(1) if joystick.get_numaxes() > 1 else 0.0
+        if joystick.get_numhats() > 0:
+            hat_x, hat_y = joystick.get_hat(0)
+            x = hat_x or x
+            y = -hat_y or y  # 十字鍵的 y 向上為正
+        if y < -self.deadzone:
+            bits |= INPUT_UP
+        elif y > self.deadzone:
+            bits |= INPUT_DOWN
+        if x < -self.deadzone:
+            bits |= INPUT_LEFT
+        elif x > self.deadzone:
+            bits |= INPUT_RIGHT
+        if joystick.get_numbuttons() > 0 and joystick.get_button(0):
+            bits |= INPUT_REVIVE
+        return bits
+
+    def poll(self):
+        """讀取這個 tick 的輸入。"""
+        keys = self.key_state() if self.key_state is not None else pygame.key.get_pressed()
+        bits = [input_bits_from_keys(keys, control_keys, revive_key) if control_keys else 0
+                for control_keys, revive_key in zip(self.control_keys_by_player, self.revive_keys)]
+        for player_id, joystick in enumerate(list(self._joysticks.values())[:len(bits)]):
+            bits[player_id] |= self._gamepad_bits(joystick)
+        return InputFrame(bits, rewind=self.rewind_key is not None and keys[self.rewind_key])
@@ -0,0 +1,132 @@
+import random
+import time
+from collections import deque
+
+import numpy as np
+import pygame
+
+
+# --- 輸入到畫面的延遲 ---
+class LatencyTracker:
+    """
+    量測每個輸入事件從 pygame.event.get() 取出，到消耗它的 tick 之後第一次 display.flip 的時間。
+    一般事件沒有時間戳記，以取出的時間為準；合成事件帶有 time 屬性 (送出的時間)，所以會包含在佇列中等待的時間。
+    沒有被模擬消耗的事件 (倒轉、載入中、選單) 在那一幀結束時丟掉，不列入統計。
+    Args:
+        event_filter (callable): 判斷事件是否為遊戲輸入，例如 InputDevices.is_game_event。
+        max_samples (int): 最多保留的樣本數。
+    """
+
+    def __init__(self, event_filter, max_samples=100000):
+        self.event_filter = event_filter
+        self._pending = []  # 還沒被模擬的輸入時間
+        self._simulated = []  # (輸入時間, 模擬時間)，等待 flip
+        self._total_ms = deque(maxlen=max_samples)
+        self._queue_ms = deque(maxlen=max_samples)  # 輸入到模擬開始
+        self.dropped = 0
+
+    @property
+    def count(self):
+        return len(self._total_ms)
+
+    def received(self, events):
+        """記下這一幀取出的遊戲輸入事件。"""
+        now = time.perf_counter()
+        for event in events:
+            if self.event_filter(event):
+                self._pending.append(getattr(event, "time", now))
+
+    def simulated(self):
+        """這一幀的模擬已經消耗了目前所有的輸入 (在 simulate_tick 或連線的 step 之前呼叫)。"""
+        if self._pending:
+            now = time.perf_counter()
+            self._simulated.extend((received_at, now) for received_at in self._pending)
+            self._pending.clear()
+
+    def presented(self):
+        """display.flip 之後呼叫。"""
+        now = time.perf_counter()
+        for received_at, simulated_at in self._simulated:
+            self._total_ms.append((now - received_at) * 1000.0)
+            self._queue_ms.append((simulated_at - received_at) * 1000.0)
+        self._simulated.clear()
+        self.dropped += len(self._pending)
+        self._pending.clear()
+
+    def summary(self):
+        """
+        Returns:
+            dict: count, dropped, p50/p95/p99/max (輸入到畫面，毫秒) 與 queue_p50 (輸入到模擬)；沒有樣本時只有 count、dropped。
+        """
+        result = {"count": self.count, "dropped": self.dropped}
+        if self._total_ms:
+            total = np.fromiter(self._total_ms, dtype=np.float64)
+            p50, p95, p99 = np.percentile(total, (50, 95, 99))
+            result.update(p50=p50, p95=p95, p99=p99, max=total.max(),
+                          queue_p50=float(np.percentile(np.fromiter(self._queue_ms, dtype=np.float64), 50)))
+        return result
+
+    def report(self):
+        stats = self.summary()
+        if stats["count"] == 0:
+            return f"輸入延遲：沒有樣本 (丟棄 {stats['dropped']})"
+        return (f"輸入延遲 ({stats['count']} 個輸入，丟棄 {stats['dropped']})："
+                f"p50 {stats['p50']:.1f}ms  p95 {stats['p95']:.1f}ms  p99 {stats['p99']:.1f}ms  "
+                f"max {stats['max']:.1f}ms  (輸入到模擬 p50 {stats['queue_p50']:.1f}ms)")
+
+
+class _OverlayKeys:
+    """真正的鍵盤狀態再加上合成的按鍵，介面與 pygame.key.get_pressed() 相同。"""
+
+    def __init__(self, keys, held):
+        self._keys = keys
+        self._held = held
+
+    def __getitem__(self, key):
+        return key in self._held or self._keys[key]
+
+
+# --- 合成輸入 ---
+class ScriptedInput:
+    """
+    固定亂數種子的合成輸入，讓延遲量測不需要鍵盤 (SDL_VIDEODRIVER=dummy) 也能執行。
+    每隔幾幀隨機按下或放開一個按鍵，用 pygame.event.post 送出帶有 time 屬性的 KEYDOWN/KEYUP；
+    事件被 pygame.event.get() 取出時才更新按住的按鍵 (與 SDL 更新鍵盤狀態的時機相同)。
+    物件本身可以當成 InputDevices 的 key_state。
+    Args:
+        keys (list): 會被按下的按鍵。
+        seed (int): 亂數種子。
+        interval (tuple): 兩次按鍵變化之間的幀數範圍。
+    """
+
+    def __init__(self, keys, seed=0, interval=(3, 12)):
+        self.keys = list(keys)
+        self.interval = interval
+        self._random = random.Random(seed)
+        self._down = set()  # 已經送出 KEYDOWN 的按鍵
+        self._held = set()  # 事件已經被取出、視為按住的按鍵
+        self._countdown = 0
+        self.events_posted = 0
+
+    def update(self):
+        """每幀呼叫一次 (在 display.flip 之後，事件會在下一幀的 pygame.event.get() 取出)。"""
+        self._countdown -= 1
+        if self._countdown > 0:
+            return
+        self._countdown = self._random.randint(*self.interval)
+        key = self._random.choice(self.keys)
+        event_type = pygame.KEYUP if key in self._down else pygame.KEYDOWN
+        self._down.symmetric_difference_update((key,))
+        pygame.event.post(pygame.event.Event(event_type, key=key, mod=0, unicode="", scancode=0,
+                                             time=time.perf_counter(), scripted=True))
+        self.events_posted += 1
+
+    def handle_event(self, event):
+        if getattr(event, "scripted", False):
+            if event.type == pygame.KEYDOWN:
+                self._held.add(event.key)
+            else:
+                self._held.discard(event.key)
+
+    def __call__(self):
+        return _OverlayKeys(pygame.key.get_pressed(), self._held)
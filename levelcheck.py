@@ -0,0 +1,431 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # 每個工作行程都會匯入 pygame
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from bot import NavGrid
+from gamerules import (SCREEN_WIDTH, SCREEN_HEIGHT, FPS, PLAYER_SPEED, PLAYER_SIZES, CHAIN_MAX_LENGTH, COOP_BOX_SIZE,
+                       COOP_BOX_PUSH_RADIUS, GOAL_SIZE, FRUIT_RADIUS)
+from levels import LEVELS_DIR, compile_level, list_level_files, load_level_file
+from spikes import SpikeScheduler
+
+CHECK_CELL_SIZE = 20  # 搜尋用的格子邊長 (與電腦隊友的導航格相同)
+CHECK_HORIZON = 180.0  # 最多模擬幾秒的關卡時間
+CHECK_MAX_WORDS = 1_000_000  # 狀態陣列 (uint64) 超過這個大小時自動加大格子 (大地圖)
+
+_MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+_ALL_BITS = np.uint64(0xFFFFFFFFFFFFFFFF)
+_NO_BITS = np.uint64(0)
+
+
+def _span(shift, size):
+    return slice(max(shift, 0), size + min(shift, 0))
+
+
+# --- 單一玩家的格子 ---
+class _Walker:
+    """
+    一位玩家在搜尋格上的資料 (整個世界)。格子判斷牆壁時比較保守 (整格都碰不到牆才能站)，
+    所以判斷目標、果實、鎖鏈、推箱子時反過來用格子範圍內最有利的位置 (玩家可以在格子裡微調)。
+    Args:
+        compiled (CompiledLevel): 編譯後的關卡。
+        agent_size (tuple): 玩家碰撞矩形的寬高。
+        start (tuple): 起點。
+        cell_size (int): 格子邊長。
+        box_rects (list): 當作固定障礙物的箱子 (left, top, right, bottom)。
+    """
+
+    def __init__(self, compiled, agent_size, start, cell_size, box_rects):
+        grid = NavGrid((compiled.world_width, compiled.world_height), compiled.wall_array,
+                       compiled.spike_table, agent_size, cell_size)
+        if box_rects:
+            grid.set_layer("boxes", box_rects)
+        self.agent_size = agent_size
+        self.cell_size = cell_size
+        # 格子判斷牆壁比較保守，貼著牆的起點所在的格子可能算不能站，改從最近的可以站的格子出發 (與電腦隊友相同)
+        start_cell = grid.nearest_free(*start)
+        self.free = ~grid.blocked
+        if start_cell is None:
+            start_cell = grid.cell_of(*start)
+            self.free[divmod(start_cell, grid.cols)] = True  # 整張圖都不能站時至少留下起點
+        self.start = divmod(start_cell, grid.cols)
+        height, width = self.shape = self.free.shape
+        rows, cols = np.nonzero(self.free)
+        self.crop = (slice(int(rows.min()), int(rows.max()) + 1), slice(int(cols.min()), int(cols.max()) + 1))
+        self.center_y = (np.arange(height) + 0.5) * cell_size
+        self.center_x = (np.arange(width) + 0.5) * cell_size
+
+        # 每個方向可以出發的格子：目標格可以站，斜走時兩個轉角格也要可以站 (與 NavGrid 的規劃相同)
+        padded = np.zeros((height + 2, width + 2), dtype=bool)
+        padded[1:-1, 1:-1] = self.free
+        self.moves = []
+        for dr, dc in _MOVES:
+            allowed = padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width].copy()
+            if dr and dc:
+                allowed &= padded[1 + dr:1 + dr + height, 1:1 + width]
+                allowed &= padded[1:1 + height, 1 + dc:1 + dc + width]
+            self.moves.append((dr, dc, allowed))
+
+        # 每個地刺伸出時會殺死站在哪些格子的玩家
+        spikes = [grid.cells_touching(((x, y, x + w, y + h),), margin=0.0)
+                  for x, y, w, h in np.asarray(compiled.spike_table).reshape(-1, 7)[:, :4]]
+        self.spike_cells = np.array(spikes, dtype=bool).reshape(-1, height, width)
+
+    def touching(self, x, y, half_w, half_h):
+        """玩家在每一格時，碰撞矩形能不能碰到以 (x, y) 為中心、半寬高為 half_w、half_h 的矩形。"""
+        slack = self.cell_size / 2
+        near_x = np.abs(self.center_x - x) < self.agent_size[0] / 2 + half_w + slack
+        near_y = np.abs(self.center_y - y) < self.agent_size[1] / 2 + half_h + slack
+        return near_y[:, None] & near_x[None, :]
+
+    def within(self, x, y, radius):
+        """玩家在每一格時，中心能不能離 (x, y) 小於 radius。"""
+        slack = self.cell_size / 2
+        dy = np.maximum(np.abs(self.center_y - y) - slack, 0.0)
+        dx = np.maximum(np.abs(self.center_x - x) - slack, 0.0)
+        return dy[:, None] ** 2 + dx[None, :] ** 2 < radius * radius
+
+    def reachable(self):
+        """不管鎖鏈與地刺時，這位玩家走得到的格子 (只被牆壁與箱子擋住)。"""
+        height, width = self.shape
+        reached = np.zeros(self.shape, dtype=bool)
+        reached[self.start] = True
+        while True:
+            grown = reached.copy()
+            for dr, dc, allowed in self.moves:
+                src = (_span(-dr, height), _span(-dc, width))
+                grown[_span(dr, height), _span(dc, width)] |= reached[src] & allowed[src]
+            if (grown == reached).all():
+                return reached
+            reached = grown
+
+    def danger(self, spike_states):
+        """spike_states 的地刺伸出時不能站的格子，沒有地刺伸出時回傳 None。"""
+        if not spike_states.any():
+            return None
+        return self.spike_cells[spike_states].any(axis=0)
+
+
+# --- 兩位玩家的位置組合 ---
+class _PairSpace:
+    """
+    兩位玩家位置的所有組合：p1 在 (r, c) (p1 可以站的範圍內的格子)，p2 在 p1 的格子再偏移 (i - K, j - K)。
+    鎖鏈限制了兩人的距離，所以只需要存 (2K + 1)² 種偏移，大地圖也不必存兩人位置的所有組合。
+    最後一軸 j 壓成 uint64 的位元 (第 j 位)，所以狀態陣列是 (列, 行, 2K + 1) 的 uint64，
+    p2 左右移動只是位元移位，一步的運算量比布林陣列少幾十倍。
+    Args:
+        first (_Walker): p1。
+        second (_Walker): p2。
+        chain_length (float): 鎖鏈長度。
+    """
+
+    def __init__(self, first, second, chain_length):
+        self.first = first
+        self.second = second
+        cell_size = first.cell_size
+        # 多留一格：p1 先走一步時兩人可能暫時多拉開一格，p2 同一步再跟上
+        self.radius = int(math.ceil(chain_length / cell_size)) + 2
+        self.size = size = 2 * self.radius + 1
+        if size > 64:
+            raise ValueError(f"格子太小 ({cell_size})，偏移超過 64 位元")
+        rows, cols = first.crop
+        self.shape = (rows.stop - rows.start, cols.stop - cols.start, size)
+        gap = np.maximum(np.abs(np.arange(size) - self.radius) - 1, 0) * cell_size  # 兩格之間最近的距離
+        self.chain_ok = self._pack(gap[:, None] ** 2 + gap[None, :] ** 2 <= chain_length * chain_length)
+
+        self.first_free = self.on_first(first.free)
+        self.first_moves = [(dr, dc, self.on_first(allowed)) for dr, dc, allowed in first.moves]
+        self.second_free = self.on_second(second.free)
+        self.second_moves = [(dr, dc, self.on_second(allowed)) for dr, dc, allowed in second.moves]
+
+    @staticmethod
+    def _pack(mask):
+        """最後一軸的布林值壓成 uint64 的位元。"""
+        weights = np.uint64(1) << np.arange(mask.shape[-1], dtype=np.uint64)
+        return np.bitwise_or.reduce(np.where(mask, weights, _NO_BITS), axis=-1)
+
+    def on_first(self, grid):
+        """p1 的格子資料 (整個世界的 2D 布林陣列) 轉成可以與狀態運算的遮罩 (全 1 或全 0 的位元)。"""
+        return np.where(grid[self.first.crop], _ALL_BITS, _NO_BITS)[:, :, None]
+
+    def on_second(self, grid):
+        """p2 的格子資料轉成 (r, c, i) 的位元遮罩：第 j 位是 p2 在 p1 的格子偏移 (i - K, j - K) 時的資料。"""
+        padded = np.pad(grid, self.radius)
+        # 先把每一列連續 size 格壓成一個 uint64，再沿著列取視窗，不必建立 (r, c, i, j) 的布林陣列
+        width = padded.shape[1] - self.size + 1
+        words = np.zeros((padded.shape[0], width), dtype=np.uint64)
+        for j in range(self.size):
+            words |= padded[:, j:j + width].astype(np.uint64) << np.uint64(j)
+        return np.ascontiguousarray(sliding_window_view(words, self.size, axis=0)[self.first.crop])
+
+    def empty(self):
+        return np.zeros(self.shape, dtype=np.uint64)
+
+    def add(self, reach, first_cell, second_cell):
+        rows, cols = self.first.crop
+        i = second_cell[0] - first_cell[0] + self.radius
+        j = second_cell[1] - first_cell[1] + self.radius
+        if not (0 <= i < self.size and 0 <= j < self.size):
+            raise ValueError("兩位玩家的起點距離超過鎖鏈長度")
+        reach[first_cell[0] - rows.start, first_cell[1] - cols.start, i] |= np.uint64(1) << np.uint64(j)
+
+    @staticmethod
+    def _shift(bits, shift):
+        return bits << np.uint64(shift) if shift > 0 else bits >> np.uint64(-shift)
+
+    def step(self, reach):
+        """兩位玩家各走一步 (八個方向或不動)，並套用鎖鏈長度限制。"""
+        height, width, size = self.shape
+        # p1 移動：p2 沒動，所以偏移反方向改變
+        moved = reach & self.first_free
+        for dr, dc, allowed in self.first_moves:
+            src = (_span(-dr, height), _span(-dc, width), _span(dr, size))
+            dst = (_span(dr, height), _span(dc, width), _span(-dr, size))
+            moved[dst] |= self._shift(reach[src] & allowed[src[:2]], -dc)
+        # p2 移動：只改變偏移
+        result = moved & self.second_free
+        for dr, dc, allowed in self.second_moves:
+            src = (slice(None), slice(None), _span(-dr, size))
+            dst = (slice(None), slice(None), _span(dr, size))
+            result[dst] |= self._shift(moved[src] & allowed[src], dc)
+        result &= self.chain_ok  # 也清掉移出範圍的位元
+        return result
+
+    def any_pair(self, reach, first_mask, second_mask):
+        """reach 中有沒有 p1 在 first_mask、同時 p2 在 second_mask 的組合 (None 表示不限制)。"""
+        if first_mask is not None:
+            reach = reach & self.on_first(first_mask)
+        if second_mask is not None:
+            reach = reach & self.on_second(second_mask)
+        return bool(reach.any())
+
+
+def _search(compiled, cell_size, horizon, box_rects):
+    """
+    在 (p1 位置, p2 位置, 時間) 上做廣度優先搜尋，每一步兩位玩家各走一格或不動：
+    兩人距離不能超過鎖鏈長度，踩到伸出的地刺的狀態直接剔除 (不考慮死亡後復活)，箱子是固定障礙物。
+    Args:
+        compiled (CompiledLevel): 編譯後的關卡。
+        cell_size (int): 格子邊長。
+        horizon (float): 最多搜尋幾秒的關卡時間。
+        box_rects (list): 當作障礙物的箱子。
+    Returns:
+        tuple: (_PairSpace, 到過的所有組合, 兩人同時站上目標的最短時間 (None 表示做不到), 搜尋步數)。
+            找到最短時間就停止，所以這時到過的組合只到那一步為止。
+    """
+    level = compiled.source
+    walkers = [_Walker(compiled, size, level[key], cell_size, box_rects)
+               for size, key in zip(PLAYER_SIZES, ("player1_start", "player2_start"))]
+    space = _PairSpace(walkers[0], walkers[1], CHAIN_MAX_LENGTH)
+    half_goal = GOAL_SIZE / 2
+    goals = (space.on_first(walkers[0].touching(*level["goal1_pos"], half_goal, half_goal)) &
+             space.on_second(walkers[1].touching(*level["goal2_pos"], half_goal, half_goal)))
+
+    scheduler = SpikeScheduler(compiled.spike_table)
+    step_time = cell_size / (PLAYER_SPEED * FPS)  # 走一格的時間 (斜走也算一步，所以時間略為偏低)
+    # 沒有地刺時可到達的狀態只會變多，一步沒有新狀態就結束；有地刺時要等一整個地刺週期都沒有新狀態
+    patience = 1
+    if len(scheduler):
+        patience = int(math.ceil(float(scheduler.cycle_time.max()) / step_time)) + 1
+    safe = {}  # 地刺狀態 -> 兩人都不在伸出的地刺上的遮罩 (地刺是週期性的，同樣的狀態會一直出現)
+
+    reach = space.empty()
+    space.add(reach, walkers[0].start, walkers[1].start)
+    visited = reach.copy()
+    completion_time = None
+    last_growth = 0
+    step = 0
+    for step in range(1, int(horizon / step_time) + 1):
+        reach = space.step(reach)
+        spike_states = scheduler.states_at(step * step_time)
+        if spike_states.any():
+            key = spike_states.tobytes()
+            mask = safe.get(key)
+            if mask is None:
+                mask = ~(space.on_first(walkers[0].danger(spike_states)) |
+                         space.on_second(walkers[1].danger(spike_states)))
+                safe[key] = mask
+            reach &= mask
+        if not reach.any():
+            break
+        if (reach & goals).any():
+            completion_time = step * step_time
+            break
+
+        new = reach & ~visited
+        if new.any():
+            visited |= new
+            last_growth = step
+        elif step - last_growth >= patience:
+            break
+    return space, visited, completion_time, step
+
+
+def _cell_size_for(compiled, cell_size):
+    """
+    格子太小 (偏移放不進 64 位元) 或大地圖的狀態陣列太大時，以 10 像素為單位加大格子，讓每關的搜尋時間差不多。
+    """
+    while True:
+        offsets = 2 * (int(math.ceil(CHAIN_MAX_LENGTH / cell_size)) + 2) + 1
+        cells = math.ceil(compiled.world_width / cell_size) * math.ceil(compiled.world_height / cell_size)
+        if offsets <= 64 and cells * offsets <= CHECK_MAX_WORDS:
+            return cell_size
+        cell_size += 10
+
+
+# --- 檢查一關 ---
+def check_level(path, seed=0, cell_size=CHECK_CELL_SIZE, horizon=CHECK_HORIZON):
+    """讀取關卡檔並檢查 (見 check_level_data)。"""
+    return check_level_data(load_level_file(path), path, seed, cell_size, horizon)
+
+
+def check_level_data(level, path="", seed=0, cell_size=CHECK_CELL_SIZE, horizon=CHECK_HORIZON):
+    """
+    檢查一關能不能完成：兩人同時站上各自的目標最少要多少時間、果實有沒有被移動或略過、有沒有果實碰不到。
+    先把箱子當成固定障礙物搜尋；做不到時，把兩人能一起靠近 (可以推) 的箱子拿掉再搜尋一次，
+    這時的時間不含推箱子的時間。流星是隨機的，不列入檢查。
+    Args:
+        level (dict): 關卡資料 (與關卡檔相同格式)。
+        path (str): 來源 (只做記錄)。
+        seed (int): 果實重新放置的隨機種子 (與遊戲相同，是關卡的索引)。
+        cell_size (int): 搜尋格子邊長。
+        horizon (float): 最多搜尋幾秒的關卡時間。
+    Returns:
+        dict: 檢查結果 (可以直接轉成 JSON)。
+    """
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # 果實略過的警告放在報告裡
+        compiled = compile_level(level, path, SCREEN_WIDTH, SCREEN_HEIGHT, FRUIT_RADIUS,
+                                 COOP_BOX_SIZE, GOAL_SIZE, seed=seed)
+    cell_size = _cell_size_for(compiled, cell_size)
+    half_box = COOP_BOX_SIZE / 2
+    box_rects = [(x - half_box, y - half_box, x + half_box, y + half_box) for x, y in compiled.box_starts]
+
+    space, visited, completion_time, steps = _search(compiled, cell_size, horizon, box_rects)
+    first, second = space.first, space.second
+    pushable = [index for index, (x, y) in enumerate(compiled.box_starts)
+                if space.any_pair(visited, first.within(x, y, COOP_BOX_PUSH_RADIUS),
+                                  second.within(x, y, COOP_BOX_PUSH_RADIUS))]
+    needs_push = False
+    if completion_time is None and pushable:
+        remaining = [rect for index, rect in enumerate(box_rects) if index not in pushable]
+        pushed = _search(compiled, cell_size, horizon, remaining)
+        if pushed[2] is not None:
+            needs_push = True
+            space, visited, completion_time, steps = pushed
+            first, second = space.first, space.second
+
+    half_goal = GOAL_SIZE / 2
+    goal1 = first.touching(*compiled.source["goal1_pos"], half_goal, half_goal)
+    goal2 = second.touching(*compiled.source["goal2_pos"], half_goal, half_goal)
+    goal_reachable = [completion_time is not None or space.any_pair(visited, goal1, None),
+                      completion_time is not None or space.any_pair(visited, None, goal2)]
+    # 果實只看牆壁與箱子：兩位玩家都走不到旁邊的果實一定拿不到
+    reachable = [walker.reachable() for walker in (first, second)]
+    unreachable_fruits = [(fx, fy, ftype) for fx, fy, ftype in compiled.fruits
+                          if not any((reached & walker.touching(fx, fy, FRUIT_RADIUS, FRUIT_RADIUS)).any()
+                                     for walker, reached in zip((first, second), reachable))]
+    return {
+        "path": path,
+        "completable": completion_time is not None,
+        "min_time": None if completion_time is None else round(completion_time, 2),
+        "needs_push": needs_push,
+        "goal_reachable": goal_reachable,
+        "boxes": len(box_rects),
+        "pushable_boxes": pushable,
+        "relocated_fruits": [list(item) for item in compiled.relocated_fruits],
+        "dropped_fruits": [list(item) for item in compiled.dropped_fruits],
+        "unreachable_fruits": [list(item) for item in unreachable_fruits],
+        "cell_size": cell_size,
+        "search_steps": steps,
+        "check_ms": round((time.perf_counter() - started) * 1000.0, 1),
+    }
+
+
+def _check_job(args):
+    return check_level(*args)
+
+
+def _level_jobs(paths, cell_size, horizon):
+    """把命令列的檔案與資料夾展開成 (path, seed, ...)，seed 與 LevelCache 一樣是關卡在資料夾中的索引。"""
+    jobs = []
+    for path in paths:
+        files = list_level_files(path) if os.path.isdir(path) else [path]
+        for file in files:
+            siblings = list_level_files(os.path.dirname(file) or ".")
+            seed = siblings.index(file) if file in siblings else 0
+            jobs.append((file, seed, cell_size, horizon))
+    return jobs
+
+
+def check_levels(paths, workers=None, cell_size=CHECK_CELL_SIZE, horizon=CHECK_HORIZON):
+    """
+    用行程池同時檢查多個關卡 (每關一個工作)。
+    Args:
+        paths (list): 關卡檔或資料夾。
+        workers (int): 行程數，None 表示 CPU 核心數，1 表示在目前行程中依序檢查。
+    Returns:
+        list: 依輸入順序的 check_level 結果。
+    """
+    jobs = _level_jobs(paths, cell_size, horizon)
+    if workers == 1 or len(jobs) <= 1:
+        return [_check_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(jobs))) as executor:
+        return list(executor.map(_check_job, jobs))
+
+
+def format_report(report):
+    name = os.path.basename(report["path"])
+    if report["completable"]:
+        status = f"可以完成，最短約 {report['min_time']:.1f} 秒"
+        if report["needs_push"]:
+            status += " (需要推箱子，不含推箱子的時間)"
+    else:
+        unreachable = [f"P{i + 1}" for i, ok in enumerate(report["goal_reachable"]) if not ok]
+        status = "無法完成" + (f"：{'、'.join(unreachable)} 到不了目標" if unreachable else "：兩人不能同時站上目標")
+    lines = [f"{name}: {status}"]
+    if not report["completable"] and report["boxes"] and not report["pushable_boxes"]:
+        lines.append("  兩人不能同時靠近任何一個箱子 (推不動)")
+    for (old, new, ftype) in report["relocated_fruits"]:
+        lines.append(f"  果實 {ftype} 從 {tuple(old)} 移到 {tuple(new)}")
+    for fx, fy, ftype in report["dropped_fruits"]:
+        lines.append(f"  果實 {ftype} ({fx}, {fy}) 找不到位置，被略過")
+    for fx, fy, ftype in report["unreachable_fruits"]:
+        lines.append(f"  果實 {ftype} ({fx}, {fy}) 沒有玩家碰得到")
+    lines.append(f"  搜尋 {report['search_steps']} 步，{report['check_ms']:.0f} ms")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線檢查關卡能不能完成 (鎖鏈長度、推箱子、地刺時間)")
+    parser.add_argument("paths", nargs="*", default=[LEVELS_DIR], help="關卡檔或資料夾，預設為 levels/")
+    parser.add_argument("--workers", type=int, default=None, help="行程數，預設為 CPU 核心數")
+    parser.add_argument("--cell", type=int, default=CHECK_CELL_SIZE, help="搜尋格子邊長 (像素)")
+    parser.add_argument("--horizon", type=float, default=CHECK_HORIZON, help="最多搜尋幾秒的關卡時間")
+    parser.add_argument("--json", action="store_true", help="輸出 JSON")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    reports = check_levels(args.paths, args.workers, args.cell, args.horizon)
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    else:
+        for report in reports:
+            print(format_report(report))
+        print(f"{len(reports)} 關，{time.perf_counter() - started:.2f} 秒")
+    failed = [r for r in reports if not r["completable"] or r["dropped_fruits"]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # 每個工作行程都會匯入 pygame
+
+import numpy as np
+
+from gamerules import (SCREEN_WIDTH, SCREEN_HEIGHT, PLAYER_SIZES, CHAIN_MAX_LENGTH, COOP_BOX_SIZE, GOAL_SIZE,
+                       FRUIT_RADIUS)
+from levelcheck import check_level_data
+
+# --- 生成參數 ---
+WALL_THICKNESS = 20
+DOOR_SIZE = (220, 300)  # 隔間的門寬，至少要讓騎士 (120) 在驗證用的格子上也過得去
+ROOM_WIDTH = 360  # 隔牆之間的距離 (騎士加上格子誤差要能在房間裡轉彎)
+SPIKE_SIZE = 40
+FRUIT_TYPES = ("mirror", "invisible_wall", "volcano")
+FRUIT_COUNT = 3
+GEN_BATCH_SIZE = 256  # 每批一起生成、一起做向量化篩選的候選關卡數
+GEN_CHECK_CELL = 30  # 篩選與完整驗證 (levelcheck) 用的格子邊長，比離線檢查粗，換取速度
+NAV_MARGIN = 2.0  # 與 bot.NavGrid 預設的 margin 相同
+GEN_HORIZON = 30.0  # 驗證最多搜尋幾秒的關卡時間 (比 HARD_TIME 長就夠了)
+# 難度以兩人同時到達目標的最短時間衡量：EASY_TIME 秒以下是 0，HARD_TIME 秒以上是 1
+EASY_TIME = 4.0
+HARD_TIME = 16.0
+
+
+def measured_difficulty(report):
+    """用 levelcheck 的結果算出關卡難度 (0 到 1)，不能完成的關卡回傳 None。"""
+    if not report["completable"]:
+        return None
+    return float(np.clip((report["min_time"] - EASY_TIME) / (HARD_TIME - EASY_TIME), 0.0, 1.0))
+
+
+def _layout(difficulty):
+    """
+    難度決定每批的隔間、擋板、地刺、箱子數量與世界寬度 (同一批形狀相同，才能向量化)。
+    隔間越多世界越寬，每個房間都要讓騎士過得去。
+    """
+    partitions = 1 + int(round(difficulty * 3))
+    return {
+        "partitions": partitions,
+        "shelves": int(round(difficulty * 2)),
+        "spikes": int(round(difficulty * 8)),
+        "boxes": int(round(difficulty * 2)),
+        "world_size": (max(SCREEN_WIDTH, 500 + partitions * ROOM_WIDTH), SCREEN_HEIGHT),
+    }
+
+
+# --- 候選關卡 (整批向量化生成) ---
+def generate_candidates(rng, count, difficulty):
+    """
+    一次生成 count 個候選關卡，全部放在 NumPy 陣列中 (矩形都是 x, y, w, h)。
+    版面是由左到右的幾道隔牆 (每道有一個門)，玩家從左邊出發，目標在右邊；難度越高門越會上下交錯。
+    再加上擋板、地刺 (一半放在門口)、協力箱子與果實。
+    Args:
+        rng (np.random.Generator): 亂數產生器。
+        count (int): 候選數。
+        difficulty (float): 目標難度 (0 到 1)。
+    Returns:
+        dict: 各種物件的陣列，第一軸是候選關卡。
+    """
+    layout = _layout(difficulty)
+    width, height = layout["world_size"]
+    k = layout["partitions"]
+    t = WALL_THICKNESS
+
+    # 隔牆：平均分布在起點區與目標區之間，位置稍微抖動
+    spacing = (width - 500) / k
+    wall_x = 250 + (np.arange(k) + 0.5) * spacing + rng.uniform(-30, 30, (count, k))
+    door = rng.uniform(*DOOR_SIZE, (count, k))
+    low, high = door / 2 + 60, height - door / 2 - 60
+    # 門的位置在隨機位置與上下交錯之間依難度內插
+    parity = (np.arange(k) + rng.integers(0, 2, (count, 1))) % 2
+    zigzag = np.where(parity == 0, low, high)
+    door_y = rng.uniform(low, high) * (1 - difficulty) + zigzag * difficulty
+    door_top = door_y - door / 2
+    door_bottom = door_y + door / 2
+    upper = np.stack((wall_x, np.zeros_like(wall_x), np.full_like(wall_x, t), door_top), axis=-1)
+    lower = np.stack((wall_x, door_bottom, np.full_like(wall_x, t), height - door_bottom), axis=-1)
+    shelves = np.stack((rng.uniform(250, width - 400, (count, layout["shelves"])),
+                        rng.uniform(100, height - 100, (count, layout["shelves"])),
+                        rng.uniform(100, 250, (count, layout["shelves"])),
+                        np.full((count, layout["shelves"]), t)), axis=-1)
+    walls = np.concatenate((upper, lower, shelves), axis=1)
+
+    # 起點在左邊，p2 在 p1 右邊；兩個目標在右邊，上下錯開但不超過鎖鏈長度
+    start1 = np.stack((rng.uniform(80, 140, count), rng.uniform(120, height - 120, count)), axis=-1)
+    start2 = start1 + np.stack((rng.uniform(90, 130, count), rng.uniform(-40, 40, count)), axis=-1)
+    goal1 = np.stack((rng.uniform(width - 160, width - 80, count), rng.uniform(80, height - 80, count)), axis=-1)
+    offset = rng.uniform(100, CHAIN_MAX_LENGTH * 0.75, count) * rng.choice((-1.0, 1.0), count)
+    goal2_y = goal1[:, 1] + offset
+    goal2_y = np.where((goal2_y < 60) | (goal2_y > height - 60), goal1[:, 1] - offset, goal2_y)
+    goal2 = np.stack((goal1[:, 0] + rng.uniform(-60, 20, count), goal2_y), axis=-1)
+
+    # 地刺：一半在門口，一半隨機；難度越高伸出越久 (縮回的時間要夠騎士整個走過去)
+    spike_count = layout["spikes"]
+    in_door = spike_count // 2
+    which = rng.integers(0, k, (count, in_door))
+    rows = np.arange(count)[:, None]
+    door_spikes = np.stack((wall_x[rows, which] + t / 2 - SPIKE_SIZE / 2 + rng.uniform(-30, 30, (count, in_door)),
+                            door_y[rows, which] - SPIKE_SIZE / 2 + rng.uniform(-60, 60, (count, in_door))), axis=-1)
+    free_spikes = np.stack((rng.uniform(200, width - 200, (count, spike_count - in_door)),
+                            rng.uniform(40, height - 80, (count, spike_count - in_door))), axis=-1)
+    spike_xy = np.concatenate((door_spikes, free_spikes), axis=1)
+    out_time = rng.uniform(0.6, 0.8 + 0.6 * difficulty, (count, spike_count))
+    in_time = rng.uniform(1.6, 2.2, (count, spike_count))
+    phase = rng.uniform(0.0, 1.0, (count, spike_count)) * (out_time + in_time)
+    spikes = np.concatenate((spike_xy, np.full((count, spike_count, 2), SPIKE_SIZE),
+                             out_time[..., None], in_time[..., None], phase[..., None]), axis=-1)
+
+    boxes = np.stack((rng.uniform(250, width - 250, (count, layout["boxes"])),
+                      rng.uniform(80, height - 80, (count, layout["boxes"]))), axis=-1)
+    fruits = np.stack((rng.uniform(60, width - 60, (count, FRUIT_COUNT)),
+                       rng.uniform(60, height - 60, (count, FRUIT_COUNT))), axis=-1)
+    fruit_types = rng.integers(0, len(FRUIT_TYPES), (count, FRUIT_COUNT))
+    return {
+        "world_size": (width, height),
+        "walls": np.round(walls),
+        "starts": np.round(np.stack((start1, start2), axis=1)),
+        "goals": np.round(np.stack((goal1, goal2), axis=1)),
+        "spikes": np.concatenate((np.round(spikes[..., :4]), np.round(spikes[..., 4:], 2)), axis=-1),
+        "boxes": np.round(boxes),
+        "fruits": np.round(fruits),
+        "fruit_types": fruit_types,
+    }
+
+
+def candidate_level(candidates, index):
+    """把第 index 個候選轉成關卡資料 (與 levels/*.json 相同格式)。"""
+    def ints(array):
+        return [[int(value) for value in row] for row in array]
+
+    starts = ints(candidates["starts"][index])
+    goals = ints(candidates["goals"][index])
+    level = {
+        "player1_start": starts[0],
+        "player2_start": starts[1],
+        "goal1_pos": goals[0],
+        "goal2_pos": goals[1],
+        "laser_walls": ints(candidates["walls"][index]),
+        "coop_box_start": ints(candidates["boxes"][index]),
+        "spike_traps": [[int(x), int(y), int(w), int(h), float(out_time), float(in_time), float(phase)]
+                        for x, y, w, h, out_time, in_time, phase in candidates["spikes"][index].tolist()],
+        "fruits": [[int(x), int(y), FRUIT_TYPES[ftype]]
+                   for (x, y), ftype in zip(candidates["fruits"][index].tolist(),
+                                            candidates["fruit_types"][index].tolist())],
+    }
+    if tuple(candidates["world_size"]) != (SCREEN_WIDTH, SCREEN_HEIGHT):
+        level["world_size"] = list(candidates["world_size"])
+    return level
+
+
+# --- 向量化篩選 ---
+def _centered(points, size):
+    """(N, P, 2) 的中心點轉成 (N, P, 4) 的 x, y, w, h 矩形。"""
+    half = np.asarray(size, dtype=np.float64) / 2
+    return np.concatenate((points - half, np.broadcast_to(half * 2, points.shape)), axis=-1)
+
+
+def _overlaps(a, b):
+    """(N, A, 4) 與 (N, B, 4) 的矩形兩兩是否重疊，回傳 (N, A, B)。"""
+    a = a[:, :, None, :]
+    b = b[:, None, :, :]
+    return ((a[..., 0] < b[..., 0] + b[..., 2]) & (b[..., 0] < a[..., 0] + a[..., 2]) &
+            (a[..., 1] < b[..., 1] + b[..., 3]) & (b[..., 1] < a[..., 1] + a[..., 3]))
+
+
+def _reachable(candidates, player_id, cell_size):
+    """
+    整批一起做淹水填充：玩家從起點走得到的格子。格子的判斷與 bot.NavGrid 相同 (牆壁與箱子依玩家大小膨脹，
+    整格都碰不到才能站)，所以用與完整驗證相同的格子大小時，這裡走不到的目標驗證時也一定走不到。
+    Returns:
+        tuple: (走得到的格子 (N, rows, cols), 格子中心的 y (rows,), x (cols,))。
+    """
+    width, height = candidates["world_size"]
+    agent_w, agent_h = PLAYER_SIZES[player_id]
+    half_w, half_h = agent_w / 2 + NAV_MARGIN, agent_h / 2 + NAV_MARGIN
+    rows, cols = int(np.ceil(height / cell_size)), int(np.ceil(width / cell_size))
+    edge_y = np.arange(rows + 1) * cell_size
+    edge_x = np.arange(cols + 1) * cell_size
+    obstacles = np.concatenate((candidates["walls"], _centered(candidates["boxes"], COOP_BOX_SIZE)), axis=1)
+    left = obstacles[..., 0, None, None] - half_w
+    top = obstacles[..., 1, None, None] - half_h
+    right = obstacles[..., 0, None, None] + obstacles[..., 2, None, None] + half_w
+    bottom = obstacles[..., 1, None, None] + obstacles[..., 3, None, None] + half_h
+    inside_y = (edge_y[None, None, 1:, None] > top) & (edge_y[None, None, :-1, None] < bottom)
+    inside_x = (edge_x[None, None, None, 1:] > left) & (edge_x[None, None, None, :-1] < right)
+    blocked = (inside_y & inside_x).any(axis=1)
+    blocked |= ~((edge_y[:-1] >= agent_h / 2) & (edge_y[1:] <= height - agent_h / 2))[None, :, None]
+    blocked |= ~((edge_x[:-1] >= agent_w / 2) & (edge_x[1:] <= width - agent_w / 2))[None, None, :]
+
+    count = len(blocked)
+    start = candidates["starts"][:, player_id]
+    start_rows = np.clip((start[:, 1] // cell_size).astype(int), 0, rows - 1)
+    start_cols = np.clip((start[:, 0] // cell_size).astype(int), 0, cols - 1)
+    reached = np.zeros_like(blocked)
+    reached[np.arange(count), start_rows, start_cols] = True
+    free = ~blocked | reached  # 起點一定算可以站 (與 levelcheck 相同)
+    while True:
+        grown = reached.copy()
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown[:, :, 1:] |= reached[:, :, :-1]
+        grown[:, :, :-1] |= reached[:, :, 1:]
+        grown &= free
+        if (grown == reached).all():
+            return reached, (edge_y[:-1] + edge_y[1:]) / 2, (edge_x[:-1] + edge_x[1:]) / 2
+        reached = grown
+
+
+def feasible(candidates, cell_size=GEN_CHECK_CELL):
+    """
+    便宜的向量化篩選 (整批一起算)，只留下值得做完整驗證的候選：
+    起點、目標、箱子不壓在牆上；地刺不壓在起點與目標上；果實不必被重新放置；
+    兩個起點、兩個目標的距離都在鎖鏈長度內；兩位玩家都走得到自己的目標 (不考慮鎖鏈與地刺)。
+    Returns:
+        np.ndarray: (N,) 的布林陣列。
+    """
+    width, height = candidates["world_size"]
+    walls = candidates["walls"]
+    spikes = candidates["spikes"][..., :4]
+    starts = np.concatenate([_centered(candidates["starts"][:, i:i + 1], PLAYER_SIZES[i]) for i in range(2)], axis=1)
+    goals = _centered(candidates["goals"], GOAL_SIZE)
+    boxes = _centered(candidates["boxes"], COOP_BOX_SIZE)
+    fruits = _centered(candidates["fruits"], FRUIT_RADIUS * 2)
+
+    ok = ~_overlaps(np.concatenate((starts, goals, boxes), axis=1), walls).any(axis=(1, 2))
+    ok &= ~_overlaps(np.concatenate((starts, goals), axis=1), spikes).any(axis=(1, 2))
+    ok &= ~_overlaps(boxes, np.concatenate((starts, goals), axis=1)).any(axis=(1, 2))
+    # 與 compile_level 相同的規則，通過的果實不會被移動
+    fruit_obstacles = np.concatenate((walls, spikes, boxes, goals), axis=1)
+    ok &= ~_overlaps(fruits, fruit_obstacles).any(axis=(1, 2))
+    ok &= ((fruits[..., 0] >= 0) & (fruits[..., 0] + fruits[..., 2] <= width) &
+           (fruits[..., 1] >= 0) & (fruits[..., 1] + fruits[..., 3] <= height)).all(axis=1)
+    for pair in ("starts", "goals"):
+        delta = candidates[pair][:, 0] - candidates[pair][:, 1]
+        ok &= np.hypot(delta[:, 0], delta[:, 1]) <= CHAIN_MAX_LENGTH
+
+    half_goal = GOAL_SIZE / 2
+    for player_id in range(2):
+        if not ok.any():
+            break
+        subset = {key: value[ok] if isinstance(value, np.ndarray) else value for key, value in candidates.items()}
+        reached, cy, cx = _reachable(subset, player_id, cell_size)
+        goal = subset["goals"][:, player_id]
+        slack = cell_size / 2  # 與 levelcheck 相同，玩家可以在格子裡微調
+        touch_y = np.abs(cy[None, :] - goal[:, 1:2]) < PLAYER_SIZES[player_id][1] / 2 + half_goal + slack
+        touch_x = np.abs(cx[None, :] - goal[:, 0:1]) < PLAYER_SIZES[player_id][0] / 2 + half_goal + slack
+        ok[ok] = (reached & touch_y[:, :, None] & touch_x[:, None, :]).any(axis=(1, 2))
+    return ok
+
+
+# --- 一批 ---
+def generate_batch(seed, batch_index, difficulty, tolerance, batch_size=GEN_BATCH_SIZE):
+    """
+    生成並驗證一批候選關卡。亂數由 (seed, batch_index) 決定，所以同一個種子不論用幾個行程結果都相同。
+    Args:
+        seed (int): 種子。
+        batch_index (int): 第幾批。
+        difficulty (float): 目標難度 (0 到 1)。
+        tolerance (float): 實際難度與目標相差不超過這個值才保留。
+        batch_size (int): 每批候選數。
+    Returns:
+        tuple: (保留的 (批內索引, 關卡資料) 列表, 統計 dict)。
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng((seed, batch_index))
+    candidates = generate_candidates(rng, batch_size, difficulty)
+    passed = np.flatnonzero(feasible(candidates))
+    filter_ms = (time.perf_counter() - started) * 1000.0
+
+    accepted = []
+    for index in passed.tolist():
+        level = candidate_level(candidates, index)
+        report = check_level_data(level, f"seed {seed} batch {batch_index} #{index}",
+                                  cell_size=GEN_CHECK_CELL, horizon=GEN_HORIZON)
+        measured = measured_difficulty(report)
+        if measured is None or report["relocated_fruits"] or report["unreachable_fruits"]:
+            continue
+        if abs(measured - difficulty) > tolerance:
+            continue
+        level["generator"] = {"seed": seed, "batch": batch_index, "index": index, "difficulty": difficulty,
+                              "measured": round(measured, 3), "min_time": report["min_time"]}
+        accepted.append((index, level))
+    stats = {"candidates": batch_size, "filtered": len(passed), "accepted": len(accepted),
+             "filter_ms": filter_ms, "total_ms": (time.perf_counter() - started) * 1000.0}
+    return accepted, stats
+
+
+def _batch_job(args):
+    return generate_batch(*args)
+
+
+def generate_levels(seed, count, difficulty, out_dir, workers=None, tolerance=0.15, batch_size=GEN_BATCH_SIZE,
+                    max_batches=10000):
+    """
+    生成 count 個通過驗證的關卡，每完成一批就把結果寫進 out_dir (每關一個 JSON 檔，可以直接當關卡資料夾)。
+    多個行程同時處理不同批次，但依批次順序寫檔，所以同一個種子的輸出與行程數無關。
+    Args:
+        seed (int): 種子。
+        count (int): 要生成的關卡數。
+        difficulty (float): 目標難度 (0 到 1)。
+        out_dir (str): 輸出資料夾。
+        workers (int): 行程數，None 表示 CPU 核心數。
+        tolerance (float): 實際難度與目標的容許誤差。
+        batch_size (int): 每批候選數。
+        max_batches (int): 最多嘗試幾批 (難度設定得太極端時避免無限執行)。
+    Returns:
+        dict: 統計 (候選數、篩選後、保留數、寫入的檔案)。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    totals = {"candidates": 0, "filtered": 0, "accepted": 0, "filter_ms": 0.0, "total_ms": 0.0}
+    written = []
+    next_batch = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(written) < count and next_batch < max_batches:
+            # 一次送出與行程數相同的批次，依順序取回結果
+            batches = range(next_batch, min(next_batch + workers, max_batches))
+            next_batch = batches.stop
+            jobs = [(seed, batch_index, difficulty, tolerance, batch_size) for batch_index in batches]
+            for batch_index, (accepted, stats) in zip(batches, executor.map(_batch_job, jobs)):
+                for key, value in stats.items():
+                    totals[key] += value
+                for index, level in accepted:
+                    if len(written) >= count:
+                        break
+                    path = os.path.join(out_dir, f"gen_{seed}_{len(written):05d}.json")
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(level, f, ensure_ascii=False)
+                    written.append(path)
+    totals["written"] = written
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="由種子與目標難度生成關卡，篩選並驗證後寫入資料夾")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=100, help="要生成的關卡數")
+    parser.add_argument("--difficulty", type=float, default=0.5, help="目標難度 (0 到 1)")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="實際難度與目標的容許誤差")
+    parser.add_argument("--out", default="generated_levels", help="輸出資料夾")
+    parser.add_argument("--workers", type=int, default=None, help="行程數，預設為 CPU 核心數")
+    parser.add_argument("--batch-size", type=int, default=GEN_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    totals = generate_levels(args.seed, args.count, args.difficulty, args.out, args.workers, args.tolerance,
+                             args.batch_size)
+    elapsed = time.perf_counter() - started
+    print(f"候選 {totals['candidates']}，通過篩選 {totals['filtered']}，通過驗證 {totals['accepted']}，"
+          f"寫入 {len(totals['written'])} 關到 {args.out}")
+    print(f"{elapsed:.1f} 秒 ({len(totals['written']) / elapsed * 60:.0f} 關/分鐘)，"
+          f"篩選佔 {totals['filter_ms'] / max(totals['total_ms'], 1e-9) * 100:.0f}% 的工作時間")
+    return 0 if len(totals["written"]) >= args.count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import json
+import os
+import random
+import threading
+
+import numpy as np
+import pygame
+
+LEVELS_DIR = "./levels"
+
+
+# --- 關卡檔案 ---
+def load_level_file(path):
+    """
+    讀取單一關卡 JSON 檔，並把座標統一轉成 tuple。
+    Args:
+        path (str): 關卡檔路徑。
+    Returns:
+        dict: 與原本 levels_data 相同格式的關卡資料。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    level = {}
+    for key, value in data.items():
+        if isinstance(value, list) and value and isinstance(value[0], list):
+            level[key] = [tuple(item) for item in value]
+        elif isinstance(value, list):
+            level[key] = tuple(value)
+        else:
+            level[key] = value
+    # coop_box_start 也可以只寫一個座標 (x, y)
+    boxes = level.get("coop_box_start", [])
+    if isinstance(boxes, tuple) and len(boxes) == 2 and isinstance(boxes[0], (int, float)):
+        level["coop_box_start"] = [boxes]
+    return level
+
+
+def list_level_files(directory=LEVELS_DIR):
+    """依檔名排序列出資料夾中的關卡檔 (*.json)。"""
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"關卡資料夾未找到: {directory}")
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    return [os.path.join(directory, name) for name in names]
+
+
+# --- 多人關卡欄位 ---
+def player_start(level, player_id):
+    """
+    第 player_id 位玩家的起點。關卡可以用 "player_starts" 列出每位玩家的起點；沒有列到的玩家與同角色
+    (player_id % 2) 的玩家1或玩家2共用起點 (同角色的碰撞框一樣大，原本的起點一定放得下)。
+    """
+    starts = level.get("player_starts", ())
+    if player_id < len(starts):
+        return tuple(starts[player_id])
+    return tuple(level["player1_start" if player_id % 2 == 0 else "player2_start"])
+
+
+def player_goal(level, player_id):
+    """第 player_id 位玩家的目標位置 ("goals"，沒有列到的玩家與 player_start 一樣沿用目標1或目標2)。"""
+    goals = level.get("goals", ())
+    if player_id < len(goals):
+        return tuple(goals[player_id])
+    return tuple(level["goal1_pos" if player_id % 2 == 0 else "goal2_pos"])
+
+
+def level_chain_links(level, player_count, default_length):
+    """
+    關卡的鎖鏈 "chain_links": [[a, b], [a, b, 長度], ...]，只保留兩端都在這場遊戲裡的鎖鏈。
+    沒有指定 (或全部被略過) 時把所有玩家依序串成一條鏈。
+    Returns:
+        tuple: (links, lengths)，links 是 [(a, b), ...]。
+    """
+    links = []
+    lengths = []
+    for link in level.get("chain_links", ()):
+        a, b = int(link[0]), int(link[1])
+        if a != b and a < player_count and b < player_count:
+            links.append((a, b))
+            lengths.append(float(link[2]) if len(link) > 2 else float(default_length))
+    if not links:
+        links = [(i, i + 1) for i in range(player_count - 1)]
+        lengths = [float(default_length)] * len(links)
+    return links, lengths
+
+
+# --- 編譯後的關卡 ---
+class CompiledLevel:
+    """
+    關卡編譯一次後的結果，重新開始或切換關卡時直接重用。
+    Attributes:
+        path (str): 來源檔案。
+        source (dict): 原始關卡資料。
+        world_width (int): 世界寬度 (關卡檔的 "world_size"，預設為畫面大小)。
+        world_height (int): 世界高度。
+        wall_rects (list): 雷射牆壁的 pygame.Rect。
+        wall_array (np.ndarray): (M, 4) 的 (left, top, right, bottom) 陣列。
+        occupancy (np.ndarray): 以 cell_size 為格的牆壁佔用表 (bool，[row, col])。
+        box_starts (list): 協力箱子起始位置。
+        spike_table (np.ndarray): (K, 7) 的 x, y, w, h, out_time, in_time, phase_offset。
+        fruits (list): 驗證 (必要時重新放置) 後的果實 (x, y, type)。
+        relocated_fruits (list): 原位置無效而被移動的果實 ((原 x, 原 y), (新 x, 新 y), type)。
+        dropped_fruits (list): 找不到有效位置而被略過的果實 (x, y, type)。
+        render_cache (dict): 給遊戲放預先畫好的背景與可重用精靈。
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.world_width = 0
+        self.world_height = 0
+        self.wall_rects = []
+        self.wall_array = np.zeros((0, 4), dtype=np.float64)
+        self.cell_size = 10
+        self.occupancy = None
+        self.box_starts = []
+        self.spike_table = np.zeros((0, 7), dtype=np.float64)
+        self.fruits = []
+        self.relocated_fruits = []
+        self.dropped_fruits = []
+        self.render_cache = {}
+
+
+def compile_level(level, path, screen_width, screen_height, fruit_radius, box_size, goal_size,
+                  cell_size=10, seed=0, max_spawn_attempts=50):
+    """
+    把關卡資料編譯成 CompiledLevel：牆壁佔用格、地刺時間表、驗證過的果實位置。
+    這一步不需要顯示視窗，離線工具也可以直接使用。
+    Args:
+        level (dict): 關卡資料。
+        path (str): 來源檔案 (只做記錄)。
+        screen_width (int): 畫面寬度，關卡沒有指定 "world_size" 時當作世界寬度。
+        screen_height (int): 畫面高度，關卡沒有指定 "world_size" 時當作世界高度。
+        fruit_radius (int): 果實半徑。
+        box_size (int): 協力箱子碰撞尺寸。
+        goal_size (int): 目標地板尺寸。
+        cell_size (int): 佔用格的格子大小 (像素)。
+        seed (int): 果實重新放置用的隨機種子，讓同一關每次結果相同。
+        max_spawn_attempts (int): 重新放置果實的最大嘗試次數。
+    Returns:
+        CompiledLevel: 編譯結果。
+    """
+    compiled = CompiledLevel(path, level)
+    compiled.cell_size = cell_size
+    world_width, world_height = level.get("world_size", (screen_width, screen_height))
+    compiled.world_width = world_width
+    compiled.world_height = world_height
+
+    compiled.wall_rects = [pygame.Rect(*wall) for wall in level.get("laser_walls", [])]
+    if compiled.wall_rects:
+        compiled.wall_array = np.array([(r.left, r.top, r.right, r.bottom) for r in compiled.wall_rects],
+                                       dtype=np.float64)
+
+    rows = (world_height + cell_size - 1) // cell_size
+    cols = (world_width + cell_size - 1) // cell_size
+    occupancy = np.zeros((rows, cols), dtype=bool)
+    for r in compiled.wall_rects:
+        occupancy[max(0, r.top // cell_size):max(0, (r.bottom + cell_size - 1) // cell_size),
+                  max(0, r.left // cell_size):max(0, (r.right + cell_size - 1) // cell_size)] = True
+    compiled.occupancy = occupancy
+
+    compiled.box_starts = [tuple(pos) for pos in level.get("coop_box_start", []) if len(pos) == 2]
+
+    spikes = level.get("spike_traps", [])
+    if spikes:
+        # 缺少的欄位使用 SpikeTrap 的預設值
+        defaults = (0, 0, 40, 40, 1.0, 1.5, 0.0)
+        compiled.spike_table = np.array([tuple(spike) + defaults[len(spike):] for spike in spikes],
+                                        dtype=np.float64)
+
+    # 果實不能生成在牆壁、地刺、箱子、目標上
+    obstacles = list(compiled.wall_rects)
+    obstacles += [pygame.Rect(*row[:4]) for row in compiled.spike_table.astype(int)]
+    for pos in compiled.box_starts:
+        box_rect = pygame.Rect(0, 0, box_size, box_size)
+        box_rect.center = pos
+        obstacles.append(box_rect)
+    goal_positions = [level[key] for key in ("goal1_pos", "goal2_pos") if key in level]
+    for pos in goal_positions + list(level.get("goals", ())):
+        goal_rect = pygame.Rect(0, 0, goal_size, goal_size)
+        goal_rect.center = pos
+        obstacles.append(goal_rect)
+
+    rng = random.Random(seed)
+    fruit_rect = pygame.Rect(0, 0, fruit_radius * 2, fruit_radius * 2)
+    for fx, fy, ftype in level.get("fruits", []):
+        fruit_rect.center = (fx, fy)
+        valid = (fruit_rect.collidelist(obstacles) == -1 and
+                 fruit_radius <= fx <= world_width - fruit_radius and
+                 fruit_radius <= fy <= world_height - fruit_radius)
+        if valid:
+            compiled.fruits.append((fx, fy, ftype))
+            continue
+        for _ in range(max_spawn_attempts):
+            new_fx = rng.randint(fruit_radius, world_width - fruit_radius)
+            new_fy = rng.randint(fruit_radius, world_height - fruit_radius)
+            fruit_rect.center = (new_fx, new_fy)
+            if fruit_rect.collidelist(obstacles) == -1:
+                compiled.fruits.append((new_fx, new_fy, ftype))
+                compiled.relocated_fruits.append(((fx, fy), (new_fx, new_fy), ftype))
+                break
+        else:
+            compiled.dropped_fruits.append((fx, fy, ftype))
+            print(f"Warning: Could not find a valid spawn location for fruit type '{ftype}' at ({fx},{fy}) "
+                  f"after {max_spawn_attempts} attempts. Skipping this fruit.")
+    return compiled
+
+
+class LevelCache:
+    """
+    關卡快取：每個關卡檔只編譯一次，檔案修改時間改變時才重新編譯。
+    Args:
+        directory (str): 關卡資料夾。
+        **compile_kwargs: 傳給 compile_level 的參數 (screen_width, fruit_radius 等)。
+    """
+
+    def __init__(self, directory=LEVELS_DIR, **compile_kwargs):
+        self.directory = directory
+        self.compile_kwargs = compile_kwargs
+        self.paths = list_level_files(directory)
+        self._compiled = {}  # path -> (mtime, CompiledLevel)
+        self._lock = threading.Lock()  # 背景執行緒也會預先編譯關卡
+
+    def __len__(self):
+        return len(self.paths)
+
+    def refresh(self):
+        """重新列出資料夾中的關卡檔 (熱重載時新增或刪除了關卡)，並丟掉已刪除關卡的編譯結果。"""
+        with self._lock:
+            self.paths = list_level_files(self.directory)
+            for path in set(self._compiled) - set(self.paths):
+                del self._compiled[path]
+
+    def compiled_levels(self):
+        """目前快取中所有已編譯的關卡 (熱重載素材時更新它們的 render_cache)。"""
+        with self._lock:
+            return [compiled for _, compiled in self._compiled.values()]
+
+    def get(self, index):
+        """取得第 index 關的 CompiledLevel，必要時才編譯。"""
+        path = self.paths[index]
+        with self._lock:
+            mtime = os.path.getmtime(path)
+            cached = self._compiled.get(path)
+            if cached is None or cached[0] != mtime:
+                compiled = compile_level(load_level_file(path), path, seed=index, **self.compile_kwargs)
+                cached = (mtime, compiled)
+                self._compiled[path] = cached
+            return cached[1]
@@ -1,43 +1,74 @@
+import argparse
+import os
+import time
+import weakref
 import pygame
-import cv2
 import numpy as np
 import math
+import heapq
 from animations import *
-import random  # Added for fruit/meteor spawning
+import struct
+from rope import VerletRope, rects_to_array
+from chaingraph import ChainGraph
+from pools import SpritePool
+from particles import ParticleSystem
+from levels import LEVELS_DIR, LevelCache, level_chain_links, player_goal, player_start
+from world import Camera, ChunkIndex, ChunkedBackground
+from spikes import SpikeScheduler
+from assets import AssetLoader, LoadingJob
+from snapshots import SimRandom, SnapshotRing
+from netplay import NetplayPeer, RollbackSession, CONTROL_LOAD_LEVEL
+from inputs import INPUT_LEFT, INPUT_RIGHT, NO_INPUT, InputDevices, InputFrame
+from latency import LatencyTracker, ScriptedInput
+from framebudget import FrameBudget
+from presenter import Presenter, SCALE_AUTO, SCALE_MODES
+from proximity import ProximityContext
+from renderqueue import RenderQueue
+from surfacemem import SurfaceMemory
+from bot import BotController
+from recorder import VideoRecorder
+from paintwindow import SharedPaintCanvas
+from gamerules import (SCREEN_WIDTH, SCREEN_HEIGHT, FPS, PLAYER_RADIUS, PLAYER_SPEED, CHAIN_MAX_LENGTH, GOAL_SIZE,
+                       KNIGHT_FRAME_SIZE, WITCH_FRAME_SIZE, COOP_BOX_SIZE, COOP_BOX_PUSH_RADIUS, FRUIT_RADIUS)
+from hotreload import FileWatcher
+from telemetry import (TelemetryRecorder, EVENT_MOVE, EVENT_DEATH, EVENT_REVIVE_START, EVENT_REVIVE, EVENT_FRUIT,
+                       EVENT_LEVEL_END, CAUSE_UNKNOWN, CAUSE_LASER, CAUSE_SPIKE, CAUSE_METEOR, FRUIT_TYPES, NO_ACTOR)
 
 # --- 常數 ---
-SCREEN_WIDTH = 1080
-SCREEN_HEIGHT = 720
-FPS = 60
+# 畫面大小、玩家尺寸等離線工具也會用到的規則參數放在 gamerules.py
+
+# 大地圖 (關卡可用 "world_size" 指定比畫面大的世界)
+CHUNK_SIZE = 512  # 區塊邊長
+SIMULATION_MARGIN = 256  # 繩索 (只影響畫面) 繞開攝影機外這個距離內的牆壁與箱子
 
 # 顏色定義
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
-PLAYER1_COLOR = (0, 0, 255)
-PLAYER1_DEAD_COLOR = (0, 0, 100)
-PLAYER2_COLOR = (255, 0, 0)
-PLAYER2_DEAD_COLOR = (100, 0, 0)
+# 每位玩家的顏色 (依 player_id)；屍體顏色較暗，目標地板顏色較淡
+PLAYER_COLORS = [(0, 0, 255), (255, 0, 0), (0, 200, 0), (230, 200, 0),
+                 (200, 0, 200), (0, 200, 200), (255, 140, 0), (160, 160, 160)]
+PLAYER_DEAD_COLORS = [tuple(c * 100 // 255 for c in color) for color in PLAYER_COLORS]
 CHAIN_COLOR = (150, 150, 150)
 LASER_WALL_COLOR = (255, 0, 255)
-GOAL_P1_COLOR = (100, 100, 255)
-GOAL_P2_COLOR = (255, 100, 100)
+GOAL_COLORS = [tuple(c + (255 - c) * 100 // 255 for c in color) for color in PLAYER_COLORS]
 TEXT_COLOR = (200, 200, 200)
 REVIVE_PROMPT_COLOR = (50, 200, 50)
 COOP_BOX_COLOR = (180, 140, 0)
 
 # 玩家參數
-PLAYER_RADIUS = 15
-PLAYER_SPEED = 3
-CHAIN_MAX_LENGTH = 400
+MAX_PLAYERS = len(PLAYER_COLORS)  # 偶數 player_id 是騎士、奇數是女巫
 CHAIN_ITERATIONS = 5
+USE_ROPE_CHAIN = True  # True: 多段 Verlet 繩索 (會繞過牆壁/箱子)；False: 單一直線
+CHAIN_ROPE_SEGMENTS = 32
+CHAIN_ROPE_BUDGET_MS = 0.3  # 繩索每幀的時間預算
 REVIVAL_RADIUS = CHAIN_MAX_LENGTH
-REVIVE_KEYP1 = pygame.K_f
-REVIVE_KEYP2 = pygame.K_PERIOD
+# 鍵盤只有兩組按鍵，第 3 位以後的玩家用手把 (第 i 個手把控制玩家 i)
+PLAYER_CONTROL_KEYS = [{'up': pygame.K_w, 'down': pygame.K_s, 'left': pygame.K_a, 'right': pygame.K_d},
+                       {'up': pygame.K_UP, 'down': pygame.K_DOWN, 'left': pygame.K_LEFT, 'right': pygame.K_RIGHT}]
+PLAYER_REVIVE_KEYS = [pygame.K_f, pygame.K_PERIOD]
 
 # 協力推箱子常數
-COOP_BOX_SIZE = 40
 COOP_BOX_SPEED = 2
-COOP_BOX_PUSH_RADIUS = 60
 
 # 地刺參數
 SAFE_COLOR = (220, 220, 220)
@@ -49,9 +80,50 @@ STATE_PLAYING = 0
 STATE_GAME_OVER = 1
 STATE_LEVEL_COMPLETE = 2
 STATE_ALL_LEVELS_COMPLETE = 3
+STATE_LOADING = 5
+
+# 載入畫面：每幀在主執行緒做收尾工作 (convert、切割、縮放) 的時間預算
+LOADING_BUDGET_MS = 6.0
+
+# 快照與倒轉 (單機時)
+SNAPSHOT_HISTORY_SECONDS = 10  # 環形緩衝區保留的秒數，每個 tick 一個快照
+REWIND_KEY = pygame.K_BACKSPACE  # 按住倒轉
+QUICK_SAVE_KEY = pygame.K_F5
+QUICK_LOAD_KEY = pygame.K_F9
+
+# 手把 (第 1 個手把控制玩家1，第 2 個控制玩家2)
+GAMEPAD_DEADZONE = 0.5  # 類比搖桿超過這個值才算按下
+
+# 輸入延遲量測 (SDL_VIDEODRIVER=dummy python main.py --latency-bench 30)
+LATENCY_BENCH_SEED = 0  # 合成輸入的亂數種子，每次量測都按同樣的按鍵
+
+# 區域網路雙人 (python main.py --host 47000 / python main.py --join 192.168.0.10:47000)
+NET_DEFAULT_PORT = 47000
+NET_TICK_DT = 1.0 / FPS  # 連線時每個 tick 固定長度，兩台電腦的模擬才會一致
+NET_RANDOM_SEED = 1234  # 每次載入關卡時用 NET_RANDOM_SEED + 換關次數 重設亂數
+NET_MAX_ROLLBACK = 12  # 最多回滾的 tick 數
+
+# 電腦隊友 (python main.py --bot 2，或遊玩中按 F2 切換玩家2)
+BOT_TOGGLE_KEY = pygame.K_F2
+BOT_PLAN_BUDGET_MS = 1.0  # 每幀路徑規劃的時間預算
+BOT_NAV_CELL_SIZE = 20
+
+# 熱重載：修改關卡檔、plays_animation_art/ 的圖集、box.png、spike_trap_*.png 後直接套用，不必重新啟動
+HOT_RELOAD_INTERVAL = 0.25  # 檢查檔案的間隔 (秒)
+HOT_RELOAD_BUDGET_MS = 4.0  # 每幀在主執行緒套用重載結果 (convert、切割、縮放) 的時間預算
+ANIMATION_DIR = "./plays_animation_art"
+
+# 錄影 (F10 開始/停止，或 python main.py --record [PATH])
+RECORD_KEY = pygame.K_F10
+RECORDINGS_DIR = "recordings"
+RECORD_QUEUE_SIZE = 8  # 最多排隊等待編碼的幀數，超過就丟幀
+RECORD_COLOR = (230, 40, 40)
+
+# 遙測 (python main.py --telemetry [DIR])：死亡、復活、果實與定時取樣的位置，用 telemetry.py 彙整成熱度圖
+TELEMETRY_DIR = "telemetry"
+TELEMETRY_MOVE_INTERVAL = 0.25  # 每隔幾秒 (關卡時間) 記錄一次每位活著玩家的位置
 
 # --- 果實相關常數 ---
-FRUIT_RADIUS = 15
 FRUIT_EFFECT_DURATION = 30.0  # 30秒效果時間
 
 # 果實顏色
@@ -65,18 +137,121 @@ METEOR_FALL_TIME = 0.5  # Time the meteor stays on screen after warning
 METEOR_SIZE = 50  # Increased size for better visibility
 METEOR_COLOR = (139, 69, 19)  # 棕色
 WARNING_COLOR = (255, 255, 0)  # 黃色警告
+WARNING_FLASH_LEVELS = 16  # 警告閃爍預先畫好的透明度層級數
+METEOR_POOL_CAPACITY = 32  # 物件池預先配置的流星數量
+WARNING_POOL_CAPACITY = 32  # 物件池預先配置的警告數量
+
+# 粒子效果常數
+PARTICLE_CAPACITY = 16384
+METEOR_IMPACT_PARTICLES = 120
+FRUIT_PICKUP_PARTICLES = 60
+
+# 畫質自動調整：每幀工作超出預算時依序降級，有餘裕時回升。只影響畫面，模擬結果在每個等級都相同
+FRAME_BUDGET_MS = 1000.0 / FPS * 0.8  # 留一些時間給 display.flip 與系統
+QUALITY_LEVELS = [
+    # particle_density: 粒子數量倍率, warning_flash: 警告是否閃爍,
+    # hud_interval: HUD 文字每幾幀重畫一次, chain_segments: 繩索段數
+    {"particle_density": 1.0, "warning_flash": True, "hud_interval": 1, "chain_segments": CHAIN_ROPE_SEGMENTS},
+    {"particle_density": 0.5, "warning_flash": True, "hud_interval": 2, "chain_segments": CHAIN_ROPE_SEGMENTS // 2},
+    {"particle_density": 0.25, "warning_flash": False, "hud_interval": 4, "chain_segments": CHAIN_ROPE_SEGMENTS // 4},
+    {"particle_density": 0.1, "warning_flash": False, "hud_interval": 8, "chain_segments": CHAIN_ROPE_SEGMENTS // 8},
+]
+
+# 內部解析度 (python main.py --render-scale 0.5)：攝影機、模擬與版面仍然以 SCREEN_WIDTH x SCREEN_HEIGHT 為準，
+# 只有畫布變小，世界精靈用快取的縮小圖片、HUD 用縮小的字型直接畫在畫布上，最後由 Presenter 放大到視窗
+MIN_RENDER_SCALE = 0.25
+
+# Surface 記憶體 (python main.py --memory-budget 64)：超過預算時依序丟棄可以重建的快取
+MEMORY_REPORT_KEY = pygame.K_F11  # 在終端機印出各類別的用量與最高值
+
+# 繪圖圖層：每幀所有系統把要畫的東西放進 RenderQueue，依圖層 (小的先畫) 一次送出
+LAYER_WALLS = 0
+LAYER_GOALS = 1
+LAYER_BOXES = 2
+LAYER_BOX_LABELS = 3
+LAYER_FRUITS = 4
+LAYER_WARNINGS = 5
+LAYER_METEORS = 6
+LAYER_PARTICLES = 7
+LAYER_CHAIN = 8
+LAYER_PLAYERS = 9
+LAYER_MESSAGES = 10  # 遊戲狀態訊息、HUD
+LAYER_REVIVE = 11
+LAYER_OVERLAY = 12  # 錄影標示
+
+
+# --- 命令列參數 ---
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description="雙人合作遊戲 Demo")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--host", type=int, nargs="?", const=NET_DEFAULT_PORT, metavar="PORT",
+                      help="開房間，本機是玩家1")
+    mode.add_argument("--join", metavar="HOST:PORT", help="加入房間，本機是玩家2")
+    parser.add_argument("--latency", type=float, default=0.0, help="模擬的單向延遲 (毫秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="模擬的延遲抖動 (毫秒)")
+    parser.add_argument("--loss", type=float, default=0.0, help="模擬的封包遺失率 (0~1)")
+    parser.add_argument("--players", type=int, choices=range(2, MAX_PLAYERS + 1), default=2, metavar="N",
+                        help=f"玩家人數 (2~{MAX_PLAYERS}，第 3 位以後用手把，只限本機)")
+    parser.add_argument("--bot", type=int, choices=range(1, MAX_PLAYERS + 1), metavar="N",
+                        help="由電腦控制第 N 位玩家 (只限本機)")
+    parser.add_argument("--record", nargs="?", const="", metavar="PATH",
+                        help=f"一開始就錄影，沒有指定路徑時存到 {RECORDINGS_DIR}/")
+    parser.add_argument("--telemetry", nargs="?", const=TELEMETRY_DIR, metavar="DIR",
+                        help=f"記錄遊玩事件 (死亡位置、復活、果實)，沒有指定資料夾時存到 {TELEMETRY_DIR}/")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Surface 記憶體預算 (MB)，超過時丟棄縮放快取、背景區塊、其他關卡的精靈等可重建的資料")
+    parser.add_argument("--memory-report", action="store_true", help="結束時印出 Surface 記憶體與物件池用量")
+    parser.add_argument("--no-hot-reload", action="store_true", help="不監看關卡與圖片檔 (預設修改後自動重新載入)")
+    parser.add_argument("--latency-report", action="store_true", help="結束時印出輸入到畫面的延遲 (p50/p95/p99)")
+    parser.add_argument("--latency-bench", type=float, metavar="SECONDS",
+                        help="用合成輸入自動遊玩指定秒數後結束並印出延遲 (不需要鍵盤，可在無視窗環境執行)")
+    parser.add_argument("--window", type=parse_size, metavar="WxH",
+                        help="視窗大小，畫面從畫布 (見 --render-scale) 一次縮放過去 (可以調整大小)")
+    parser.add_argument("--fullscreen", action="store_true", help="全螢幕 (畫布縮放到桌面大小)")
+    parser.add_argument("--scale", choices=SCALE_MODES, default=SCALE_AUTO,
+                        help="縮放方式：auto 整數倍最近鄰、其他平滑；nearest 只放大整數倍；smooth 平滑；gpu 交給顯示卡")
+    parser.add_argument("--render-scale", type=float, default=1.0, metavar="S",
+                        help=f"內部解析度 = {SCREEN_WIDTH}x{SCREEN_HEIGHT} 乘上 S ({MIN_RENDER_SCALE}~1)，"
+                             "低階電腦可用 0.5 以一半解析度繪製再放大到視窗 (遊戲範圍不變)")
+    args, _ = parser.parse_known_args()
+    if args.players != 2 and (args.host is not None or args.join):
+        parser.error("連線模式只支援兩名玩家")
+    if args.bot and args.bot > args.players:
+        parser.error(f"--bot 超過玩家人數 {args.players}")
+    if not MIN_RENDER_SCALE <= args.render_scale <= 1:
+        parser.error(f"--render-scale 必須在 {MIN_RENDER_SCALE}~1 之間")
+    return args
+
+
+cli_args = parse_command_line()
 
 # --- Pygame 初始化 ---
 pygame.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+# 遊戲建立的 Surface 都依類別登記在這裡 (動畫幀、屍體圖、靜態圖片、背景區塊、快取等)
+surface_memory = SurfaceMemory(int(cli_args.memory_budget * 1024 * 1024) if cli_args.memory_budget else None)
+# 所有東西都畫在 CANVAS_WIDTH x CANVAS_HEIGHT 的畫布 (screen) 上，presenter.present() 再一次縮放到視窗
+RENDER_SCALE = cli_args.render_scale
+CANVAS_WIDTH, CANVAS_HEIGHT = round(SCREEN_WIDTH * RENDER_SCALE), round(SCREEN_HEIGHT * RENDER_SCALE)
+
+
+def ui(length):
+    """邏輯畫面 (SCREEN_WIDTH x SCREEN_HEIGHT) 的長度 -> 畫布像素 (HUD 的邊距、字型大小、線寬等)。"""
+    return max(1, round(length * RENDER_SCALE))
+
+
+# 內部解析度比較小時視窗仍然是邏輯畫面的大小
+presenter = Presenter((CANVAS_WIDTH, CANVAS_HEIGHT),
+                      cli_args.window or (None if RENDER_SCALE == 1 else (SCREEN_WIDTH, SCREEN_HEIGHT)),
+                      cli_args.fullscreen, cli_args.scale)
+screen = surface_memory.track(presenter.canvas, "screen")
 pygame.display.set_caption("雙人合作遊戲 Demo - 果實能力")
 clock = pygame.time.Clock()
 
-# 圖片載入
-box_img = pygame.image.load("box.png").convert_alpha()
-spike_trap_img_out = pygame.image.load("spike_trap_out.png").convert_alpha()
-spike_trap_img_in = pygame.image.load("spike_trap_in.png").convert_alpha()
-
 # 加載支持中文的字體
 try:
     system_fonts = pygame.font.get_fonts()
@@ -92,44 +267,110 @@ try:
             break
     if chinese_font_name:
         font_path = pygame.font.match_font(chinese_font_name)
-        font_small = pygame.font.Font(font_path, 36)
-        font_large = pygame.font.Font(font_path, 74)
-        font_tiny = pygame.font.Font(font_path, 24)
-        font_effect = pygame.font.Font(font_path, 18)  # For effect timers
+        font_small = pygame.font.Font(font_path, ui(36))
+        font_large = pygame.font.Font(font_path, ui(74))
+        font_tiny = pygame.font.Font(font_path, ui(24))
+        font_effect = pygame.font.Font(font_path, ui(18))  # For effect timers
     else:
         print("警告：找不到中文字體，遊戲中的中文可能無法正確顯示")
-        font_small = pygame.font.Font(None, 36)
-        font_large = pygame.font.Font(None, 74)
-        font_tiny = pygame.font.Font(None, 24)
-        font_effect = pygame.font.Font(None, 18)
+        font_small = pygame.font.Font(None, ui(36))
+        font_large = pygame.font.Font(None, ui(74))
+        font_tiny = pygame.font.Font(None, ui(24))
+        font_effect = pygame.font.Font(None, ui(18))
 except Exception as e:
     print(f"載入字體時出錯：{e}")
-    font_small = pygame.font.Font(None, 36)
-    font_large = pygame.font.Font(None, 74)
-    font_tiny = pygame.font.Font(None, 24)
-    font_effect = pygame.font.Font(None, 18)
+    font_small = pygame.font.Font(None, ui(36))
+    font_large = pygame.font.Font(None, ui(74))
+    font_tiny = pygame.font.Font(None, ui(24))
+    font_effect = pygame.font.Font(None, ui(18))
+
+# --- 資源載入 (背景執行緒解碼 + 載入畫面) ---
+asset_loader = AssetLoader(track=surface_memory.tracker("decoded"))
+
+
+def draw_loading_screen(title, progress, label=""):
+    """畫載入進度條。"""
+    title_text = font_large.render(title, True, TEXT_COLOR)
+    screen.blit(title_text, (CANVAS_WIDTH // 2 - title_text.get_width() // 2, CANVAS_HEIGHT // 3))
+    bar_rect = pygame.Rect(CANVAS_WIDTH // 4, CANVAS_HEIGHT // 2, CANVAS_WIDTH // 2, ui(20))
+    pygame.draw.rect(screen, TEXT_COLOR, bar_rect, ui(2))
+    fill_rect = bar_rect.inflate(-ui(6), -ui(6))
+    fill_rect.width = int(fill_rect.width * progress)
+    pygame.draw.rect(screen, REVIVE_PROMPT_COLOR, fill_rect)
+    if label:
+        label_text = font_tiny.render(label, True, TEXT_COLOR)
+        screen.blit(label_text, (CANVAS_WIDTH // 2 - label_text.get_width() // 2, bar_rect.bottom + ui(10)))
+
+
+def run_loading_screen(job, title):
+    """遊戲開始前的載入畫面：每幀只做一小段收尾工作，其餘時間照常處理事件與畫面。"""
+    while not job.done:
+        clock.tick(FPS)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                asset_loader.shutdown()
+                pygame.quit()
+                raise SystemExit
+            presenter.handle_event(event)
+        job.poll(LOADING_BUDGET_MS)
+        screen.fill(BLACK)
+        draw_loading_screen(title, job.progress, job.current_label)
+        presenter.present()
+
+
+images = {}  # 靜態圖片
+STATIC_IMAGES = {"box": "box.png", "spike_trap_out": "spike_trap_out.png", "spike_trap_in": "spike_trap_in.png"}
+animation_library = {0: {}, 1: {}}  # 角色 (0 騎士、1 女巫) -> {動畫名稱: 幀列表}
+CHARACTER_SHEETS = ((KNIGHT_SHEETS, KNIGHT_FRAME_SIZE), (WITCH_SHEETS, WITCH_FRAME_SIZE))  # 依角色排列
+
+
+def queue_image(job, name, path):
+    def finalize(surface):
+        images[name] = surface_memory.track(surface.convert_alpha(), "static")
+    job.add(path, asset_loader.load_image(path), finalize)
+
+
+def queue_animation(job, player_id, name, path, num_frames, vertical, size):
+    def finalize(sheet):
+        frames = slice_sprite_sheet(sheet.convert_alpha(), num_frames, vertical, size, size, name=path)
+        animation_library[player_id][name] = surface_memory.track_all(frames, "animation")
+    job.add(path, asset_loader.load_image(path), finalize)
+
+
+startup_job = LoadingJob()
+for image_name, image_path in STATIC_IMAGES.items():
+    queue_image(startup_job, image_name, image_path)
+for character, (sheets, frame_size) in enumerate(CHARACTER_SHEETS):
+    for anim_name, (sheet_path, sheet_frames, sheet_vertical) in sheets.items():
+        queue_animation(startup_job, character, anim_name, sheet_path, sheet_frames, sheet_vertical, frame_size)
+run_loading_screen(startup_job, "載入中")
+
+box_img = images["box"]
+spike_trap_img_out = images["spike_trap_out"]
+spike_trap_img_in = images["spike_trap_in"]
 
 # --- OpenCV 視窗準備 (Not used by fruits) ---
+# 視窗在另一個行程 (paintwindow.py)，遊戲只讀寫共享記憶體裡的 paint_surface，不會被 OpenCV 的事件迴圈卡住
 use_opencv = False
 opencv_window_name = "P2 Paint Area (OpenCV)"
 paint_surface_width = 400
 paint_surface_height = 300
-paint_surface = np.zeros((paint_surface_height, paint_surface_width, 3), dtype=np.uint8) + 200
-
-
-def show_opencv_paint_window():
-    if use_opencv:
-        cv2.imshow(opencv_window_name, paint_surface)
-        key = cv2.waitKey(1) & 0xFF
+paint_canvas = None
+if use_opencv:
+    paint_canvas = SharedPaintCanvas(paint_surface_width, paint_surface_height, opencv_window_name).start()
+    paint_surface = paint_canvas.pixels
+else:
+    paint_surface = np.zeros((paint_surface_height, paint_surface_width, 3), dtype=np.uint8) + 200
 
 
 # --- 果實類別 ---
 class Fruit(pygame.sprite.Sprite):
-    def __init__(self, x, y, fruit_type):
+    images = {}  # fruit_type -> Surface
+
+    def __init__(self, x, y, fruit_type, index=0):
         super().__init__()
         self.fruit_type = fruit_type  # "mirror", "invisible_wall", "volcano"
-        self.image = pygame.Surface([FRUIT_RADIUS * 2, FRUIT_RADIUS * 2], pygame.SRCALPHA)  # SRCALPHA for transparency
-        # self.image.set_colorkey((0,0,0)) # Not needed if using SRCALPHA and drawing transparently
+        self.index = index  # 在關卡果實列表中的位置 (快照用)
 
         if fruit_type == "mirror":
             color = MIRROR_FRUIT_COLOR
@@ -139,21 +380,37 @@ class Fruit(pygame.sprite.Sprite):
             color = VOLCANO_FRUIT_COLOR
         else:
             color = (255, 255, 255)  # Default white
+        self.color = color
 
-        pygame.draw.circle(self.image, color, (FRUIT_RADIUS, FRUIT_RADIUS), FRUIT_RADIUS)
-        pygame.draw.circle(self.image, WHITE, (FRUIT_RADIUS, FRUIT_RADIUS), FRUIT_RADIUS, 2)  # Outline
+        # 同種類果實共用一張圖片，重新載入關卡時不必重畫
+        if fruit_type not in Fruit.images:
+            image = pygame.Surface([FRUIT_RADIUS * 2, FRUIT_RADIUS * 2], pygame.SRCALPHA)  # SRCALPHA for transparency
+            pygame.draw.circle(image, color, (FRUIT_RADIUS, FRUIT_RADIUS), FRUIT_RADIUS)
+            pygame.draw.circle(image, WHITE, (FRUIT_RADIUS, FRUIT_RADIUS), FRUIT_RADIUS, 2)  # Outline
+            Fruit.images[fruit_type] = surface_memory.track(image, "effects")
+        self.image = Fruit.images[fruit_type]
 
         self.rect = self.image.get_rect(center=(x, y))
 
 
 # --- 流星類別 (火山爆發效果) ---
 class Meteor(pygame.sprite.Sprite):
-    def __init__(self, x, y, lifetime=METEOR_FALL_TIME):
+    shared_image = None  # 所有流星共用同一張預先畫好的圖片
+
+    def __init__(self, x=0, y=0, lifetime=METEOR_FALL_TIME):
         super().__init__()
-        self.image = pygame.Surface([METEOR_SIZE, METEOR_SIZE], pygame.SRCALPHA)
-        pygame.draw.circle(self.image, METEOR_COLOR, (METEOR_SIZE // 2, METEOR_SIZE // 2), METEOR_SIZE // 2)
-        pygame.draw.ellipse(self.image, (0, 0, 0, 100), [0, 0, METEOR_SIZE, METEOR_SIZE], 2)  # Shadow effect
-        self.rect = self.image.get_rect(center=(x, y))
+        if Meteor.shared_image is None:
+            Meteor.shared_image = pygame.Surface([METEOR_SIZE, METEOR_SIZE], pygame.SRCALPHA)
+            pygame.draw.circle(Meteor.shared_image, METEOR_COLOR, (METEOR_SIZE // 2, METEOR_SIZE // 2), METEOR_SIZE // 2)
+            pygame.draw.ellipse(Meteor.shared_image, (0, 0, 0, 100), [0, 0, METEOR_SIZE, METEOR_SIZE], 2)  # Shadow effect
+            surface_memory.track(Meteor.shared_image, "effects")
+        self.image = Meteor.shared_image
+        self.rect = self.image.get_rect()
+        self.pool = None  # Set by SpritePool
+        self.spawn(x, y, lifetime)
+
+    def spawn(self, x, y, lifetime=METEOR_FALL_TIME):
+        self.rect.center = (x, y)
         self.active = True  # Kept for consistency, might not be needed if using lifetime
         self.lifetime = lifetime
         self.timer = 0
@@ -163,165 +420,264 @@ class Meteor(pygame.sprite.Sprite):
         if self.timer >= self.lifetime:
             self.kill()  # Remove meteor after its lifetime
 
+    def kill(self):
+        if self.alive():
+            super().kill()
+            if self.pool:
+                self.pool.release(self)
+
 
 # --- 警告標記類別 ---
 class Warning(pygame.sprite.Sprite):
-    def __init__(self, x, y, duration):
+    flash_frames = None  # 預先畫好的閃爍圖片 (依透明度分級)，所有警告共用
+    animate_flash = True  # 畫質降低時關閉閃爍，固定顯示最不透明的圖片 (計時不受影響)
+
+    def __init__(self, x=0, y=0, duration=METEOR_WARNING_TIME):
         super().__init__()
-        self.image = pygame.Surface([METEOR_SIZE * 1.5, METEOR_SIZE * 1.5],
-                                    pygame.SRCALPHA)  # Slightly larger than meteor
-        self.rect = self.image.get_rect(center=(x, y))
+        if Warning.flash_frames is None:
+            Warning.flash_frames = []
+            size = int(METEOR_SIZE * 1.5)  # Slightly larger than meteor
+            for i in range(WARNING_FLASH_LEVELS):
+                alpha = 63 + (255 - 63) * i // (WARNING_FLASH_LEVELS - 1)
+                frame = pygame.Surface([size, size], pygame.SRCALPHA)
+                pygame.draw.circle(frame, WARNING_COLOR + (alpha,), (size // 2, size // 2),
+                                   int(METEOR_SIZE * 0.75), 3)
+                Warning.flash_frames.append(surface_memory.track(frame, "effects"))
+        self.image = Warning.flash_frames[-1]
+        self.rect = self.image.get_rect()
+        self.pool = None  # Set by SpritePool
+        self.spawn(x, y, duration)
+
+    def spawn(self, x, y, duration=METEOR_WARNING_TIME):
+        self.rect.center = (x, y)
         self.duration = duration
         self.timer = 0
         self.spawn_pos = (x, y)  # Store where the meteor should spawn
 
     def update(self, dt):
         self.timer += dt
-        # Flashing effect
-        # Cycle alpha between ~64 and 255 over 0.5 seconds
-        flash_speed = 10
-        alpha = int(159 + 96 * math.sin(self.timer * flash_speed))
-        self.image.fill((0, 0, 0, 0))  # Clear previous frame
-        pygame.draw.circle(self.image, WARNING_COLOR + (alpha,), (self.rect.width // 2, self.rect.height // 2),
-                           int(METEOR_SIZE * 0.75), 3)
+        if Warning.animate_flash:
+            # Flashing effect
+            # Cycle alpha between ~64 and 255 over 0.5 seconds
+            flash_speed = 10
+            alpha = int(159 + 96 * math.sin(self.timer * flash_speed))
+            self.image = Warning.flash_frames[(alpha - 63) * (WARNING_FLASH_LEVELS - 1) // (255 - 63)]
+        else:
+            self.image = Warning.flash_frames[-1]
 
         if self.timer >= self.duration:
             self.kill()  # Remove warning
             return True  # Indicate meteor should spawn
         return False  # Continue updating
 
+    def kill(self):
+        if self.alive():
+            super().kill()
+            if self.pool:
+                self.pool.release(self)
+
 
 # --- 效果管理器 ---
+class Effect:
+    """單一進行中的果實效果。用 __slots__ 讓大量同時存在的效果保持輕量。"""
+    __slots__ = ("effect_type", "player_id", "name", "started_at", "expires_at", "stacks",
+                 "expire_seq", "meteor_at", "meteor_seq")
+
+    def __init__(self, effect_type, player_id, name, started_at, expires_at):
+        self.effect_type = effect_type
+        self.player_id = player_id
+        self.name = name
+        self.started_at = started_at
+        self.expires_at = expires_at
+        self.stacks = 1
+        # 目前有效的事件序號 (快照用)，0 表示沒有
+        self.expire_seq = 0
+        self.meteor_at = 0.0
+        self.meteor_seq = 0
+
+
 class EffectManager:
+    """
+    事件驅動的效果管理器：效果到期與流星生成都排進一個依時間排序的 heap，
+    update 只處理已到時的事件，不再每幀輪詢每個效果。每個事件的成本為 O(log n)。
+    """
+    EVENT_EXPIRE = 0
+    EVENT_METEOR = 1
+
     def __init__(self):
         self.default_laser_wall_alpha = 255
-        self.effects = {
-            "mirror_p1": {"active": False, "timer": 0, "name": "P1 反向"},
-            "mirror_p2": {"active": False, "timer": 0, "name": "P2 反向"},
-            "invisible_wall": {"active": False, "timer": 0, "flash_timer": 0,
-                               "current_alpha": self.default_laser_wall_alpha, "name": "牆壁隱形"},
-            # Start showing
-            "volcano": {"active": False, "timer": 0, "meteor_timer": 0, "name": "火山爆發"}
-        }
+        self.now = 0.0
+        self.effects = {}  # (effect_type, player_id) -> Effect
+        self._events = []  # heap of (time, seq, kind, key, token)
+        self._seq = 0
+        self._pending_meteors = 0
+
+    def _schedule(self, at, kind, key, token):
+        self._seq += 1
+        heapq.heappush(self._events, (at, self._seq, kind, key, token))
+        if kind == self.EVENT_EXPIRE:
+            token.expire_seq = self._seq
+        else:
+            token.meteor_at = at
+            token.meteor_seq = self._seq
 
-    def apply_effect(self, effect_type, player_id=None):
+    @staticmethod
+    def _effect_key(effect_type, player_id):
+        # Mirror is per player; the other effects are shared by everyone
+        return (effect_type, player_id if effect_type == "mirror" else None)
+
+    @staticmethod
+    def _effect_name(effect_type, player_id):
         if effect_type == "mirror":
-            if player_id == 0:
-                self.effects["mirror_p1"]["active"] = True
-                self.effects["mirror_p1"]["timer"] = FRUIT_EFFECT_DURATION
-            elif player_id == 1:
-                self.effects["mirror_p2"]["active"] = True
-                self.effects["mirror_p2"]["timer"] = FRUIT_EFFECT_DURATION
+            return f"P{player_id + 1} 反向"
         elif effect_type == "invisible_wall":
-            self.effects["invisible_wall"]["active"] = True
-            self.effects["invisible_wall"]["timer"] = FRUIT_EFFECT_DURATION
-            self.effects["invisible_wall"]["flash_timer"] = 0
-            self.effects["invisible_wall"]["current_alpha"] = 0  # Start fully transparent
-        elif effect_type == "volcano":
-            self.effects["volcano"]["active"] = True
-            self.effects["volcano"]["timer"] = FRUIT_EFFECT_DURATION
-            self.effects["volcano"]["meteor_timer"] = 0  # Reset meteor timer
+            return "牆壁隱形"
+        return "火山爆發"
+
+    def apply_effect(self, effect_type, player_id=None):
+        if effect_type not in ("mirror", "invisible_wall", "volcano"):
+            return
+        if effect_type == "mirror" and player_id is None:
+            return
+        key = self._effect_key(effect_type, player_id)
+        effect = self.effects.get(key)
+        if effect is not None:
+            # Stacking: each extra fruit adds a full duration on top of the remaining time
+            effect.stacks += 1
+            effect.expires_at += FRUIT_EFFECT_DURATION
+        else:
+            effect = Effect(effect_type, key[1], self._effect_name(*key), self.now, self.now + FRUIT_EFFECT_DURATION)
+            self.effects[key] = effect
+            if effect_type == "volcano":
+                # Spawn a meteor every 1 to 2 seconds; the interval is drawn once per meteor
+                self._schedule(self.now + sim_random.uniform(1.0, 2.0), self.EVENT_METEOR, key, effect)
+        self._schedule(effect.expires_at, self.EVENT_EXPIRE, key, effect)
 
     def update(self, dt):
-        # Update mirror effects
-        for key in ["mirror_p1", "mirror_p2"]:
-            if self.effects[key]["active"]:
-                self.effects[key]["timer"] -= dt
-                if self.effects[key]["timer"] <= 0:
-                    self.effects[key]["active"] = False
-
-        # Update invisible wall effect
-        if self.effects["invisible_wall"]["active"]:
-            self.effects["invisible_wall"]["timer"] -= dt
-            self.effects["invisible_wall"]["flash_timer"] += dt
-
-            target_alpha = 0  # Default to transparent during effect
-
-            if self.effects["invisible_wall"]["timer"] <= 0:
-                self.effects["invisible_wall"]["active"] = False
-                self.effects["invisible_wall"]["current_alpha"] = self.default_laser_wall_alpha  # Reset to default
-            else:
-                # Cycle logic for alpha: 5s total, 4s transparent, 1s fade in/out
-                cycle_duration = 5.0
-                hidden_duration = 4.0  # Transparent for 4 seconds
-                visible_duration = 1.0  # Visible (fading) for 1 second
-                fade_time = visible_duration / 2  # 0.5s for fade-in, 0.5s for fade-out
-
-                current_cycle_time = self.effects["invisible_wall"]["flash_timer"] % cycle_duration
-
-                if current_cycle_time < hidden_duration:  # Hidden phase
-                    target_alpha = 0
-                else:  # Visible phase (1 second duration)
-                    time_in_visible_phase = current_cycle_time - hidden_duration  # Ranges from 0.0 to 1.0
-
-                    if time_in_visible_phase < fade_time:  # Fade-in (e.g., 0 to 0.5s)
-                        # Interpolate alpha from 0 to 255
-                        target_alpha = int((time_in_visible_phase / fade_time) * 255)
-                    else:  # Fade-out (e.g., 0.5s to 1.0s)
-                        # Interpolate alpha from 255 to 0
-                        time_in_fade_out = time_in_visible_phase - fade_time
-                        target_alpha = int((1.0 - (time_in_fade_out / fade_time)) * 255)
-
-                self.effects["invisible_wall"]["current_alpha"] = max(0, min(255, target_alpha))
-        else:  # Effect not active
-            if self.effects["invisible_wall"]["current_alpha"] != self.default_laser_wall_alpha:
-                self.effects["invisible_wall"]["current_alpha"] = self.default_laser_wall_alpha
-
-
-        # Update volcano effect
-        if self.effects["volcano"]["active"]:
-            self.effects["volcano"]["timer"] -= dt
-            self.effects["volcano"]["meteor_timer"] += dt
-            if self.effects["volcano"]["timer"] <= 0:
-                self.effects["volcano"]["active"] = False
+        self.now += dt
+        events = self._events
+        while events and events[0][0] <= self.now:
+            at, _, kind, key, token = heapq.heappop(events)
+            effect = self.effects.get(key)
+            if effect is not token:
+                continue  # Stale event from an effect that already ended or was reset
+            if kind == self.EVENT_EXPIRE:
+                if at >= effect.expires_at:  # Ignore entries superseded by stacking
+                    del self.effects[key]
+            elif kind == self.EVENT_METEOR:
+                self._pending_meteors += 1
+                self._schedule(at + sim_random.uniform(1.0, 2.0), self.EVENT_METEOR, key, effect)
 
     def get_laser_wall_alpha(self):
-        if self.effects["invisible_wall"]["active"]:
-            return self.effects["invisible_wall"]["current_alpha"]
-        return self.default_laser_wall_alpha  # Default fully visible
+        effect = self.effects.get(("invisible_wall", None))
+        if effect is None:
+            return self.default_laser_wall_alpha  # Default fully visible
+
+        # Cycle logic for alpha: 5s total, 4s transparent, 1s fade in/out
+        cycle_duration = 5.0
+        hidden_duration = 4.0  # Transparent for 4 seconds
+        visible_duration = 1.0  # Visible (fading) for 1 second
+        fade_time = visible_duration / 2  # 0.5s for fade-in, 0.5s for fade-out
+
+        current_cycle_time = (self.now - effect.started_at) % cycle_duration
+        if current_cycle_time < hidden_duration:  # Hidden phase
+            target_alpha = 0
+        else:  # Visible phase (1 second duration)
+            time_in_visible_phase = current_cycle_time - hidden_duration  # Ranges from 0.0 to 1.0
+            if time_in_visible_phase < fade_time:  # Fade-in (e.g., 0 to 0.5s)
+                target_alpha = int((time_in_visible_phase / fade_time) * 255)
+            else:  # Fade-out (e.g., 0.5s to 1.0s)
+                time_in_fade_out = time_in_visible_phase - fade_time
+                target_alpha = int((1.0 - (time_in_fade_out / fade_time)) * 255)
+        return max(0, min(255, target_alpha))
 
     def is_mirror_active(self, player_id):
-        if player_id == 0:
-            return self.effects["mirror_p1"]["active"]
-        elif player_id == 1:
-            return self.effects["mirror_p2"]["active"]
-        return False
-
-
+        return ("mirror", player_id) in self.effects
 
     def should_spawn_meteor(self):
-        # Spawn meteor every 1 to 2 seconds randomly
-        return (self.effects["volcano"]["active"] and
-                self.effects["volcano"]["meteor_timer"] >= random.uniform(1.0, 2.0))
+        return self._pending_meteors > 0
 
     def reset_meteor_timer(self):
-        self.effects["volcano"]["meteor_timer"] = 0
+        if self._pending_meteors > 0:
+            self._pending_meteors -= 1
 
     def reset_all_effects(self):
-        for effect_key in self.effects:
-            self.effects[effect_key]["active"] = False
-            self.effects[effect_key]["timer"] = 0
-            if "flash_timer" in self.effects[effect_key]:
-                self.effects[effect_key]["flash_timer"] = 0
-            if "showing" in self.effects[effect_key]:  # Ensure walls are visible on reset
-                self.effects[effect_key]["showing"] = True
-            if "meteor_timer" in self.effects[effect_key]:
-                self.effects[effect_key]["meteor_timer"] = 0
-            if effect_key == "invisible_wall":
-                self.effects[effect_key]["current_alpha"] = self.default_laser_wall_alpha
+        self.now = 0.0
+        self._seq = 0
+        self.effects.clear()
+        self._events.clear()
+        self._pending_meteors = 0
+
+    # 快照格式：標頭 (now, seq, 待生成流星數, 效果數)，每個效果 (key, 開始, 到期, 疊加數, 到期事件序號,
+    # 下一顆流星時間, 流星事件序號)。被疊加取代的舊到期事件不影響結果，不必保存。
+    STATE_HEADER = struct.Struct("<dIHB")
+    STATE_EFFECT = struct.Struct("<BddHIdI")
+    EFFECT_KEYS = tuple(("mirror", player_id) for player_id in range(MAX_PLAYERS)) + \
+        (("invisible_wall", None), ("volcano", None))
+    STATE_MAX_SIZE = STATE_HEADER.size + STATE_EFFECT.size * len(EFFECT_KEYS)
+
+    def pack_state(self, buffer, offset):
+        """把效果與排程中的事件寫進 buffer[offset:]，回傳結束位置。"""
+        self.STATE_HEADER.pack_into(buffer, offset, self.now, self._seq, self._pending_meteors, len(self.effects))
+        offset += self.STATE_HEADER.size
+        for key, effect in self.effects.items():
+            self.STATE_EFFECT.pack_into(buffer, offset, self.EFFECT_KEYS.index(key), effect.started_at,
+                                        effect.expires_at, effect.stacks, effect.expire_seq, effect.meteor_at,
+                                        effect.meteor_seq)
+            offset += self.STATE_EFFECT.size
+        return offset
+
+    def unpack_state(self, buffer, offset):
+        self.now, self._seq, self._pending_meteors, count = self.STATE_HEADER.unpack_from(buffer, offset)
+        offset += self.STATE_HEADER.size
+        previous = self.effects
+        self.effects = {}
+        self._events = []
+        for _ in range(count):
+            key_index, started_at, expires_at, stacks, expire_seq, meteor_at, meteor_seq = \
+                self.STATE_EFFECT.unpack_from(buffer, offset)
+            offset += self.STATE_EFFECT.size
+            key = self.EFFECT_KEYS[key_index]
+            effect = previous.get(key)
+            if effect is None:
+                effect = Effect(key[0], key[1], self._effect_name(*key), started_at, expires_at)
+            effect.started_at = started_at
+            effect.expires_at = expires_at
+            effect.stacks = stacks
+            effect.expire_seq = expire_seq
+            effect.meteor_at = meteor_at
+            effect.meteor_seq = meteor_seq
+            self.effects[key] = effect
+            if expire_seq:
+                self._events.append((expires_at, expire_seq, self.EVENT_EXPIRE, key, effect))
+            if meteor_seq:
+                self._events.append((meteor_at, meteor_seq, self.EVENT_METEOR, key, effect))
+        heapq.heapify(self._events)
+        return offset
 
     def get_active_effects_info(self):
         info = []
-        for key, data in self.effects.items():
-            if data["active"]:
-                timer_str = f"{data['timer']:.1f}s"
-                info.append(f"{data['name']}: {timer_str}")
+        for effect in self.effects.values():
+            timer_str = f"{effect.expires_at - self.now:.1f}s"
+            stack_str = f" x{effect.stacks}" if effect.stacks > 1 else ""
+            info.append(f"{effect.name}{stack_str}: {timer_str}")
         return info
 
 
 # --- 玩家類別 ---
+flipped_frames = weakref.WeakKeyDictionary()  # 動畫幀 -> 左右翻轉的版本 (幀被熱重載換掉時自動消失)
+
+
+def flipped(frame):
+    """面向左邊時用的翻轉幀，每張只翻轉一次 (每幀都產生新的 Surface 時，縮小畫布的快取永遠用不到)。"""
+    result = flipped_frames.get(frame)
+    if result is None:
+        result = flipped_frames[frame] = surface_memory.track(pygame.transform.flip(frame, True, False), "flipped")
+    return result
+
+
 class Player(pygame.sprite.Sprite):
-    def __init__(self, x, y, alive_color, dead_color, control_keys, player_id):
+    def __init__(self, x, y, alive_color, dead_color, control_keys, player_id, animations=None):
         super().__init__()
         self.start_pos = pygame.math.Vector2(x, y)
         self.pos = pygame.math.Vector2(x, y)
@@ -333,24 +689,27 @@ class Player(pygame.sprite.Sprite):
         self.walk_frames = []
         self.idle_frames = []
 
-        if self.player_id == 0:
-            self.walk_frames = load_knight_run_animation(target_width=PLAYER_RADIUS * 8,target_height=PLAYER_RADIUS * 8)
-            self.idle_frames = load_knight_idle_animation(target_width=PLAYER_RADIUS * 8,target_height=PLAYER_RADIUS * 8)
+        # animations: 預先載入好的 {動畫名稱: 幀列表}；沒有提供時才同步載入
+        self.animations = animations or {}
+        if self.player_id % 2 == 0:
+            self.walk_frames = self.animations.get("walk") or load_knight_run_animation(
+                target_width=KNIGHT_FRAME_SIZE, target_height=KNIGHT_FRAME_SIZE)
+            self.idle_frames = self.animations.get("idle") or load_knight_idle_animation(
+                target_width=KNIGHT_FRAME_SIZE, target_height=KNIGHT_FRAME_SIZE)
             self.is_witch = False
             self.frame_interval = 0.2
             self.idle_frame_interval = 0.3
-        elif self.player_id == 1:
+        else:
             self.is_witch = True
-            self.walk_frames = load_witch_run_animation(target_width=PLAYER_RADIUS * 4, target_height=PLAYER_RADIUS * 4)
-            self.idle_frames = load_witch_idle_animation(target_width=PLAYER_RADIUS * 4,target_height=PLAYER_RADIUS * 4)
+            self.walk_frames = self.animations.get("walk") or load_witch_run_animation(
+                target_width=WITCH_FRAME_SIZE, target_height=WITCH_FRAME_SIZE)
+            self.idle_frames = self.animations.get("idle") or load_witch_idle_animation(
+                target_width=WITCH_FRAME_SIZE, target_height=WITCH_FRAME_SIZE)
             self.frame_interval = 0.2
             self.idle_frame_interval = 0.3
 
         self.dead_frames = []
-        for frame in self.walk_frames:
-            dead_frame = frame.copy()
-            dead_frame.set_alpha(100)
-            self.dead_frames.append(dead_frame)
+        self._build_dead_frames()
 
         self.current_frame = 0
         self.frame_timer = 0
@@ -361,6 +720,7 @@ class Player(pygame.sprite.Sprite):
 
         self.is_alive = True
         self.death_pos = None
+        self.death_cause = CAUSE_UNKNOWN
 
         # For death shake animation
         self.is_shaking = False
@@ -369,6 +729,23 @@ class Player(pygame.sprite.Sprite):
         self.shake_magnitude = 4  # pixels for shake intensity
         self.original_death_pos_for_shake = None  # Stores the position around which to shake
 
+    def _build_dead_frames(self):
+        self.dead_frames = []
+        for frame in self.walk_frames:
+            dead_frame = frame.copy()
+            dead_frame.set_alpha(100)
+            self.dead_frames.append(surface_memory.track(dead_frame, "dead_frames"))
+
+    def refresh_frames(self):
+        """動畫幀被熱重載換掉後 (walk_frames、idle_frames 是同一個列表物件) 重建屍體圖與目前的圖片。"""
+        self._build_dead_frames()
+        self.current_frame %= len(self.walk_frames)
+        if self.is_alive:
+            frame = self.walk_frames[self.current_frame]
+            self.image = flipped(frame) if self.facing_left else frame
+        else:
+            self._update_dead_image()
+
     def reset(self):
         self.pos = pygame.math.Vector2(self.start_pos.x, self.start_pos.y)
         self.is_alive = True
@@ -398,9 +775,10 @@ class Player(pygame.sprite.Sprite):
         self.original_death_pos_for_shake = None  # Clear shake-related temp state
         self.death_pos = None  # Player is no longer considered "at a death position"
 
-    def die(self):
+    def die(self, cause=CAUSE_UNKNOWN):
         if self.is_alive:  # Only proceed if player was alive
             self.is_alive = False
+            self.death_cause = cause  # 只給遙測使用，不影響模擬
             # Guard against re-triggering shake if somehow called multiple times rapidly
             if not self.is_shaking and self.death_pos is None:
                 self.death_pos = self.pos.copy()  # Final resting position after shake
@@ -413,13 +791,13 @@ class Player(pygame.sprite.Sprite):
 
     # MODIFIED: update_movement to integrate fruit effects
     def update_movement(self, laser_walls, coop_boxes=None, spike_trap_group=None, meteor_sprites=None,
-                        effect_manager=None, dt=0.016):
+                        dt=0.016, frame=NO_INPUT):
         if not self.is_alive:
             if self.is_shaking:
                 self.shake_timer -= dt
                 if self.shake_timer > 0 and self.original_death_pos_for_shake:
-                    offset_x = random.uniform(-self.shake_magnitude, self.shake_magnitude)
-                    offset_y = random.uniform(-self.shake_magnitude, self.shake_magnitude)
+                    offset_x = sim_random.uniform(-self.shake_magnitude, self.shake_magnitude)
+                    offset_y = sim_random.uniform(-self.shake_magnitude, self.shake_magnitude)
                     self.rect.centerx = self.original_death_pos_for_shake.x + offset_x
                     self.rect.centery = self.original_death_pos_for_shake.y + offset_y
                     # self.pos should remain self.original_death_pos_for_shake
@@ -438,25 +816,14 @@ class Player(pygame.sprite.Sprite):
                 self._update_dead_image()
             return
 
-        keys = pygame.key.get_pressed()
-        movement_vector = pygame.math.Vector2(0, 0)
-
-        mirror_active = effect_manager and effect_manager.is_mirror_active(self.player_id)
-
-        up_key_actual = self.control_keys['down'] if mirror_active else self.control_keys['up']
-        down_key_actual = self.control_keys['up'] if mirror_active else self.control_keys['down']
-        left_key_actual = self.control_keys['right'] if mirror_active else self.control_keys['left']
-        right_key_actual = self.control_keys['left'] if mirror_active else self.control_keys['right']
-
-        if keys[up_key_actual]: movement_vector.y = -1
-        if keys[down_key_actual]: movement_vector.y = 1
-        if keys[left_key_actual]: movement_vector.x = -1
-        if keys[right_key_actual]: movement_vector.x = 1
+        # frame.moves 已經套用過鏡像效果
+        movement_vector = pygame.math.Vector2(frame.move(self.player_id))
 
         # Determine facing direction based on NON-MIRRORED input for animation
-        if keys[self.control_keys['left']]:
+        raw_bits = frame.bits[self.player_id]
+        if raw_bits & INPUT_LEFT:
             self.facing_left = True
-        elif keys[self.control_keys['right']]:
+        elif raw_bits & INPUT_RIGHT:
             self.facing_left = False
 
         is_moving = movement_vector.length_squared() > 0
@@ -464,6 +831,7 @@ class Player(pygame.sprite.Sprite):
         if is_moving:
             movement_vector.normalize_ip()
             movement_vector *= PLAYER_SPEED
+            self._confine_to_view(movement_vector)
 
         tentative_pos = self.pos + movement_vector
 
@@ -492,7 +860,7 @@ class Player(pygame.sprite.Sprite):
                     collided_with_laser = True;
                     break
         if collided_with_laser:
-            self.die()
+            self.die(CAUSE_LASER)
             return
 
         # Update tentative_pos based on adjusted movement_vector (if hit laser)
@@ -520,7 +888,7 @@ class Player(pygame.sprite.Sprite):
                 # Player attempts to move into the spike's area
                 if spike.is_dangerous() and final_tentative_rect.colliderect(spike.rect):
                     # Death should occur at self.pos (position *before* moving into spike)
-                    self.die()
+                    self.die(CAUSE_SPIKE)
                     return  # Exit update_movement
 
         # Meteor Collision
@@ -529,17 +897,29 @@ class Player(pygame.sprite.Sprite):
                 # Player attempts to move into the meteor's area
                 if final_tentative_rect.colliderect(meteor.rect):
                     # Death should occur at self.pos (position *before* moving into meteor)
-                    self.die()
+                    self.die(CAUSE_METEOR)
                     return  # Exit update_movement
 
         # Final position update
         self.pos += movement_vector
-        self.pos.x = max(self.rect.width // 2, min(self.pos.x, SCREEN_WIDTH - self.rect.width // 2))
-        self.pos.y = max(self.rect.height // 2, min(self.pos.y, SCREEN_HEIGHT - self.rect.height // 2))
+        self.pos.x = max(self.rect.width // 2, min(self.pos.x, world_rect.width - self.rect.width // 2))
+        self.pos.y = max(self.rect.height // 2, min(self.pos.y, world_rect.height - self.rect.height // 2))
         self.rect.center = self.pos
 
         self._update_alive_image(is_moving)
 
+    def _confine_to_view(self, movement_vector):
+        """
+        不能走出攝影機畫面，所有玩家永遠都在畫面上 (攝影機也在遊戲狀態裡，連線時兩邊結果相同)。
+        已經在畫面外 (例如關卡起點相距太遠) 時只能往畫面內走，不會被瞬間拉回來。
+        """
+        view = camera.rect
+        half_width, half_height = self.rect.width // 2, self.rect.height // 2
+        x, y = self.pos
+        target_x = min(max(x + movement_vector.x, min(x, view.left + half_width)), max(x, view.right - half_width))
+        target_y = min(max(y + movement_vector.y, min(y, view.top + half_height)), max(y, view.bottom - half_height))
+        movement_vector.update(target_x - x, target_y - y)
+
     def _update_alive_image(self, is_moving):
         """更新存活狀態的圖片"""
         # keys = pygame.key.get_pressed() # facing_left is now handled in update_movement
@@ -568,7 +948,7 @@ class Player(pygame.sprite.Sprite):
                 frame = self.idle_frames[self.current_frame]
 
         if self.facing_left:
-            frame = pygame.transform.flip(frame, True, False)
+            frame = flipped(frame)
 
         self.image = frame
 
@@ -590,11 +970,42 @@ class Player(pygame.sprite.Sprite):
         # If you want an animated death (beyond shake), this would be more complex
         frame = self.dead_frames[0]  # Or some other logic for dead sprite
         if self.facing_left:
-            frame = pygame.transform.flip(frame, True, False)
+            frame = flipped(frame)
         self.image = frame
 
-    def draw(self, surface):
-        surface.blit(self.image, self.rect)
+    def draw(self, surface, offset=(0, 0)):
+        surface.blit(self.image, self.rect.move(-offset[0], -offset[1]))
+
+    # 快照格式：pos, rect.center, 旗標, shake_timer, death_pos, 震動中心, current_frame, frame_timer
+    STATE = struct.Struct("<ddiiBdddddHd")
+
+    def pack_state(self, buffer, offset):
+        """把模擬狀態寫進 buffer[offset:] (圖片由狀態推回，不存)，回傳結束位置。"""
+        death_pos = self.death_pos or (0.0, 0.0)
+        shake_center = self.original_death_pos_for_shake or (0.0, 0.0)
+        flags = (self.is_alive | self.is_shaking << 1 | self.facing_left << 2 |
+                 (self.death_pos is not None) << 3 | (self.original_death_pos_for_shake is not None) << 4)
+        self.STATE.pack_into(buffer, offset, self.pos.x, self.pos.y, self.rect.centerx, self.rect.centery, flags,
+                             self.shake_timer, death_pos[0], death_pos[1], shake_center[0], shake_center[1],
+                             self.current_frame, self.frame_timer)
+        return offset + self.STATE.size
+
+    def unpack_state(self, buffer, offset):
+        (x, y, center_x, center_y, flags, self.shake_timer, death_x, death_y, shake_x, shake_y,
+         self.current_frame, self.frame_timer) = self.STATE.unpack_from(buffer, offset)
+        self.is_alive = bool(flags & 1)
+        self.is_shaking = bool(flags & 2)
+        self.facing_left = bool(flags & 4)
+        self.pos = pygame.math.Vector2(x, y)
+        self.death_pos = pygame.math.Vector2(death_x, death_y) if flags & 8 else None
+        self.original_death_pos_for_shake = pygame.math.Vector2(shake_x, shake_y) if flags & 16 else None
+        if self.is_alive:
+            frame = self.walk_frames[self.current_frame % len(self.walk_frames)]
+            self.image = flipped(frame) if self.facing_left else frame
+        else:
+            self._update_dead_image()
+        self.rect = self.image.get_rect(center=(center_x, center_y))
+        return offset + self.STATE.size
 
     def _make_grayscale(self, surface):  # Keep this utility if needed elsewhere
         grayscale_surface = surface.copy()
@@ -613,7 +1024,7 @@ class LaserWall(pygame.sprite.Sprite):
         super().__init__()
         self.original_color = LASER_WALL_COLOR # Store the base color
         # Create the image that will be drawn. It needs SRCALPHA to support transparency.
-        self.image = pygame.Surface([width, height], pygame.SRCALPHA)
+        self.image = surface_memory.track(pygame.Surface([width, height], pygame.SRCALPHA), "walls")
         # Fill with opaque color initially (alpha = 255)
         self.image.fill((self.original_color[0], self.original_color[1], self.original_color[2], 255))
         self.rect = self.image.get_rect(topleft=(x, y))
@@ -625,28 +1036,36 @@ class LaserWall(pygame.sprite.Sprite):
             self._current_alpha = alpha_value
             # Re-fill the surface with the original color but new alpha
             self.image.fill((self.original_color[0], self.original_color[1], self.original_color[2], self._current_alpha))
+            render_queue.forget(self.image)  # 縮小的版本也要重新產生
 
 
 # --- 目標類別 (顏色地板) ---
 class Goal(pygame.sprite.Sprite):
     def __init__(self, x, y, color, player_id_target):
         super().__init__()
-        self.image = pygame.Surface([int(PLAYER_RADIUS * 2.5), int(PLAYER_RADIUS * 2.5)])
-        self.image.fill(color)
-        self.rect = self.image.get_rect(center=(x, y))
+        self.base_image = pygame.Surface([GOAL_SIZE, GOAL_SIZE])
+        self.base_image.fill(color)
+        # 站上目標時的外框預先畫好，繪圖時只要換一張圖 (一次 blit)
+        self.active_image = self.base_image.copy()
+        pygame.draw.rect(self.active_image, WHITE, self.active_image.get_rect(), 3)
+        surface_memory.track(self.base_image, "goals")
+        surface_memory.track(self.active_image, "goals")
+        self.rect = self.base_image.get_rect(center=(x, y))
         self.player_id_target = player_id_target
         self.is_active = False
 
+    @property
+    def image(self):
+        return self.active_image if self.is_active else self.base_image
+
     def update_status(self, player):
         if player.is_alive and self.rect.colliderect(player.rect) and player.player_id == self.player_id_target:
             self.is_active = True
         else:
             self.is_active = False
 
-    def draw(self, surface):
-        surface.blit(self.image, self.rect)
-        if self.is_active:
-            pygame.draw.rect(surface, WHITE, self.rect, 3)
+    def draw(self, surface, offset=(0, 0)):
+        surface.blit(self.image, self.rect.move(-offset[0], -offset[1]))
 
 
 # --- 協力推箱子類別 ---
@@ -658,11 +1077,20 @@ class CoopBox(pygame.sprite.Sprite):
         self.rect = pygame.Rect(0, 0, self.collision_size, self.collision_size)
         self.rect.center = (x, y)
         self.pos = pygame.math.Vector2(x, y)
+        self.set_image(img)
+
+    def set_image(self, img):
+        """設定 (或熱重載時更換) 箱子的圖片，None 表示用純色方塊。"""
         if img:
             self.image = pygame.transform.scale(img, (self.display_size, self.display_size))
         else:
             self.image = pygame.Surface([self.display_size, self.display_size])
             self.image.fill(COOP_BOX_COLOR)
+        surface_memory.track(self.image, "boxes")
+
+    def reset(self, x, y):
+        self.pos = pygame.math.Vector2(x, y)
+        self.rect.center = (x, y)
 
     def move(self, direction, obstacles):
         tentative_pos = self.pos + direction * COOP_BOX_SPEED
@@ -672,19 +1100,24 @@ class CoopBox(pygame.sprite.Sprite):
             if test_rect.colliderect(obs.rect) and isinstance(obs, LaserWall):  # Ensure it's a LaserWall
                 # LaserWalls (even if visually transparent due to fruit) should block the box.
                 return  # Blocked by any laser wall
-        if not (self.collision_size // 2 <= tentative_pos.x <= SCREEN_WIDTH - self.collision_size // 2 and
-                self.collision_size // 2 <= tentative_pos.y <= SCREEN_HEIGHT - self.collision_size // 2):
+        if not (self.collision_size // 2 <= tentative_pos.x <= world_rect.width - self.collision_size // 2 and
+                self.collision_size // 2 <= tentative_pos.y <= world_rect.height - self.collision_size // 2):
             return  # Out of bounds
         self.pos = tentative_pos
         self.rect.center = self.pos
 
-    def draw(self, surface):
-        img_rect = self.image.get_rect(center=self.rect.center)
-        surface.blit(self.image, img_rect)
+    def screen_rect(self, offset=(0, 0)):
+        """圖片 (比碰撞框大) 在畫面上的位置。"""
+        return self.image.get_rect(center=(self.rect.centerx - offset[0], self.rect.centery - offset[1]))
+
+    def draw(self, surface, offset=(0, 0)):
+        surface.blit(self.image, self.screen_rect(offset))
 
 
 # ---地刺類別---
 class SpikeTrap(pygame.sprite.Sprite):
+    scaled_images = {}  # (id(img), width, height) -> 縮放後的圖片，同尺寸地刺共用
+
     def __init__(self, x, y, width=40, height=40, out_time=1.0, in_time=1.5, phase_offset=0.0,
                  img_out=None, img_in=None):
         super().__init__()
@@ -692,6 +1125,7 @@ class SpikeTrap(pygame.sprite.Sprite):
         self.out_time = out_time
         self.in_time = in_time
         self.cycle_time = self.out_time + self.in_time
+        self.phase_offset = phase_offset
         self.timer = phase_offset
         self.active = False
         self.img_out = img_out
@@ -702,10 +1136,15 @@ class SpikeTrap(pygame.sprite.Sprite):
         phase = self.timer % self.cycle_time
         self.active = phase < self.out_time
 
+    def reset(self):
+        self.timer = self.phase_offset
+        self.active = False
+
     def is_dangerous(self):
         return self.active
 
-    def draw(self, surface):
+    def draw(self, surface, offset=(0, 0)):
+        screen_rect = self.rect.move(-offset[0], -offset[1])
         current_img = None
         if self.active and self.img_out:
             current_img = self.img_out
@@ -713,60 +1152,26 @@ class SpikeTrap(pygame.sprite.Sprite):
             current_img = self.img_in
 
         if current_img:
-            img_scaled = pygame.transform.scale(current_img, (self.rect.width, self.rect.height))
-            surface.blit(img_scaled, self.rect)
+            key = (id(current_img), self.rect.width, self.rect.height)
+            img_scaled = SpikeTrap.scaled_images.get(key)
+            if img_scaled is None:
+                img_scaled = surface_memory.track(
+                    pygame.transform.scale(current_img, (self.rect.width, self.rect.height)), "spike_cache")
+                SpikeTrap.scaled_images[key] = img_scaled
+            surface.blit(img_scaled, screen_rect)
         else:
             color = DANGER_COLOR if self.active else SAFE_COLOR
-            pygame.draw.rect(surface, color, self.rect)
+            pygame.draw.rect(surface, color, screen_rect)
 
 
 # --- 關卡資料 ---
-levels_data = [
-    {
-        "player1_start": (100, SCREEN_HEIGHT // 2),
-        "player2_start": (150, SCREEN_HEIGHT // 2),
-        "goal1_pos": (SCREEN_WIDTH - 50, 100),
-        "goal2_pos": (SCREEN_WIDTH - 50, SCREEN_HEIGHT - 100),
-        "laser_walls": [
-            (SCREEN_WIDTH // 2 - 10, 150, 20, SCREEN_HEIGHT - 300),
-            (200, SCREEN_HEIGHT // 2 - 10, SCREEN_WIDTH // 2 - 200 - 10, 10),
-            (SCREEN_WIDTH // 2 + 10, SCREEN_HEIGHT // 2 - 10, SCREEN_WIDTH // 2 - 20 - 10, 10),
-        ],
-        "coop_box_start": [(SCREEN_WIDTH // 4, SCREEN_HEIGHT // 4), (SCREEN_WIDTH // 4 + 50, SCREEN_HEIGHT // 4 + 50)],
-        "spike_traps": [
-            (40, 40, 40, 40, 1.0, 2.0, 0.0),
-            (100, 40, 40, 40, 0.7, 1.5, 0.5),
-            (160, 40, 40, 40, 1.2, 1.0, 1.0),
-        ],
-        "fruits": [  # Added fruits for level 1
-            (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100, "mirror"),
-            (200, 100, "invisible_wall"),
-            (SCREEN_WIDTH - 200, SCREEN_HEIGHT - 100, "volcano"),
-        ]
-    },
-    {
-        "player1_start": (50, 50),
-        "player2_start": (100, 50),
-        "goal1_pos": (SCREEN_WIDTH - 50, SCREEN_HEIGHT - 50),
-        "goal2_pos": (SCREEN_WIDTH - 100, SCREEN_HEIGHT - 50),
-        "laser_walls": [
-            (0, 0, SCREEN_WIDTH, 20), (0, SCREEN_HEIGHT - 20, SCREEN_WIDTH, 20),
-            (0, 0, 20, SCREEN_HEIGHT), (SCREEN_WIDTH - 20, 0, 20, SCREEN_HEIGHT),
-            (150, 20, 20, SCREEN_HEIGHT // 2),
-            (150, SCREEN_HEIGHT // 2 + 50, 20, SCREEN_HEIGHT // 2 - 70),
-            (SCREEN_WIDTH - 150, 20, 20, SCREEN_HEIGHT // 2 - 50),
-            (SCREEN_WIDTH - 150, SCREEN_HEIGHT // 2, 20, SCREEN_HEIGHT // 2 - 20),
-            (150, SCREEN_HEIGHT // 3, SCREEN_WIDTH - 300, 20),
-            (150, SCREEN_HEIGHT * 2 // 3, SCREEN_WIDTH - 300, 20),
-        ],
-        "coop_box_start": [(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)],  # Ensure this is a list of tuples for consistency
-        "fruits": [  # Added fruits for level 2
-            (SCREEN_WIDTH // 3, SCREEN_HEIGHT // 3, "volcano"),
-            (SCREEN_WIDTH * 2 // 3, SCREEN_HEIGHT * 2 // 3, "mirror"),
-            (SCREEN_WIDTH // 2, 100, "invisible_wall"),
-        ]
-    }
-]
+# 關卡放在 levels/*.json，每關只編譯一次 (見 levels.py)
+level_cache = LevelCache(LEVELS_DIR, screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT,
+                         fruit_radius=FRUIT_RADIUS, box_size=COOP_BOX_SIZE, goal_size=GOAL_SIZE)
+current_level = None  # 目前關卡的 CompiledLevel
+world_rect = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)  # 目前關卡的世界範圍
+camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT)
+level_time = 0.0  # 關卡開始後經過的時間，地刺狀態由它直接算出
 current_level_index = 0
 
 # --- 遊戲物件群組 ---
@@ -779,28 +1184,183 @@ spike_trap_group = pygame.sprite.Group()
 fruit_sprites = pygame.sprite.Group()  # New group for fruits
 meteor_sprites = pygame.sprite.Group()  # New group for meteors
 warning_sprites = pygame.sprite.Group()  # New group for warnings
+particle_system = ParticleSystem(PARTICLE_CAPACITY)
+meteor_pool = SpritePool(Meteor, METEOR_POOL_CAPACITY)
+warning_pool = SpritePool(Warning, WARNING_POOL_CAPACITY)
 
 # --- 遊戲物件實體 ---
-player1 = Player(0, 0, PLAYER1_COLOR, PLAYER1_DEAD_COLOR,
-                 {'up': pygame.K_w, 'down': pygame.K_s, 'left': pygame.K_a, 'right': pygame.K_d}, 0)
-player2 = Player(0, 0, PLAYER2_COLOR, PLAYER2_DEAD_COLOR,
-                 {'up': pygame.K_UP, 'down': pygame.K_DOWN, 'left': pygame.K_LEFT, 'right': pygame.K_RIGHT}, 1)
-player_sprites.add(player1, player2)
-
-goal1 = Goal(0, 0, GOAL_P1_COLOR, 0)
-goal2 = Goal(0, 0, GOAL_P2_COLOR, 1)
+# 玩家、目標、鎖鏈都依 player_id 放在列表裡，人數由 --players 決定
+players = [Player(0, 0, PLAYER_COLORS[i], PLAYER_DEAD_COLORS[i],
+                  PLAYER_CONTROL_KEYS[i] if i < len(PLAYER_CONTROL_KEYS) else None, i,
+                  animations=animation_library[i % 2]) for i in range(cli_args.players)]
+player_sprites.add(players)
+input_devices = InputDevices([player.control_keys for player in players],
+                             [PLAYER_REVIVE_KEYS[i] if i < len(PLAYER_REVIVE_KEYS) else None
+                              for i in range(len(players))],
+                             REWIND_KEY, GAMEPAD_DEADZONE)
+
+goals = [Goal(0, 0, GOAL_COLORS[i], i) for i in range(len(players))]
 # coop_box is loaded per level
 
 effect_manager = EffectManager()  # Initialize EffectManager
-
-
-def load_level(level_idx):
-    global game_state
-    if level_idx >= len(levels_data):
-        game_state = STATE_ALL_LEVELS_COMPLETE
-        return
-
-    level = levels_data[level_idx]
+sim_random = SimRandom()  # 遊戲規則用的亂數 (流星位置、間隔、死亡震動)，狀態可以放進快照
+snapshot_ring = SnapshotRing(FPS * SNAPSHOT_HISTORY_SECONDS)  # 每個 tick 的快照，倒轉用
+quick_save = None  # (關卡索引, 快照)
+rewinding = False
+proximity = None  # 這個 tick 的 ProximityContext (update_proximity 建立)
+
+frame_budget = FrameBudget(FRAME_BUDGET_MS, len(QUALITY_LEVELS))
+hud_items = None  # 快取的 HUD 文字 [(Surface, 位置)]，畫質降低時不必每幀重新 render
+hud_age = 0
+
+chain_graph = None  # 載入關卡時依關卡的 "chain_links" 重建
+chain_ropes = []  # 每條鎖鏈一條繩索 (只影響畫面)，與 chain_graph.links 一一對應
+
+
+def memory_report():
+    """Surface 記憶體統計，後面加上隕石與警告物件池的使用情形。"""
+    lines = [surface_memory.report(), "物件池"]
+    for name, pool in (("隕石", meteor_pool), ("警告", warning_pool)):
+        stats = pool.stats()
+        lines.append(f"  {name:<10} 使用中 {stats['in_use']} (最高 {stats['peak_in_use']})  "
+                     f"閒置 {stats['free']}/{stats['capacity']}  新建 {stats['allocations']}  "
+                     f"重用 {stats['reuses']}  丟棄 {stats['discarded']}")
+    return "\n".join(lines)
+
+
+def build_chain_graph(level):
+    """依關卡設定建立鎖鏈圖與對應的繩索。"""
+    global chain_graph, chain_ropes
+    links, lengths = level_chain_links(level, len(players), CHAIN_MAX_LENGTH)
+    chain_graph = ChainGraph(len(players), links, lengths)
+    segments = QUALITY_LEVELS[frame_budget.level]["chain_segments"]
+    chain_ropes = [VerletRope(segment_count=segments, max_length=length, budget_ms=CHAIN_ROPE_BUDGET_MS)
+                   for length in chain_graph.lengths]
+
+
+build_chain_graph({})  # 還沒載入關卡時所有玩家依序相連
+
+
+def apply_quality(level):
+    """套用畫質等級。這些設定都只在 visuals 為 True 時使用，或只影響畫面，不會改變模擬。"""
+    settings = QUALITY_LEVELS[level]
+    particle_system.density = settings["particle_density"]
+    Warning.animate_flash = settings["warning_flash"]
+    for rope in chain_ropes:
+        rope.set_segment_count(settings["chain_segments"])
+
+
+def chain_anchor(player):
+    """鎖鏈在這位玩家身上的端點：活著時是角色中心，死掉時是屍體位置 (沒有屍體時為 None)。"""
+    if player.is_alive:
+        return player.rect.center
+    return player.death_pos or None
+
+
+def get_chain_segments():
+    """回傳可以畫的鎖鏈 [(鎖鏈索引, start, end)]：至少一端活著，另一端是玩家或屍體。"""
+    segments = []
+    for index, (a, b) in enumerate(chain_graph.links):
+        if players[a].is_alive or players[b].is_alive:
+            start = chain_anchor(players[a])
+            end = chain_anchor(players[b])
+            if start is not None and end is not None:
+                segments.append((index, start, end))
+    return segments
+
+
+def keep_players_in_view():
+    """
+    攝影機再移動到所有活著的玩家都在畫面上：玩家不能走出畫面 (Player._confine_to_view)，
+    所以他們的外框不會比畫面大，不論幾位玩家、鎖鏈多長都不會有人在畫面外。
+    """
+    alive = [player.rect for player in players if player.is_alive]
+    if alive:
+        camera.keep_in_view(alive[0].unionall(alive[1:]))
+
+
+def update_camera():
+    """攝影機跟隨所有活著的玩家與鎖鏈另一端的屍體的中心。"""
+    points = {player.player_id: player.rect.center for player in players if player.is_alive}
+    for index, start, end in get_chain_segments():
+        a, b = chain_graph.links[index]
+        points[a] = start
+        points[b] = end
+    if points:
+        camera.follow((sum(point[0] for point in points.values()) / len(points),
+                       sum(point[1] for point in points.values()) / len(points)))
+        keep_players_in_view()
+
+
+def solve_chain_constraints():
+    """所有鎖鏈的長度約束 (向量化，成本與鎖鏈數成正比)，把修正後的位置寫回玩家。"""
+    positions = np.array([(player.pos.x, player.pos.y) for player in players], dtype=np.float64)
+    alive = np.array([player.is_alive for player in players], dtype=bool)
+    corpses = np.array([(player.death_pos.x, player.death_pos.y) if not player.is_alive and player.death_pos
+                        else (np.nan, np.nan) for player in players], dtype=np.float64)
+    half_sizes = np.array([(player.rect.width // 2, player.rect.height // 2) for player in players],
+                          dtype=np.float64)
+    before = positions.copy()
+    moved = chain_graph.solve(positions, alive, corpses, half_sizes, world_rect.size, CHAIN_ITERATIONS)
+    # 跟 Player._confine_to_view 一樣不能被拉到更外面：大小不同的玩家被拉向小玩家時可能越過自己的畫面邊界
+    view = camera.rect
+    np.clip(positions, np.minimum(before, np.array(view.topleft) + half_sizes),
+            np.maximum(before, np.array(view.bottomright) - half_sizes), out=positions)
+    for player_id in np.flatnonzero(moved).tolist():
+        player = players[player_id]
+        player.pos.x, player.pos.y = positions[player_id].tolist()
+        player.rect.center = player.pos
+
+
+def build_level_render_cache(compiled):
+    """第一次載入某關時建立可重用的精靈與預先畫好的背景，之後重新開始直接沿用。"""
+    cache = compiled.render_cache
+    cache["laser_walls"] = [LaserWall(*wall) for wall in compiled.source.get("laser_walls", [])]
+    cache["coop_boxes"] = [CoopBox(x, y, img=box_img) for x, y in compiled.box_starts]
+    cache["spike_traps"] = [SpikeTrap(*(int(v) for v in row[:4]), *row[4:], img_out=spike_trap_img_out,
+                                      img_in=spike_trap_img_in) for row in compiled.spike_table.tolist()]
+    # 區塊索引：只查詢攝影機附近的牆壁與地刺
+    cache["wall_index"] = ChunkIndex(CHUNK_SIZE)
+    for wall in cache["laser_walls"]:
+        cache["wall_index"].insert(wall, wall.rect)
+    cache["spike_index"] = ChunkIndex(CHUNK_SIZE)
+    for spike in cache["spike_traps"]:
+        cache["spike_index"].insert(spike, spike.rect)
+    cache["spike_scheduler"] = SpikeScheduler(compiled.spike_table, cache["spike_traps"])
+
+    # 靜態背景：底色 + 地刺 (+ 完全不透明的雷射牆壁)，分塊且只在畫面附近時才畫。
+    # 地刺切換狀態時只重畫那一小塊，不必每幀重畫所有地刺。
+    wall_index = cache["wall_index"]
+    spike_index = cache["spike_index"]
+
+    def render_floor_chunk(surface, chunk_rect):
+        surface.fill(BLACK)
+        for spike in spike_index.query(chunk_rect):
+            spike.draw(surface, chunk_rect.topleft)
+
+    def render_background_chunk(surface, chunk_rect):
+        render_floor_chunk(surface, chunk_rect)
+        for wall in wall_index.query(chunk_rect):
+            surface.blit(wall.image, wall.rect.move(-chunk_rect.x, -chunk_rect.y))
+
+    cache["floor"] = ChunkedBackground(compiled.world_width, compiled.world_height, render_floor_chunk, CHUNK_SIZE,
+                                       track=surface_memory.tracker("background"), scale=RENDER_SCALE)
+    cache["background"] = ChunkedBackground(compiled.world_width, compiled.world_height, render_background_chunk,
+                                            CHUNK_SIZE, track=surface_memory.tracker("background"),
+                                            scale=RENDER_SCALE)
+
+
+def install_level(compiled):
+    """
+    把編譯好的關卡放進遊戲：牆壁、地刺、箱子、果實、目標與鎖鏈 (箱子與果實回到關卡的初始狀態)。
+    不動玩家、效果與 level_time，載入關卡與熱重載目前關卡共用。
+    """
+    global current_level, level_fruits, fruit_mask
+    if not compiled.render_cache:
+        build_level_render_cache(compiled)
+    cache = compiled.render_cache
+    level = compiled.source
+    current_level = compiled
 
     # Clear existing sprites from groups
     laser_wall_sprites.empty()
@@ -808,97 +1368,102 @@ def load_level(level_idx):
     coop_box_group.empty()
     spike_trap_group.empty()
     fruit_sprites.empty()
-    meteor_sprites.empty()
-    warning_sprites.empty()
-    effect_manager.reset_all_effects()
 
-    player1.start_pos = pygame.math.Vector2(level["player1_start"])
-    player2.start_pos = pygame.math.Vector2(level["player2_start"])
-    player1.reset()
-    player2.reset()
-
-    for lw_data in level["laser_walls"]:
-        laser_wall_sprites.add(LaserWall(*lw_data))
-
-    goal1.rect.center = level["goal1_pos"]
-    goal2.rect.center = level["goal2_pos"]
-    goal1.is_active = False
-    goal2.is_active = False
-    goal_sprites.add(goal1, goal2)
-
-    coop_box_starts = level.get("coop_box_start", [])  # Ensure coop_box_start is present
-    if coop_box_starts:
-        if isinstance(coop_box_starts[0], (list, tuple)) and not isinstance(coop_box_starts[0], int):
-            for pos_data in coop_box_starts:
-                if len(pos_data) == 2:
-                    coop_box_group.add(CoopBox(pos_data[0], pos_data[1], img=box_img))
-                # ... (other conditions for coop_box_starts if any)
-        elif len(coop_box_starts) == 2 and isinstance(coop_box_starts[0], (int, float)):
-            coop_box_group.add(CoopBox(coop_box_starts[0], coop_box_starts[1], img=box_img))
-
-    for spike_data in level.get("spike_traps", []):
-        spike_trap_group.add(SpikeTrap(*spike_data, img_out=spike_trap_img_out, img_in=spike_trap_img_in))
-
-    # --- MODIFIED FRUIT SPAWNING LOGIC ---
-    obstacle_sprites_for_fruits = pygame.sprite.Group()
-    obstacle_sprites_for_fruits.add(laser_wall_sprites.sprites())
-    obstacle_sprites_for_fruits.add(spike_trap_group.sprites())
-    obstacle_sprites_for_fruits.add(coop_box_group.sprites())
-    obstacle_sprites_for_fruits.add(goal_sprites.sprites())
-    # Potentially add players' start positions if fruits shouldn't spawn right on them
-    # temp_player_rects = [player1.rect.copy(), player2.rect.copy()] # if needed
-
-    for fruit_data in level.get("fruits", []):
-        fx, fy, ftype = fruit_data
-        original_pos_valid = True
-        max_spawn_attempts = 50  # Max attempts to find a new spot
-        current_attempts = 0
-
-        # Create a temporary rect for the fruit at its original intended position
-        fruit_rect = pygame.Rect(0, 0, FRUIT_RADIUS * 2, FRUIT_RADIUS * 2)
-        fruit_rect.center = (fx, fy)
-
-        # Check collision with existing obstacles
-        for obs in obstacle_sprites_for_fruits:
-            if fruit_rect.colliderect(obs.rect):
-                original_pos_valid = False
-                break
-
-        # Check if too close to screen edges (already handled by random range if relocated)
-        if not (FRUIT_RADIUS <= fruit_rect.centerx <= SCREEN_WIDTH - FRUIT_RADIUS and \
-                FRUIT_RADIUS <= fruit_rect.centery <= SCREEN_HEIGHT - FRUIT_RADIUS):
-            original_pos_valid = False
-
-        if original_pos_valid:
-            fruit_sprites.add(Fruit(fx, fy, ftype))
-        else:
-            # Try to find a new random valid position
-            found_new_spot = False
-            for attempt in range(max_spawn_attempts):
-                current_attempts += 1
-                new_fx = random.randint(FRUIT_RADIUS, SCREEN_WIDTH - FRUIT_RADIUS)
-                new_fy = random.randint(FRUIT_RADIUS, SCREEN_HEIGHT - FRUIT_RADIUS)
-                fruit_rect.center = (new_fx, new_fy)
-
-                colliding_with_obstacle = False
-                for obs in obstacle_sprites_for_fruits:
-                    if fruit_rect.colliderect(obs.rect):
-                        colliding_with_obstacle = True
-                        break
-
-                if not colliding_with_obstacle:
-                    fruit_sprites.add(Fruit(new_fx, new_fy, ftype))
-                    found_new_spot = True
-                    # print(f"Fruit {ftype} relocated to ({new_fx},{new_fy}) after {current_attempts} attempts.")
-                    break
+    for wall in cache["laser_walls"]:
+        wall.update_visuals(effect_manager.default_laser_wall_alpha)
+    laser_wall_sprites.add(cache["laser_walls"])
+    world_rect.size = (compiled.world_width, compiled.world_height)
+    camera.set_world(compiled.world_width, compiled.world_height)
+
+    for goal in goals:
+        goal.rect.center = player_goal(level, goal.player_id_target)
+        goal.is_active = False
+    goal_sprites.add(goals)
+
+    for box, (x, y) in zip(cache["coop_boxes"], compiled.box_starts):
+        box.reset(x, y)
+    coop_box_group.add(cache["coop_boxes"])
+
+    cache["spike_scheduler"].reset()
+    if bot is not None:
+        bot.attach(compiled, bot_player().rect.size)
+    cache["floor"].invalidate()
+    cache["background"].invalidate()
+    spike_trap_group.add(cache["spike_traps"])
+
+    build_chain_graph(level)
 
-            if not found_new_spot:
-                print(
-                    f"Warning: Could not find a valid spawn location for fruit type '{ftype}' at ({fx},{fy}) after {max_spawn_attempts} attempts. Skipping this fruit.")
+    # 果實位置已在編譯時驗證過
+    level_fruits = [Fruit(fx, fy, ftype, i) for i, (fx, fy, ftype) in enumerate(compiled.fruits)]
+    fruit_mask = (1 << len(level_fruits)) - 1
+    fruit_sprites.add(level_fruits)
+
+
+def load_level(level_idx):
+    global game_state, level_time, revive_progress, revive_target
+    if level_idx >= len(level_cache):
+        game_state = STATE_ALL_LEVELS_COMPLETE
+        return
+
+    compiled = level_cache.get(level_idx)
+    meteor_pool.release_group(meteor_sprites)
+    warning_pool.release_group(warning_sprites)
+    particle_system.clear()
+    effect_manager.reset_all_effects()
+    frame_budget.reset()  # 載入的時間不算進畫質判斷
+
+    for player in players:
+        player.start_pos = pygame.math.Vector2(player_start(compiled.source, player.player_id))
+        player.reset()
+    level_time = 0.0
+    install_level(compiled)
+    if telemetry is not None:
+        begin_telemetry_run(level_idx, compiled)
+
+    snap_chain_ropes()
+    camera.follow((sum(player.pos.x for player in players) / len(players),
+                   sum(player.pos.y for player in players) / len(players)))
+    keep_players_in_view()
+    revive_progress = 0.0
+    revive_target = None
+    update_proximity()
+    snapshot_ring.reset(game_state_max_size())
+
+    if net_session is not None:
+        sim_random.seed(NET_RANDOM_SEED + net_session.epoch)  # 兩台電腦從完全相同的狀態開始
+
+    # 趁玩這一關的時候先在背景編譯下一關
+    if level_idx + 1 < len(level_cache):
+        asset_loader.submit(level_cache.get, level_idx + 1)
 
     game_state = STATE_PLAYING
 
 
+level_loading_job = None
+loading_level_index = 0
+level_fruits = []  # 目前關卡的所有果實 (依編譯順序)，回滾時用索引還原
+fruit_mask = 0  # 還沒被吃掉的果實 (第 i 位元對應 level_fruits[i])
+
+
+def begin_level_load(level_idx, state=STATE_LOADING):
+    """在背景編譯關卡，主迴圈每幀只推進一小段，完成後才切換到新關卡，畫面不會卡住。"""
+    global game_state, level_loading_job, loading_level_index
+    if level_idx >= len(level_cache):
+        game_state = STATE_ALL_LEVELS_COMPLETE
+        return
+
+    def finalize(compiled):
+        if not compiled.render_cache:
+            build_level_render_cache(compiled)
+
+    level_loading_job = LoadingJob()
+    level_loading_job.add(f"關卡 {level_idx + 1}", asset_loader.submit(level_cache.get, level_idx), finalize)
+    loading_level_index = level_idx
+    game_state = state
+    if net_session is not None:
+        net_session.reset(net_session.epoch + 1)
+
+
 # ---遊戲初始化---
 game_state = STATE_START_SCREEN
 current_level_index = 0
@@ -915,397 +1480,955 @@ revive_progress = 0.0
 revive_target = None
 
 
+def simulate_tick(frame, dt, visuals=True):
+    """
+    遊玩中前進一個 tick。所有遊戲規則都在這裡，輸入只來自 frame，
+    所以同樣的狀態加上同樣的輸入一定得到同樣的結果 (連線回滾時會重新模擬)。
+    Args:
+        frame (InputFrame): 這個 tick 的輸入 (鍵盤、手把、網路或電腦隊友)，尚未套用鏡像。
+        dt (float): tick 長度 (秒)。
+        visuals (bool): False 時略過粒子、繩索等只影響畫面的部分 (回滾重新模擬時使用)。
+    Returns:
+        int: 這個 tick 造成的狀態切換 (STATE_LEVEL_COMPLETE / STATE_GAME_OVER)，沒有則為 None。
+    """
+    global level_time, revive_progress, revive_target, fruit_mask
+    effect_manager.update(dt)  # Update effects first
+    level_time += dt
+    frame = frame.with_mirror([effect_manager.is_mirror_active(player.player_id) for player in players])
+
+    # 碰撞只查每位玩家這個 tick 走得到的範圍 (不是攝影機範圍)，鎖鏈再長、玩家離畫面中心再遠都一樣會碰撞
+    wall_index = current_level.render_cache["wall_index"]
+    spike_index = current_level.render_cache["spike_index"]
+
+    # 所有地刺一次向量化更新，只重畫真的切換狀態的地刺
+    spike_scheduler = current_level.render_cache["spike_scheduler"]
+    changed_spikes = spike_scheduler.tick(level_time)
+    redraw_spikes(changed_spikes)
+
+    # Update player movement (pass meteor_sprites and this tick's input)
+    log_events = telemetry is not None and visuals  # 回滾重新模擬的 tick 已經記錄過，不重複記錄
+    if log_events:
+        was_alive = [player.is_alive for player in players]
+    for player in players:
+        reach = player.rect.inflate(PLAYER_SPEED * 2, PLAYER_SPEED * 2)
+        near_boxes = [box for box in coop_box_group if reach.colliderect(box.rect)]
+        player.update_movement(wall_index.query(reach), near_boxes, spike_index.query(reach), meteor_sprites, dt,
+                               frame)
+    if log_events:
+        record_deaths(was_alive)
+
+    # Player-Fruit collision
+    for player in player_sprites:
+        if player.is_alive:
+            collided_fruits = pygame.sprite.spritecollide(player, fruit_sprites,
+                                                          True)  # True to remove fruit on collision
+            for fruit in collided_fruits:
+                fruit_mask &= ~(1 << fruit.index)
+                effect_manager.apply_effect(fruit.fruit_type, player.player_id)
+                if log_events:
+                    telemetry.record(EVENT_FRUIT, player.player_id, level_time, fruit.rect.centerx,
+                                     fruit.rect.centery, FRUIT_TYPES.index(fruit.fruit_type))
+                if visuals:
+                    particle_system.emit(fruit.rect.centerx, fruit.rect.centery, FRUIT_PICKUP_PARTICLES,
+                                         fruit.color, speed=120, lifetime=0.5)
+
+    # Volcano effect: Spawn warnings and meteors
+    if effect_manager.should_spawn_meteor():
+        # 流星只落在攝影機看得到的範圍
+        spawn_x = sim_random.randint(camera.rect.left + METEOR_SIZE, camera.rect.right - METEOR_SIZE)
+        spawn_y = sim_random.randint(camera.rect.top + METEOR_SIZE, camera.rect.bottom - METEOR_SIZE)
+        warning_sprites.add(warning_pool.acquire(spawn_x, spawn_y, METEOR_WARNING_TIME))
+        effect_manager.reset_meteor_timer()
+
+    # Update warnings and spawn meteors
+    for warning in list(warning_sprites):  # Iterate over a copy for safe removal
+        if warning.update(dt):  # True if warning expired and meteor should spawn
+            meteor_sprites.add(meteor_pool.acquire(warning.spawn_pos[0], warning.spawn_pos[1]))
+            if visuals:
+                particle_system.emit(warning.spawn_pos[0], warning.spawn_pos[1], METEOR_IMPACT_PARTICLES,
+                                     VOLCANO_FRUIT_COLOR, speed=250, lifetime=0.8)
+
+    meteor_sprites.update(dt)  # Update meteors (e.g., for lifetime)
+    if visuals:
+        particle_system.update(dt)
+
+    # --- 鎖鏈物理 ---
+    solve_chain_constraints()
+
+    # --- 推箱判斷 ---
+    # 放在鎖鏈之後：所有人都在同一個箱子旁邊時距離遠小於鎖鏈長度，鎖鏈不會移動他們，結果與先推箱相同
+    update_proximity()
+    if all(player.is_alive for player in players):
+        for coop_box in coop_box_group:
+            if proximity.all_near(coop_box):
+                # 所有人的原始輸入方向相加 (推箱不受鏡像影響)，反方向會互相抵消
+                directions = [frame.direction(player.player_id) for player in players]
+                total_dir = pygame.math.Vector2(sum(dx for dx, _ in directions), sum(dy for _, dy in directions))
+
+                if total_dir.length_squared() > 0:
+                    total_dir.normalize_ip()
+                    # Pass only laser_wall_sprites as obstacles for boxes
+                    coop_box.move(total_dir, wall_index.query(coop_box.rect.inflate(COOP_BOX_SPEED * 2,
+                                                                                     COOP_BOX_SPEED * 2)))
+
+    # 繩索只影響畫面，不改變上面的玩家距離約束
+    if USE_ROPE_CHAIN and visuals:
+        segments = get_chain_segments()
+        if segments:
+            view = camera.rect.inflate(SIMULATION_MARGIN * 2, SIMULATION_MARGIN * 2)
+            obstacles = rects_to_array([wall.rect for wall in wall_index.query(view)] +
+                                       [box.rect for box in coop_box_group if view.colliderect(box.rect)])
+            for index, start, end in segments:
+                chain_ropes[index].step(start, end, obstacles)
+
+    update_camera()
+
+    # 判斷復活條件：活著且按住復活鍵的玩家可以復活範圍內的任何屍體 (推箱只移動箱子，距離資料仍然正確)。
+    # 同一時間只復活一位，正在復活的目標仍然可以被救時繼續累積，否則換成編號最小的可救屍體並重新計時
+    holding = np.array([frame.revive(player.player_id) for player in players], dtype=bool)
+    revivable = np.flatnonzero((proximity.in_revive_range & holding[:, None]).any(axis=0))
+    if revivable.size:
+        if revive_target is None or revive_target.player_id not in revivable:
+            revive_target = players[revivable[0]]
+            revive_progress = 0
+        if log_events and revive_progress == 0:
+            record_revive(EVENT_REVIVE_START, revive_target, holding)
+        revive_progress += dt
+    else:
+        revive_progress = 0  # 沒有人在復活就歸零 (保留目標)
+
+    if revive_progress >= REVIVE_HOLD_TIME and revive_target is not None:
+        if log_events:
+            record_revive(EVENT_REVIVE, revive_target, holding)
+        revive_target.revive()
+        revive_progress = 0
+        revive_target = None
+
+    if log_events:
+        sample_positions()
+
+    # ----是否過關---
+    for goal in goals:
+        goal.update_status(players[goal.player_id_target])
+    outcome = None
+    if all(goal.is_active for goal in goals) and all(player.is_alive for player in players):
+        outcome = STATE_LEVEL_COMPLETE
+    elif not any(player.is_alive for player in players):
+        outcome = STATE_GAME_OVER
+    if log_events and outcome is not None:
+        record_level_end(outcome)
+    return outcome
+
+
+# --- 遙測 ---
+telemetry = None
+telemetry_sample = -1  # 上一次取樣位置的時間格 (level_time // TELEMETRY_MOVE_INTERVAL)
+
+
+def record_deaths(was_alive):
+    for player, alive in zip(players, was_alive):
+        if alive and not player.is_alive:
+            telemetry.record(EVENT_DEATH, player.player_id, level_time, player.pos.x, player.pos.y,
+                             player.death_cause)
+
+
+def record_revive(kind, target, holding):
+    """記錄復活事件，救人的玩家是範圍內按住復活鍵、編號最小的玩家。"""
+    rescuers = np.flatnonzero(proximity.in_revive_range[:, target.player_id] & holding)
+    actor = int(rescuers[0]) if rescuers.size else NO_ACTOR
+    telemetry.record(kind, target.player_id, level_time, target.death_pos.x, target.death_pos.y, actor=actor)
+
+
+def sample_positions():
+    """每 TELEMETRY_MOVE_INTERVAL 秒 (關卡時間) 記錄一次活著的玩家位置，倒帶回到之前的時間格時不重複記錄。"""
+    global telemetry_sample
+    sample = int(level_time // TELEMETRY_MOVE_INTERVAL)
+    if sample > telemetry_sample:
+        telemetry_sample = sample
+        for player in players:
+            if player.is_alive:
+                telemetry.record(EVENT_MOVE, player.player_id, level_time, player.pos.x, player.pos.y)
+
+
+def record_level_end(outcome):
+    telemetry.record(EVENT_LEVEL_END, 0, level_time, camera.rect.centerx, camera.rect.centery,
+                     1 if outcome == STATE_LEVEL_COMPLETE else 2)
+    telemetry.flush()  # 一關結束就交給寫入執行緒，程式中途關閉時也不會遺失
+
+
+def begin_telemetry_run(level_idx, compiled):
+    global telemetry_sample
+    telemetry_sample = -1
+    telemetry.begin_run(level_idx, os.path.relpath(compiled.path))
+
+
+def finish_level(outcome):
+    """處理 simulate_tick 回傳的狀態切換。"""
+    global game_state, current_level_index
+    if outcome == STATE_LEVEL_COMPLETE:
+        current_level_index += 1
+        if current_level_index < len(level_cache):
+            begin_level_load(current_level_index, STATE_LEVEL_COMPLETE)
+        else:
+            game_state = STATE_ALL_LEVELS_COMPLETE
+    elif outcome == STATE_GAME_OVER:
+        game_state = STATE_GAME_OVER
+
+
+def redraw_spikes(changed_spikes):
+    """只重畫切換了狀態的地刺所在的背景。"""
+    if changed_spikes.size:
+        rects = current_level.render_cache["spike_scheduler"].rects[changed_spikes]
+        current_level.render_cache["floor"].redraw_rects(rects)
+        current_level.render_cache["background"].redraw_rects(rects)
+
+
+# --- 遊戲狀態快照 ---
+# 二進位格式 (little-endian)：標頭、每位玩家、效果、地刺位元、箱子、果實位元、警告、流星。
+# 箱子、果實、地刺的數量每關固定，所以一關內每個快照的大小有上限 (見 game_state_max_size)。
+STATE_HEADER = struct.Struct("<ddbiiQB")  # level_time, revive_progress, revive_target, 攝影機, 亂數, 目標旗標 (每位玩家一位元)
+STATE_COUNT = struct.Struct("<H")
+STATE_BOX = struct.Struct("<dd")
+STATE_TIMED_SPRITE = struct.Struct("<iidd")  # 警告/流星：中心、持續時間、計時器
+
+
+def game_state_max_size():
+    cache = current_level.render_cache
+    return (STATE_HEADER.size + Player.STATE.size * len(players) + EffectManager.STATE_MAX_SIZE +
+            cache["spike_scheduler"].state_size + STATE_COUNT.size * 4 +
+            STATE_BOX.size * len(cache["coop_boxes"]) + (len(level_fruits) + 7) // 8 +
+            STATE_TIMED_SPRITE.size * (WARNING_POOL_CAPACITY + METEOR_POOL_CAPACITY))
+
+
+def write_game_state(buffer, offset=0):
+    """
+    把目前這一關可回滾的模擬狀態寫進 buffer[offset:] (不含粒子、繩索等只影響畫面的部分)。
+    警告與流星最多各保存物件池容量的數量。
+    Returns:
+        int: 結束位置。
+    """
+    cache = current_level.render_cache
+    STATE_HEADER.pack_into(buffer, offset, level_time, revive_progress,
+                           -1 if revive_target is None else revive_target.player_id,
+                           camera.rect.x, camera.rect.y, sim_random.state,
+                           sum(goal.is_active << goal.player_id_target for goal in goals))
+    offset += STATE_HEADER.size
+    for player in players:
+        offset = player.pack_state(buffer, offset)
+    offset = effect_manager.pack_state(buffer, offset)
+    offset = cache["spike_scheduler"].pack_state(buffer, offset)
+
+    boxes = cache["coop_boxes"]
+    STATE_COUNT.pack_into(buffer, offset, len(boxes))
+    offset += STATE_COUNT.size
+    for box in boxes:
+        STATE_BOX.pack_into(buffer, offset, box.pos.x, box.pos.y)
+        offset += STATE_BOX.size
+
+    STATE_COUNT.pack_into(buffer, offset, len(level_fruits))
+    offset += STATE_COUNT.size
+    fruit_bytes = (len(level_fruits) + 7) // 8
+    buffer[offset:offset + fruit_bytes] = fruit_mask.to_bytes(fruit_bytes, "little")
+    offset += fruit_bytes
+
+    for group, capacity in ((warning_sprites, WARNING_POOL_CAPACITY), (meteor_sprites, METEOR_POOL_CAPACITY)):
+        sprites = group.sprites()[:capacity]
+        STATE_COUNT.pack_into(buffer, offset, len(sprites))
+        offset += STATE_COUNT.size
+        for sprite in sprites:
+            duration = sprite.duration if group is warning_sprites else sprite.lifetime
+            STATE_TIMED_SPRITE.pack_into(buffer, offset, sprite.rect.centerx, sprite.rect.centery, duration,
+                                         sprite.timer)
+            offset += STATE_TIMED_SPRITE.size
+    return offset
+
+
+def read_game_state(buffer, offset=0):
+    """從 buffer[offset:] 還原 write_game_state 寫入的狀態，回傳結束位置。"""
+    global level_time, revive_progress, revive_target, fruit_mask
+    cache = current_level.render_cache
+    (level_time, revive_progress, revive_target_id, camera.rect.x, camera.rect.y, sim_random.state,
+     goal_flags) = STATE_HEADER.unpack_from(buffer, offset)
+    offset += STATE_HEADER.size
+    revive_target = None if revive_target_id < 0 else players[revive_target_id]
+    for goal in goals:
+        goal.is_active = bool(goal_flags >> goal.player_id_target & 1)
+    for player in players:
+        offset = player.unpack_state(buffer, offset)
+    offset = effect_manager.unpack_state(buffer, offset)
+    offset, changed_spikes = cache["spike_scheduler"].unpack_state(buffer, offset)
+    redraw_spikes(changed_spikes)
+
+    count, = STATE_COUNT.unpack_from(buffer, offset)
+    offset += STATE_COUNT.size
+    for box in cache["coop_boxes"][:count]:
+        box.reset(*STATE_BOX.unpack_from(buffer, offset))
+        offset += STATE_BOX.size
+
+    count, = STATE_COUNT.unpack_from(buffer, offset)
+    offset += STATE_COUNT.size
+    fruit_bytes = (count + 7) // 8
+    saved_fruit_mask = int.from_bytes(buffer[offset:offset + fruit_bytes], "little")
+    offset += fruit_bytes
+    if saved_fruit_mask != fruit_mask:
+        fruit_mask = saved_fruit_mask
+        fruit_sprites.empty()
+        fruit_sprites.add(fruit for fruit in level_fruits if fruit_mask >> fruit.index & 1)
+
+    # 警告與流星盡量沿用現有的精靈，只補上或歸還數量差
+    for group, pool in ((warning_sprites, warning_pool), (meteor_sprites, meteor_pool)):
+        count, = STATE_COUNT.unpack_from(buffer, offset)
+        offset += STATE_COUNT.size
+        sprites = group.sprites()
+        for sprite in sprites[count:]:
+            sprite.kill()
+        for i in range(count):
+            x, y, duration, timer = STATE_TIMED_SPRITE.unpack_from(buffer, offset)
+            offset += STATE_TIMED_SPRITE.size
+            if i < len(sprites):
+                sprites[i].spawn(x, y, duration)
+            else:
+                sprites.append(pool.acquire(x, y, duration))
+                group.add(sprites[i])
+            sprites[i].timer = timer
+    return offset
+
+
+def update_proximity():
+    """重新計算玩家與箱子、屍體的距離資料 (每個 tick 一次，以及狀態跳躍之後)。"""
+    global proximity
+    proximity = ProximityContext(players, coop_box_group, COOP_BOX_PUSH_RADIUS, REVIVAL_RADIUS)
+
+
+def snap_chain_ropes():
+    """狀態跳躍 (載入關卡、倒轉、讀取快速存檔) 後把繩索直接拉到新的兩端。"""
+    for index, start, end in get_chain_segments():
+        chain_ropes[index].reset(start, end)
+
+
+def capture_game_state():
+    """目前狀態的二進位快照 (bytes)。"""
+    buffer = bytearray(game_state_max_size())
+    return bytes(buffer[:write_game_state(buffer)])
+
+
+def restore_game_state(data):
+    read_game_state(data)
+
+
+# --- 區域網路連線 (預測 + 回滾) ---
+def net_advance(inputs, resimulating):
+    return simulate_tick(InputFrame(inputs), NET_TICK_DT, visuals=not resimulating)
+
+
+# --- 電腦隊友 ---
+def make_bot(player_id):
+    return BotController(player_id, PLAYER_SPEED * FPS, REVIVAL_RADIUS, COOP_BOX_PUSH_RADIUS, CHAIN_MAX_LENGTH,
+                         goals[0].rect.width, cell_size=BOT_NAV_CELL_SIZE, budget_ms=BOT_PLAN_BUDGET_MS)
+
+
+def bot_player():
+    return players[bot.player_id]
+
+
+def bot_partner():
+    """電腦隊友跟隨的玩家：鎖鏈上第一位相鄰的玩家 (沒有相連的玩家時是下一位)。"""
+    neighbours = chain_graph.neighbours(bot.player_id)
+    return players[neighbours[0] if neighbours else (bot.player_id + 1) % len(players)]
+
+
+def bot_input_frame(frame):
+    """
+    電腦隊友決定自己的輸入。兩人遊戲時人類玩家用哪一組按鍵或手把都可以；
+    多人時其他玩家照常使用自己的按鍵或手把。
+    """
+    me = bot_player()
+    partner = bot_partner()
+    if len(players) == 2:
+        frame = frame.with_player(partner.player_id, frame.combined())
+    human_bits = frame.bits[partner.player_id]
+    hazards = [meteor.rect for meteor in meteor_sprites]
+    for warning in warning_sprites:
+        # 警告的位置就是之後流星落下的位置
+        hazards.append(pygame.Rect(warning.spawn_pos[0] - METEOR_SIZE // 2, warning.spawn_pos[1] - METEOR_SIZE // 2,
+                                   METEOR_SIZE, METEOR_SIZE))
+    bot_bits = bot.think(me, partner, human_bits, coop_box_group,
+                         [(rect.left, rect.top, rect.right, rect.bottom) for rect in hazards],
+                         current_level.render_cache["spike_scheduler"], level_time,
+                         effect_manager.is_mirror_active(bot.player_id))
+    return frame.with_player(bot.player_id, bot_bits)
+
+
+# --- 錄影 ---
+def start_recording(path=None):
+    global recorder
+    if not path:
+        os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        path = os.path.join(RECORDINGS_DIR, time.strftime("session_%Y%m%d_%H%M%S.mp4"))
+    recorder = VideoRecorder(path, screen.get_size(), FPS, RECORD_QUEUE_SIZE).start()
+
+
+def stop_recording():
+    global recorder
+    recorder.stop()
+    print(f"錄影已儲存: {recorder.path} (寫入 {recorder.frames_written} 幀，丟棄 {recorder.frames_dropped} 幀，"
+          f"主執行緒平均 {recorder.capture_ms:.2f}ms)")
+    if recorder.error:
+        print(recorder.error)
+    recorder = None
+
+
+def draw_recording_indicator():
+    text = f"● REC {recorder.duration:.1f}s  丟棄 {recorder.frames_dropped}  {recorder.capture_ms:.2f}ms"
+    if recorder.error:
+        text = recorder.error
+    rec_surf = font_effect.render(text, True, RECORD_COLOR)
+    render_queue.add(LAYER_OVERLAY, rec_surf, (ui(10), CANVAS_HEIGHT - rec_surf.get_height() - ui(10)))
+
+
+# --- 熱重載 ---
+# 監看的檔案 -> 重新載入的方式。圖集依路徑對應到 (角色, 動畫名稱, 幀數, 是否垂直排列, 幀大小)
+SHEET_FILES = {os.path.normpath(path): (character, name, frames, vertical, size)
+               for character, (sheets, size) in enumerate(CHARACTER_SHEETS)
+               for name, (path, frames, vertical) in sheets.items()}
+IMAGE_FILES = {os.path.normpath(path): name for name, path in STATIC_IMAGES.items()}
+hot_reload_job = None  # 還沒套用完的重載 (LoadingJob)，失敗的檔案只印出訊息，遊戲繼續
+
+
+def report_reload_error(label, error):
+    print(f"熱重載失敗 {label}: {error}")
+
+
+def queue_reload(label, future, finalize):
+    """把一個重載步驟加進 hot_reload_job，完成時印出從偵測到變更起花了多久。"""
+    global hot_reload_job
+    if hot_reload_job is None or hot_reload_job.done:
+        hot_reload_job = LoadingJob(on_error=report_reload_error)
+    started = time.perf_counter()
+
+    def apply(result):
+        finalize(result)
+        print(f"已重新載入 {label} ({(time.perf_counter() - started) * 1000:.1f}ms)")
+    hot_reload_job.add(label, future, apply)
+
+
+def apply_static_image(name, old_image):
+    """換掉所有已建立的關卡中用到這張圖的精靈，只讓相關的背景區塊重畫。"""
+    global box_img, spike_trap_img_out, spike_trap_img_in
+    image = images[name]
+    compiled_levels = [compiled for compiled in level_cache.compiled_levels() if compiled.render_cache]
+    if name == "box":
+        box_img = image
+        for compiled in compiled_levels:
+            for box in compiled.render_cache["coop_boxes"]:
+                box.set_image(image)
+        return
+    # 地刺：丟掉舊圖的縮放快取，地刺畫在背景裡，所以背景也要重畫
+    for key in [key for key in SpikeTrap.scaled_images if key[0] == id(old_image)]:
+        del SpikeTrap.scaled_images[key]
+    if name == "spike_trap_out":
+        spike_trap_img_out = image
+    else:
+        spike_trap_img_in = image
+    for compiled in compiled_levels:
+        cache = compiled.render_cache
+        for spike in cache["spike_traps"]:
+            if name == "spike_trap_out":
+                spike.img_out = image
+            else:
+                spike.img_in = image
+        cache["floor"].invalidate()
+        cache["background"].invalidate()
+
+
+def reload_static_image(path):
+    name = IMAGE_FILES[path]
+
+    def finalize(surface):
+        old_image = images.get(name)
+        images[name] = surface_memory.track(surface.convert_alpha(), "static")
+        apply_static_image(name, old_image)
+    asset_loader.forget(STATIC_IMAGES[name])
+    queue_reload(path, asset_loader.load_image(STATIC_IMAGES[name]), finalize)
+
+
+def reload_sheet(path):
+    """只重新解碼、切割這一張圖集，換掉 animation_library 中同一個列表的內容 (玩家手上的參照不變)。"""
+    character, name, num_frames, vertical, size = SHEET_FILES[path]
+
+    def finalize(sheet):
+        frames = surface_memory.track_all(slice_sprite_sheet(sheet.convert_alpha(), num_frames, vertical, size, size,
+                                                             name=path), "animation")
+        library = animation_library[character]
+        if name in library:
+            library[name][:] = frames
+        else:
+            library[name] = frames
+        for player in players:
+            if player.player_id % 2 == character:
+                player.refresh_frames()
+    asset_loader.forget(path)
+    queue_reload(path, asset_loader.load_image(path), finalize)
+
+
+def reload_level_file(path):
+    """
+    關卡檔改變：其他關卡在下次載入時才重新編譯 (LevelCache 會比對修改時間)；
+    目前這一關在背景重新編譯後原地換上，玩家、效果與時間保留，箱子與果實回到初始位置。
+    """
+    level_paths = [os.path.normpath(level_path) for level_path in level_cache.paths]
+    if path not in level_paths or not os.path.exists(path):
+        level_cache.refresh()  # 新增或刪除了關卡
+        level_paths = [os.path.normpath(level_path) for level_path in level_cache.paths]
+    if current_level is None or os.path.normpath(current_level.path) != path or game_state != STATE_PLAYING or \
+            path not in level_paths:
+        return
+    if net_session is not None:
+        print("連線中不熱重載目前的關卡 (兩台電腦的模擬會不一致)")
+        return
+    index = level_paths.index(path)
+
+    def finalize(compiled):
+        global quick_save
+        if compiled is current_level or game_state != STATE_PLAYING or current_level.path != compiled.path:
+            return
+        install_level(compiled)
+        snap_chain_ropes()
+        update_proximity()
+        snapshot_ring.reset(game_state_max_size())  # 舊關卡的快照大小與內容都不再適用
+        quick_save = None
+    queue_reload(path, asset_loader.submit(level_cache.get, index), finalize)
+
+
+def handle_file_changes(paths):
+    for path in paths:
+        if path in SHEET_FILES:
+            reload_sheet(path)
+        elif path in IMAGE_FILES:
+            reload_static_image(path)
+        elif path.endswith(".json") and os.path.dirname(path) == os.path.normpath(LEVELS_DIR):
+            reload_level_file(path)
+
+
+file_watcher = None
+if not cli_args.no_hot_reload:
+    file_watcher = FileWatcher([LEVELS_DIR, ANIMATION_DIR, *STATIC_IMAGES.values()],
+                               interval=HOT_RELOAD_INTERVAL).start()
+
+
+# --- Surface 記憶體預算 ---
+# 超過預算時依序丟棄 (先丟重建最便宜、最不會馬上用到的)，每個函式一次丟一些，回傳是否丟了東西
+def evict_other_levels():
+    """丟掉一個其他關卡 (不是目前或正在載入的關卡) 預先建立的精靈與背景，再次載入時重建。"""
+    loading_path = None
+    if game_state in (STATE_LOADING, STATE_LEVEL_COMPLETE) and loading_level_index < len(level_cache):
+        loading_path = level_cache.paths[loading_level_index]
+    for compiled in level_cache.compiled_levels():
+        if compiled.render_cache and compiled is not current_level and compiled.path != loading_path:
+            compiled.render_cache.clear()
+            return True
+    return False
+
+
+def evict_spike_cache():
+    """丟掉目前關卡用不到的地刺縮放圖 (目前關卡重畫背景區塊時還會用到的保留，避免一直重新縮放)。"""
+    in_use = set()
+    if current_level is not None and current_level.render_cache:
+        for spike in current_level.render_cache["spike_traps"]:
+            for image in (spike.img_out, spike.img_in):
+                in_use.add((id(image), spike.rect.width, spike.rect.height))
+    unused = [key for key in SpikeTrap.scaled_images if key not in in_use]
+    for key in unused:
+        del SpikeTrap.scaled_images[key]
+    return bool(unused)
+
+
+def evict_background_chunks():
+    """
+    目前關卡的背景只保留畫面上的區塊 (每幀都會畫到，在 LRU 的最後面)。
+    地板與含牆壁的背景同時只會用到一個 (看牆壁是否透明)，用不到的那個整個丟掉。
+    """
+    if current_level is None or not current_level.render_cache:
+        return False
+    view = camera.rect
+    keep = (((view.right - 1) // CHUNK_SIZE - view.left // CHUNK_SIZE + 1) *
+            ((view.bottom - 1) // CHUNK_SIZE - view.top // CHUNK_SIZE + 1))
+    cache = current_level.render_cache
+    walls_in_background = effect_manager.get_laser_wall_alpha() == effect_manager.default_laser_wall_alpha
+    trimmed_floor = cache["floor"].trim(0 if walls_in_background else keep)
+    trimmed_background = cache["background"].trim(keep if walls_in_background else 0)
+    return trimmed_floor or trimmed_background
+
+
+surface_memory.add_evictor("解碼圖片", asset_loader.release_decoded)
+surface_memory.add_evictor("其他關卡", evict_other_levels)
+surface_memory.add_evictor("地刺縮放", evict_spike_cache)
+surface_memory.add_evictor("背景區塊", evict_background_chunks)
+
+
+def start_level(level_idx):
+    """開始 (或重新開始) 第 level_idx 關。連線時同時通知對方，兩邊一起載入。"""
+    global current_level_index
+    if net_session is not None:
+        net_session.send_control(CONTROL_LOAD_LEVEL, level_idx)
+    current_level_index = level_idx
+    begin_level_load(level_idx)  # load_level will reset effects
+
+
+net_session = None
+if cli_args.host is not None or cli_args.join:
+    if cli_args.host is not None:
+        net_peer = NetplayPeer(cli_args.host, None, cli_args.latency, cli_args.jitter, cli_args.loss, host="0.0.0.0")
+        local_player_id = 0
+    else:
+        remote_host, remote_port = cli_args.join.rsplit(":", 1)
+        net_peer = NetplayPeer(0, (remote_host, int(remote_port)), cli_args.latency, cli_args.jitter, cli_args.loss,
+                               host="0.0.0.0")
+        local_player_id = 1
+    net_session = RollbackSession(net_peer.start(), local_player_id, capture_game_state, restore_game_state,
+                                  net_advance, max_rollback=NET_MAX_ROLLBACK)
+    pygame.display.set_caption(f"雙人合作遊戲 Demo - 連線 (玩家{local_player_id + 1})")
+bot_player_id = cli_args.bot - 1 if cli_args.bot else 1  # F2 重新開啟電腦隊友時控制同一位玩家
+bot = make_bot(bot_player_id) if cli_args.bot and net_session is None else None
+recorder = None
+if cli_args.record is not None:
+    start_recording(cli_args.record)
+if cli_args.telemetry:
+    telemetry = TelemetryRecorder(os.path.join(cli_args.telemetry, time.strftime("session_%Y%m%d_%H%M%S")))
+latency_tracker = LatencyTracker(input_devices.is_game_event)
+scripted_input = None
+if cli_args.latency_bench:
+    scripted_input = ScriptedInput([key for player in players if player.control_keys
+                                    for key in player.control_keys.values()] + PLAYER_REVIVE_KEYS[:len(players)],
+                                   seed=LATENCY_BENCH_SEED)
+    input_devices.key_state = scripted_input
+    latency_bench_end = time.perf_counter() + cli_args.latency_bench
+
+
 def draw_game_state_messages():
-    if game_state == STATE_GAME_OVER:
-        game_over_text = font_large.render("遊戲結束", True, TEXT_COLOR)
-        restart_text = font_small.render("按 R 鍵重新開始", True, TEXT_COLOR)
-        screen.blit(game_over_text, (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, SCREEN_HEIGHT // 2 - 50))
-        screen.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, SCREEN_HEIGHT // 2 + 20))
-    elif game_state == STATE_ALL_LEVELS_COMPLETE:
-        complete_text = font_large.render("所有關卡完成！", True, TEXT_COLOR)
+    if game_state == STATE_LEVEL_COMPLETE or game_state == STATE_LOADING:
+        title = "關卡完成！" if game_state == STATE_LEVEL_COMPLETE else "載入中"
+        render_queue.add_draw(LAYER_MESSAGES, lambda _: draw_loading_screen(title, level_loading_job.progress,
+                                                                            level_loading_job.current_label))
+    elif game_state == STATE_GAME_OVER or game_state == STATE_ALL_LEVELS_COMPLETE:
+        title = "遊戲結束" if game_state == STATE_GAME_OVER else "所有關卡完成！"
+        title_text = font_large.render(title, True, TEXT_COLOR)
         restart_text = font_small.render("按 R 鍵重新開始", True, TEXT_COLOR)
-        screen.blit(complete_text, (SCREEN_WIDTH // 2 - complete_text.get_width() // 2, SCREEN_HEIGHT // 2 - 50))
-        screen.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, SCREEN_HEIGHT // 2 + 20))
+        render_queue.add(LAYER_MESSAGES, title_text,
+                         (CANVAS_WIDTH // 2 - title_text.get_width() // 2, CANVAS_HEIGHT // 2 - ui(50)))
+        render_queue.add(LAYER_MESSAGES, restart_text,
+                         (CANVAS_WIDTH // 2 - restart_text.get_width() // 2, CANVAS_HEIGHT // 2 + ui(20)))
 
     if game_state == STATE_PLAYING:
-        level_text = font_small.render(f"關卡 {current_level_index + 1}", True, TEXT_COLOR)
-        screen.blit(level_text, (10, 10))
-
-        p1_status_text = "存活" if player1.is_alive else "死亡"
-        p2_status_text = "存活" if player2.is_alive else "死亡"
-        p1_text = font_tiny.render(f"玩家1: {p1_status_text}", True, PLAYER1_COLOR)
-        p2_text = font_tiny.render(f"玩家2: {p2_status_text}", True, PLAYER2_COLOR)
-        screen.blit(p1_text, (10, 50))
-        screen.blit(p2_text, (10, 75))
-
-        if (player1.is_alive and not player2.is_alive) or \
-                (player2.is_alive and not player1.is_alive):
-            revive_hint = font_tiny.render("靠近隊友按住 F/. 復活", True, REVIVE_PROMPT_COLOR)
-            screen.blit(revive_hint, (SCREEN_WIDTH // 2 - revive_hint.get_width() // 2, 10))
-
-        # Display active effects
-        active_effects = effect_manager.get_active_effects_info()
-        y_offset = 100
-        for effect_str in active_effects:
-            effect_surf = font_effect.render(effect_str, True, TEXT_COLOR)
-            screen.blit(effect_surf, (10, y_offset))
-            y_offset += 20
-
-        # Push hint (simplified as there can be multiple boxes)
-        # This needs to be smarter if there are multiple boxes. For now, it checks the first one if any.
-        if player1.is_alive and player2.is_alive and coop_box_group:
-            first_box = next(iter(coop_box_group))  # Get the first box
-            p1_near = player1.pos.distance_to(first_box.pos) < COOP_BOX_PUSH_RADIUS
-            p2_near = player2.pos.distance_to(first_box.pos) < COOP_BOX_PUSH_RADIUS
-            if p1_near and p2_near:
-                push_hint = font_tiny.render("兩人靠近可推箱", True, (225, 210, 80))
-                screen.blit(push_hint, (SCREEN_WIDTH // 2 - push_hint.get_width() // 2, 40))
+        draw_hud()
+
+
+def build_hud_items():
+    """遊玩中的 HUD 文字，回傳給 screen.blits 的 [(Surface, 畫布座標)]。"""
+    items = []
+    level_text = font_small.render(f"關卡 {current_level_index + 1}", True, TEXT_COLOR)
+    items.append((level_text, (ui(10), ui(10))))
+
+    for player in players:
+        status_text = "存活" if player.is_alive else "死亡"
+        player_text = font_tiny.render(f"玩家{player.player_id + 1}: {status_text}", True, player.alive_color)
+        items.append((player_text, (ui(10), ui(50 + 25 * player.player_id))))
+
+    alive_count = sum(player.is_alive for player in players)
+    if 0 < alive_count < len(players):
+        revive_hint = font_tiny.render("靠近隊友按住 F/. 復活", True, REVIVE_PROMPT_COLOR)
+        items.append((revive_hint, (CANVAS_WIDTH // 2 - revive_hint.get_width() // 2, ui(10))))
+
+    if net_session is not None:
+        stats = net_session.stats()
+        net_text = font_effect.render(f"RTT {stats['rtt_ms']:.0f}ms  修正 {stats['corrections']}  "
+                                      f"重算 {stats['rollback_ticks']} tick  等待 {stats['stalls']}",
+                                      True, TEXT_COLOR)
+        items.append((net_text, (CANVAS_WIDTH - net_text.get_width() - ui(10), ui(10))))
+
+    if rewinding:
+        rewind_text = font_effect.render(f"<< 倒轉 {len(snapshot_ring) / FPS:.1f}s  快照 {snapshot_ring.save_us:.0f}us  "
+                                         f"還原 {snapshot_ring.restore_us:.0f}us", True, REVIVE_PROMPT_COLOR)
+        items.append((rewind_text, (CANVAS_WIDTH - rewind_text.get_width() - ui(10), ui(30))))
+
+    if bot is not None:
+        bot_text = font_effect.render(f"電腦玩家{bot.player_id + 1} [{bot.mode}]  規劃 {bot.plan_ms:.2f}ms  "
+                                      f"展開 {bot.expanded}  重新規劃 {bot.replans}", True, TEXT_COLOR)
+        items.append((bot_text, (CANVAS_WIDTH - bot_text.get_width() - ui(10), ui(50))))
+
+    if frame_budget.level > 0:
+        quality_text = font_effect.render(f"畫質 -{frame_budget.level}  更新 {frame_budget.update_ms:.1f}ms  "
+                                          f"繪製 {frame_budget.render_ms:.1f}ms", True, TEXT_COLOR)
+        items.append((quality_text, (CANVAS_WIDTH - quality_text.get_width() - ui(10), ui(70))))
+
+    if surface_memory.budget is not None:
+        mb = 1024 * 1024
+        memory_text = font_effect.render(f"記憶體 {surface_memory.total / mb:.1f}/{surface_memory.budget / mb:.0f}MB  "
+                                         f"最高 {surface_memory.peak / mb:.1f}MB", True,
+                                         REVIVE_PROMPT_COLOR if surface_memory.over_budget else TEXT_COLOR)
+        items.append((memory_text, (CANVAS_WIDTH - memory_text.get_width() - ui(10), ui(90))))
+
+    # Display active effects
+    active_effects = effect_manager.get_active_effects_info()
+    y_offset = 50 + 25 * len(players)
+    for effect_str in active_effects:
+        effect_surf = font_effect.render(effect_str, True, TEXT_COLOR)
+        items.append((effect_surf, (ui(10), ui(y_offset))))
+        y_offset += 20
+
+    # Push hint (simplified as there can be multiple boxes)
+    # This needs to be smarter if there are multiple boxes. For now, it checks the first one if any.
+    if alive_count == len(players) and coop_box_group:
+        first_box = next(iter(coop_box_group))  # Get the first box
+        if proximity.all_near(first_box):
+            push_hint = font_tiny.render("兩人靠近可推箱" if len(players) == 2 else "全員靠近可推箱", True,
+                                         (225, 210, 80))
+            items.append((push_hint, (CANVAS_WIDTH // 2 - push_hint.get_width() // 2, ui(40))))
+    return items
+
+
+def draw_hud():
+    """依畫質等級每 hud_interval 幀才重新產生 HUD 文字，其他幀重複使用上次的結果。"""
+    global hud_items, hud_age
+    if hud_items is None or hud_age >= QUALITY_LEVELS[frame_budget.level]["hud_interval"]:
+        hud_items = build_hud_items()
+        hud_age = 0
+    hud_age += 1
+    render_queue.extend(LAYER_MESSAGES, hud_items)
+
+
+def draw_chain(surface, segments):
+    for index, start, end in segments:
+        if USE_ROPE_CHAIN:
+            chain_ropes[index].draw(surface, CHAIN_COLOR, ui(3), camera.offset, RENDER_SCALE)
+        else:
+            pygame.draw.line(surface, CHAIN_COLOR, render_queue.to_canvas(camera.apply_point(start)),
+                             render_queue.to_canvas(camera.apply_point(end)), ui(3))
+
+
+def draw_revive_progress(surface):
+    """在復活目標頭上畫進度圈。"""
+    percentage = min(revive_progress / REVIVE_HOLD_TIME, 1.0)
+    radius = 20
+    # rect for arc needs to be top-left, width, height
+    center_x, center_y = camera.apply_point(revive_target.death_pos)
+    arc_rect = pygame.Rect(int(center_x) - radius,
+                           int(center_y - PLAYER_RADIUS - radius * 1.5) - radius,  # Position above player's head
+                           radius * 2, radius * 2)
+    arc_rect = pygame.Rect(render_queue.to_canvas(arc_rect.topleft), (ui(radius * 2), ui(radius * 2)))
+
+    # Draw background circle (slightly transparent or darker)
+    pygame.draw.circle(surface, (80, 80, 80, 150) if pygame.SRCALPHA else (80, 80, 80), arc_rect.center, ui(radius),
+                       ui(2))
+
+    # Draw reviving progress arc
+    start_angle_rad = -math.pi / 2  # Start at the top (12 o'clock)
+    end_angle_rad = start_angle_rad + (percentage * 2 * math.pi)  # Full circle is 2*pi
+
+    if percentage > 0.01:  # Draw only if there's some progress
+        pygame.draw.arc(surface, REVIVE_PROMPT_COLOR, arc_rect, start_angle_rad, end_angle_rad, ui(4))
 
 
+render_queue = RenderQueue(RENDER_SCALE, track=surface_memory.tracker("scaled"))
+surface_memory.add_evictor("縮小精靈", render_queue.clear_scaled)
+
 # ---遊戲主程式循環---
 while running:
     dt = clock.tick(FPS) / 1000.0
-    keys = pygame.key.get_pressed()  # Get keys once per frame
-
-    for event in pygame.event.get():
+    frame_budget.begin_update()
+    events = pygame.event.get()
+    latency_tracker.received(events)
+    for event in events:
         if event.type == pygame.QUIT:
             running = False
+        input_devices.handle_event(event)
+        presenter.handle_event(event)
+        if scripted_input is not None:
+            scripted_input.handle_event(event)
 
         # --- 開始畫面事件處理 ---
         if game_state == STATE_START_SCREEN:
             if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RETURN:
-                    current_level_index = 0
-                    load_level(current_level_index)
-                    game_state = STATE_PLAYING
+                if event.key == pygame.K_RETURN and (net_session is None or net_session.peer.connected):
+                    start_level(0)
+        if event.type == pygame.KEYDOWN and game_state == STATE_PLAYING and net_session is None:
+            if event.key == QUICK_SAVE_KEY:
+                quick_save = (current_level_index, capture_game_state())
+            elif event.key == QUICK_LOAD_KEY and quick_save and quick_save[0] == current_level_index:
+                restore_game_state(quick_save[1])
+                snap_chain_ropes()
+                update_proximity()
+            elif event.key == BOT_TOGGLE_KEY:
+                if bot is None:
+                    bot = make_bot(bot_player_id)
+                    bot.attach(current_level, bot_player().rect.size)
+                else:
+                    bot = None
+        if event.type == pygame.KEYDOWN and event.key == MEMORY_REPORT_KEY:
+            print(memory_report())
+        if event.type == pygame.KEYDOWN and event.key == RECORD_KEY:
+            if recorder is None:
+                start_recording()
+            else:
+                stop_recording()
         if event.type == pygame.KEYDOWN:
             if (game_state == STATE_GAME_OVER or game_state == STATE_ALL_LEVELS_COMPLETE) and event.key == pygame.K_r:
-                if game_state == STATE_ALL_LEVELS_COMPLETE:
-                    current_level_index = 0
-                load_level(current_level_index)  # This will reset effects
+                start_level(0 if game_state == STATE_ALL_LEVELS_COMPLETE else current_level_index)
+
+    if file_watcher is not None:
+        handle_file_changes(file_watcher.changes())
+    if surface_memory.over_budget:
+        surface_memory.enforce()
+    if hot_reload_job is not None and not hot_reload_job.done:
+        hot_reload_job.poll(HOT_RELOAD_BUDGET_MS)
+
+    # 在取出事件之後才讀鍵盤與手把 (取出事件時 SDL 才更新按鍵狀態)，這一幀的輸入就能在這一幀模擬
+    frame = input_devices.poll()  # 每幀只讀一次鍵盤與手把，之後都只看 frame
+
+    if net_session is not None:
+        if game_state != STATE_PLAYING:
+            net_session.sync()  # 繼續收送封包，讓對方能確認最後的輸入
+        for code, value in net_session.take_control_events():
+            if code == CONTROL_LOAD_LEVEL:
+                current_level_index = value
+                begin_level_load(value)
 
     if game_state == STATE_START_SCREEN:
         prompt_blink_timer += dt
         if prompt_blink_timer >= prompt_blink_interval:
             prompt_blink_timer = 0.0  # 重置計時器
             prompt_text_visible = not prompt_text_visible
+    # ---遊戲狀態_載入關卡---
+    elif game_state == STATE_LEVEL_COMPLETE or game_state == STATE_LOADING:
+        level_loading_job.poll(LOADING_BUDGET_MS)
+        if level_loading_job.done:
+            load_level(loading_level_index)
     # ---遊戲狀態_遊玩中---
     elif game_state == STATE_PLAYING:
-        effect_manager.update(dt)  # Update effects first
-
-        # Update player movement (pass effect_manager and meteor_sprites)
-        player1.update_movement(laser_wall_sprites, coop_box_group, spike_trap_group, meteor_sprites, effect_manager,
-                                dt)
-        player2.update_movement(laser_wall_sprites, coop_box_group, spike_trap_group, meteor_sprites, effect_manager,
-                                dt)
-
-        # Player-Fruit collision
-        for player in player_sprites:
-            if player.is_alive:
-                collided_fruits = pygame.sprite.spritecollide(player, fruit_sprites,
-                                                              True)  # True to remove fruit on collision
-                for fruit in collided_fruits:
-                    effect_manager.apply_effect(fruit.fruit_type, player.player_id)
-                    # Add sound effect or visual feedback for fruit pickup here if desired
-
-        # Volcano effect: Spawn warnings and meteors
-        if effect_manager.should_spawn_meteor():
-            spawn_x = random.randint(METEOR_SIZE, SCREEN_WIDTH - METEOR_SIZE)
-            spawn_y = random.randint(METEOR_SIZE, SCREEN_HEIGHT - METEOR_SIZE)
-            warning_sprites.add(Warning(spawn_x, spawn_y, METEOR_WARNING_TIME))
-            effect_manager.reset_meteor_timer()
-
-        # Update warnings and spawn meteors
-        for warning in list(warning_sprites):  # Iterate over a copy for safe removal
-            if warning.update(dt):  # True if warning expired and meteor should spawn
-                meteor_sprites.add(Meteor(warning.spawn_pos[0], warning.spawn_pos[1]))
-
-        warning_sprites.update(dt)  # Ensure this is called if not done inside loop
-        meteor_sprites.update(dt)  # Update meteors (e.g., for lifetime)
-
-        # --- 推箱判斷 ---
-        if player1.is_alive and player2.is_alive:
-            for coop_box in coop_box_group:
-                p1_near = player1.pos.distance_to(coop_box.pos) < COOP_BOX_PUSH_RADIUS
-                p2_near = player2.pos.distance_to(coop_box.pos) < COOP_BOX_PUSH_RADIUS
-                if p1_near and p2_near:
-                    # Determine push direction from player inputs relative to the box
-                    # This logic might need refinement if players push in opposite directions
-                    # For simplicity, let's combine their intended directions
-                    dir_p1 = pygame.math.Vector2(0, 0)
-                    if keys[player1.control_keys['right']]: dir_p1.x += 1
-                    if keys[player1.control_keys['left']]: dir_p1.x -= 1
-                    if keys[player1.control_keys['down']]: dir_p1.y += 1
-                    if keys[player1.control_keys['up']]: dir_p1.y -= 1
-
-                    dir_p2 = pygame.math.Vector2(0, 0)
-                    if keys[player2.control_keys['right']]: dir_p2.x += 1
-                    if keys[player2.control_keys['left']]: dir_p2.x -= 1
-                    if keys[player2.control_keys['down']]: dir_p2.y += 1
-                    if keys[player2.control_keys['up']]: dir_p2.y -= 1
-
-                    # If players are trying to push, average their direction or use the dominant one
-                    # A more robust system would check if they are on opposite sides pushing towards each other
-                    # For now, if either is pushing, and they are both near, the box moves.
-                    # The direction can be tricky. A simple approach: if P1 pushes right, and P2 is also near, box moves right.
-                    # Let's use the combined direction from player inputs
-
-                    # Consider movement based on player positions relative to box and their input
-                    # A simpler model: if both near and any player is pushing towards the box's direction
-                    # For now, using combined normalized input:
-                    total_dir = pygame.math.Vector2(0, 0)
-                    # P1 movement input
-                    if keys[player1.control_keys['right']]: total_dir.x += 1
-                    if keys[player1.control_keys['left']]:  total_dir.x -= 1
-                    if keys[player1.control_keys['down']]:  total_dir.y += 1
-                    if keys[player1.control_keys['up']]:    total_dir.y -= 1
-                    # P2 movement input
-                    if keys[player2.control_keys['right']]: total_dir.x += 1
-                    if keys[player2.control_keys['left']]:  total_dir.x -= 1
-                    if keys[player2.control_keys['down']]:  total_dir.y += 1
-                    if keys[player2.control_keys['up']]:    total_dir.y -= 1
-
-                    if total_dir.length_squared() > 0:
-                        total_dir.normalize_ip()
-                        # Pass only laser_wall_sprites as obstacles for boxes
-                        coop_box.move(total_dir, laser_wall_sprites)
-
-        # --- 鎖鏈物理 ---
-        # (Chain physics code remains largely the same)
-        for _ in range(CHAIN_ITERATIONS):
-            if player1.is_alive and player2.is_alive:
-                p1_pos_vec = player1.pos
-                p2_pos_vec = player2.pos
-                delta = p2_pos_vec - p1_pos_vec
-                distance = delta.length()
-                if distance > CHAIN_MAX_LENGTH and distance != 0:
-                    diff = (distance - CHAIN_MAX_LENGTH) / distance
-                    # Correct for collision with walls/boxes after chain pull
-                    p1_new_pos = player1.pos + delta * 0.5 * diff
-                    p2_new_pos = player2.pos - delta * 0.5 * diff
-
-                    # Basic boundary check for chain pull (can be more sophisticated)
-                    player1.pos.x = max(player1.rect.width // 2,
-                                        min(p1_new_pos.x, SCREEN_WIDTH - player1.rect.width // 2))
-                    player1.pos.y = max(player1.rect.height // 2,
-                                        min(p1_new_pos.y, SCREEN_HEIGHT - player1.rect.height // 2))
-                    player2.pos.x = max(player2.rect.width // 2,
-                                        min(p2_new_pos.x, SCREEN_WIDTH - player2.rect.width // 2))
-                    player2.pos.y = max(player2.rect.height // 2,
-                                        min(p2_new_pos.y, SCREEN_HEIGHT - player2.rect.height // 2))
-
-                    player1.rect.center = player1.pos
-                    player2.rect.center = player2.pos
-
-            elif player1.is_alive and not player2.is_alive and player2.death_pos:
-                delta = player2.death_pos - player1.pos
-                distance = delta.length()
-                if distance > CHAIN_MAX_LENGTH and distance != 0:
-                    diff_factor = (distance - CHAIN_MAX_LENGTH) / distance
-                    p1_new_pos = player1.pos + delta * diff_factor
-                    player1.pos.x = max(player1.rect.width // 2,
-                                        min(p1_new_pos.x, SCREEN_WIDTH - player1.rect.width // 2))
-                    player1.pos.y = max(player1.rect.height // 2,
-                                        min(p1_new_pos.y, SCREEN_HEIGHT - player1.rect.height // 2))
-                    player1.rect.center = player1.pos
-            elif player2.is_alive and not player1.is_alive and player1.death_pos:
-                delta = player1.death_pos - player2.pos
-                distance = delta.length()
-                if distance > CHAIN_MAX_LENGTH and distance != 0:
-                    diff_factor = (distance - CHAIN_MAX_LENGTH) / distance
-                    p2_new_pos = player2.pos + delta * diff_factor
-                    player2.pos.x = max(player2.rect.width // 2,
-                                        min(p2_new_pos.x, SCREEN_WIDTH - player2.rect.width // 2))
-                    player2.pos.y = max(player2.rect.height // 2,
-                                        min(p2_new_pos.y, SCREEN_HEIGHT - player2.rect.height // 2))
-                    player2.rect.center = player2.pos
-
-        # ----是否過關---
-        goal1.update_status(player1)
-        goal2.update_status(player2)
-        if goal1.is_active and goal2.is_active and player1.is_alive and player2.is_alive:
-            current_level_index += 1
-            if current_level_index < len(levels_data):
-                load_level(current_level_index)
-            else:
-                game_state = STATE_ALL_LEVELS_COMPLETE
-        if not player1.is_alive and not player2.is_alive:
-            game_state = STATE_GAME_OVER
-
+        rewinding = net_session is None and frame.rewind
+        if rewinding:
+            # 每幀讀回前一個 tick 的快照
+            if snapshot_ring.pop(read_game_state):
+                snap_chain_ropes()
+                update_proximity()
+            outcome = None
+        elif net_session is None:
+            snapshot_ring.push(write_game_state)
+            latency_tracker.simulated()
+            outcome = simulate_tick(bot_input_frame(frame) if bot is not None else frame, dt)
+        else:
+            latency_tracker.simulated()
+            net_session.step(frame.combined())
+            outcome = net_session.poll_outcome()
+        if outcome is not None:
+            finish_level(outcome)
 
     # ---遊戲畫面繪製---
-    screen.fill(BLACK)
+    frame_budget.begin_render()
+    current_lw_alpha = effect_manager.get_laser_wall_alpha()
+    # 地刺已畫在背景中。牆壁完全不透明時直接用包含牆壁的背景，否則用地板背景再依透明度畫牆壁
+    walls_in_background = (current_level is not None and game_state != STATE_START_SCREEN and
+                           current_lw_alpha == effect_manager.default_laser_wall_alpha)
+    if walls_in_background:
+        current_level.render_cache["background"].draw(screen, camera)
+    elif current_level is not None and game_state != STATE_START_SCREEN:
+        current_level.render_cache["floor"].draw(screen, camera)
+    else:
+        screen.fill(BLACK)
 
+    view = camera.rect
     if game_state == STATE_START_SCREEN:
         title_text = font_large.render("雙人合作遊戲 Demo", True, TEXT_COLOR)
-        screen.blit(title_text, (SCREEN_WIDTH // 2 - title_text.get_width() // 2, SCREEN_HEIGHT // 3))
+        render_queue.add(LAYER_MESSAGES, title_text,
+                         (CANVAS_WIDTH // 2 - title_text.get_width() // 2, CANVAS_HEIGHT // 3))
 
         if prompt_text_visible:  # 只有當 prompt_text_visible 為 True 時才繪製
-            start_prompt_text = font_small.render("按 Enter 開始遊戲", True, TEXT_COLOR)
-            screen.blit(start_prompt_text, (SCREEN_WIDTH // 2 - start_prompt_text.get_width() // 2, SCREEN_HEIGHT // 2))
-
-    elif game_state == STATE_PLAYING:
-        # ... 您現有的遊戲畫面繪製 ...
-        draw_game_state_messages()  # UI 文字等
-    elif game_state == STATE_GAME_OVER or game_state == STATE_ALL_LEVELS_COMPLETE:
-        draw_game_state_messages()  # 遊戲結束/完成訊息
-
-    show_opencv_paint_window()  # If used
+            if net_session is not None and not net_session.peer.connected:
+                start_prompt_text = font_small.render("等待對方連線…", True, TEXT_COLOR)
+            else:
+                start_prompt_text = font_small.render("按 Enter 開始遊戲", True, TEXT_COLOR)
+            render_queue.add(LAYER_MESSAGES, start_prompt_text,
+                             (CANVAS_WIDTH // 2 - start_prompt_text.get_width() // 2, CANVAS_HEIGHT // 2))
 
     # Update laser wall visuals based on effect manager
-    current_lw_alpha = effect_manager.get_laser_wall_alpha()
     for wall_sprite in laser_wall_sprites:  # Use a different variable name if 'wall' is used elsewhere
         if hasattr(wall_sprite, 'update_visuals'):  # Check if it's a LaserWall with the method
             wall_sprite.update_visuals(current_lw_alpha)
 
-    laser_wall_sprites.draw(screen)  # Always draw; their alpha determines visibility
+    if not walls_in_background:
+        render_queue.add_sprites(LAYER_WALLS, laser_wall_sprites, view)  # Their alpha determines visibility
 
-    goal_sprites.draw(screen)  # Draw goals first
-    for goal_sprite in goal_sprites:  # Custom draw for active state highlight
-        goal_sprite.draw(screen)
+    render_queue.add_sprites(LAYER_GOALS, goal_sprites, view)  # 站上目標時的外框已經畫在圖片裡
 
     for coop_box_item in coop_box_group:  # Renamed to avoid conflict
-        coop_box_item.draw(screen)
+        if not view.colliderect(coop_box_item.rect.inflate(COOP_BOX_SIZE, COOP_BOX_SIZE)):
+            continue
+        render_queue.add_scaled(LAYER_BOXES, coop_box_item.image, coop_box_item.screen_rect(camera.offset).topleft)
         # Number display on boxes
-        p1_on_box = player1.is_alive and player1.pos.distance_to(coop_box_item.pos) < COOP_BOX_PUSH_RADIUS
-        p2_on_box = player2.is_alive and player2.pos.distance_to(coop_box_item.pos) < COOP_BOX_PUSH_RADIUS
-        num_on_box = int(p1_on_box) + int(p2_on_box)
-        if num_on_box < 2:  # Show remaining needed
-            box_text_val = 2 - num_on_box
+        num_on_box = proximity.pushers(coop_box_item)
+        if num_on_box < len(players):  # Show remaining needed
+            box_text_val = len(players) - num_on_box
             if box_text_val > 0:
                 box_text = font_small.render(str(box_text_val), True, WHITE)
-                box_cx, box_cy = int(coop_box_item.rect.centerx), int(coop_box_item.rect.centery)
-                screen.blit(box_text, (box_cx - box_text.get_width() // 2, box_cy - box_text.get_height() // 2))
-
-    for spike in spike_trap_group:
-        spike.update(dt)  # Update spike state
-        spike.draw(screen)
+                box_cx, box_cy = render_queue.to_canvas(camera.apply_point(coop_box_item.rect.center))
+                render_queue.add(LAYER_BOX_LABELS, box_text,
+                                 (box_cx - box_text.get_width() // 2, box_cy - box_text.get_height() // 2))
 
-    fruit_sprites.draw(screen)  # Draw fruits
-    warning_sprites.draw(screen)  # Draw warnings
-    meteor_sprites.draw(screen)  # Draw meteors
+    render_queue.add_sprites(LAYER_FRUITS, fruit_sprites, view)
+    render_queue.add_sprites(LAYER_WARNINGS, warning_sprites, view)
+    render_queue.add_sprites(LAYER_METEORS, meteor_sprites, view)
+    if particle_system.count:
+        render_queue.add_draw(LAYER_PARTICLES,
+                              lambda surface: particle_system.draw(surface, camera.offset, RENDER_SCALE))
 
     # 繪製鎖鏈
-    chain_start_pos = None
-    chain_end_pos = None
-    can_draw_chain = False
-    if player1.is_alive and player2.is_alive:
-        chain_start_pos = player1.rect.center
-        chain_end_pos = player2.rect.center
-        can_draw_chain = True
-    elif player1.is_alive and not player2.is_alive and player2.death_pos:
-        chain_start_pos = player1.rect.center
-        chain_end_pos = player2.death_pos
-        can_draw_chain = True
-    elif player2.is_alive and not player1.is_alive and player1.death_pos:
-        chain_start_pos = player2.rect.center
-        chain_end_pos = player1.death_pos
-        can_draw_chain = True
-    if can_draw_chain:
-        pygame.draw.line(screen, CHAIN_COLOR, chain_start_pos, chain_end_pos, 3)
-
-    player_sprites.draw(screen)  # Draw players on top of most things
+    segments = get_chain_segments()
+    if segments:
+        render_queue.add_draw(LAYER_CHAIN, lambda surface: draw_chain(surface, segments))
 
-    draw_game_state_messages()  # Draw UI text last
+    render_queue.add_sprites(LAYER_PLAYERS, player_sprites, view)  # Draw players on top of most things
 
-    # 判斷復活條件
-    # keys already gotten at top of loop
-    if game_state == STATE_PLAYING:
-        # Reset revive_target and progress if conditions change
-        current_revive_initiator = None
-        potential_target_player = None
-
-        if player1.is_alive and not player2.is_alive and player2.death_pos:
-            if player1.pos.distance_to(player2.death_pos) <= REVIVAL_RADIUS:
-                if keys[REVIVE_KEYP1]:
-                    current_revive_initiator = player1
-                    potential_target_player = player2
-                    if revive_target != player2:  # New target or first press
-                        revive_target = player2
-                        revive_progress = 0
-                    revive_progress += dt
-                else:  # Key not held for P1
-                    if revive_target == player2:  # Was P1 reviving P2?
-                        revive_progress = 0
-                        # revive_target = None # Keep target to draw incomplete circle maybe
-            # else: # P1 too far from P2's body
-            #     if revive_target == player2:
-            #         revive_progress = 0
-            #         # revive_target = None
-
-        elif player2.is_alive and not player1.is_alive and player1.death_pos:
-            if player2.pos.distance_to(player1.death_pos) <= REVIVAL_RADIUS:
-                if keys[REVIVE_KEYP2]:
-                    current_revive_initiator = player2
-                    potential_target_player = player1
-                    if revive_target != player1:
-                        revive_target = player1
-                        revive_progress = 0
-                    revive_progress += dt
-                else:  # Key not held for P2
-                    if revive_target == player1:
-                        revive_progress = 0
-                        # revive_target = None
-            # else: # P2 too far from P1's body
-            #     if revive_target == player1:
-            #         revive_progress = 0
-            #         # revive_target = None
-
-        # If no one is actively reviving, or conditions are not met, reset progress
-        if not (keys[REVIVE_KEYP1] and revive_target == player2 and player1.pos.distance_to(
-                player2.death_pos) <= REVIVAL_RADIUS) and \
-                not (keys[REVIVE_KEYP2] and revive_target == player1 and player2.pos.distance_to(
-                    player1.death_pos) <= REVIVAL_RADIUS):
-            if revive_target is not None and revive_progress < REVIVE_HOLD_TIME:  # Only reset if not completed
-                pass  # keep partial progress visible if key released momentarily
-            if not ((player1.is_alive and not player2.is_alive and player2.death_pos and player1.pos.distance_to(
-                    player2.death_pos) <= REVIVAL_RADIUS and keys[REVIVE_KEYP1]) or \
-                    (player2.is_alive and not player1.is_alive and player1.death_pos and player2.pos.distance_to(
-                        player1.death_pos) <= REVIVAL_RADIUS and keys[REVIVE_KEYP2])):
-                revive_progress = 0  # Full reset if conditions are not met at all
-                # revive_target = None # Could also reset target here
-
-        if revive_progress >= REVIVE_HOLD_TIME and revive_target is not None:
-            if revive_target == player2:  # P1 revived P2
-                player2.revive()
-            elif revive_target == player1:  # P2 revived P1
-                player1.revive()
-            revive_progress = 0
-            revive_target = None
+    draw_game_state_messages()  # Draw UI text last
 
     # --- 繪製復活進度圈 ---
-    if revive_target is not None and revive_progress > 0:
-        percentage = min(revive_progress / REVIVE_HOLD_TIME, 1.0)
-        # angle = percentage * 360 # For pygame.draw.arc, angle is in radians
-
-        # Find the center for the circle (death position of the target)
-        center_pos_death = None
-        if revive_target == player1 and player1.death_pos:
-            center_pos_death = player1.death_pos
-        elif revive_target == player2 and player2.death_pos:
-            center_pos_death = player2.death_pos
-
-        if center_pos_death:
-            radius = 20
-            # rect for arc needs to be top-left, width, height
-            arc_rect = pygame.Rect(int(center_pos_death.x) - radius,
-                                   int(center_pos_death.y - PLAYER_RADIUS - radius * 1.5) - radius,
-                                   # Position above player's head
-                                   radius * 2, radius * 2)
-
-            # Draw background circle (slightly transparent or darker)
-            pygame.draw.circle(screen, (80, 80, 80, 150) if pygame.SRCALPHA else (80, 80, 80), arc_rect.center, radius,
-                               2)
-
-            # Draw reviving progress arc
-            start_angle_rad = -math.pi / 2  # Start at the top (12 o'clock)
-            end_angle_rad = start_angle_rad + (percentage * 2 * math.pi)  # Full circle is 2*pi
-
-            if percentage > 0.01:  # Draw only if there's some progress
-                pygame.draw.arc(screen, REVIVE_PROMPT_COLOR, arc_rect, start_angle_rad, end_angle_rad, 4)
-
-    pygame.display.flip()
+    if revive_target is not None and revive_progress > 0 and revive_target.death_pos:
+        render_queue.add_draw(LAYER_REVIVE, draw_revive_progress)
+
+    if recorder is not None:
+        draw_recording_indicator()
+
+    render_queue.submit(screen)
+    presenter.present()
+    latency_tracker.presented()
+    if recorder is not None:
+        recorder.capture(screen)  # 只複製像素，編碼在背景執行緒
+    if frame_budget.end_frame():
+        apply_quality(frame_budget.level)
+
+    # --- 延遲量測 (合成輸入) ---
+    if scripted_input is not None:
+        scripted_input.update()  # 事件在下一幀取出，中間的等待也算進延遲
+        if game_state in (STATE_START_SCREEN, STATE_GAME_OVER, STATE_ALL_LEVELS_COMPLETE):
+            start_level(current_level_index if game_state == STATE_GAME_OVER else 0)
+        if time.perf_counter() >= latency_bench_end:
+            running = False
 
+if recorder is not None:
+    stop_recording()
+if telemetry is not None:
+    telemetry.close()
+    print(f"遙測已儲存: {telemetry.directory} ({telemetry.written} 筆，丟棄 {telemetry.dropped} 筆)")
+    if telemetry.error:
+        print(telemetry.error)
+if cli_args.memory_report:
+    print(memory_report())
+if cli_args.latency_report or scripted_input is not None:
+    print(latency_tracker.report())
+asset_loader.shutdown()
+if file_watcher is not None:
+    file_watcher.stop()
+if net_session is not None:
+    net_session.peer.close()
 pygame.quit()
-if use_opencv:
-    cv2.destroyAllWindows()
\ No newline at end of file
+if paint_canvas is not None:
+    paint_canvas.close()
\ No newline at end of file
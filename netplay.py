@@ -0,0 +1,429 @@
+import asyncio
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from inputs import INPUT_LEFT, INPUT_RIGHT
+
+# --- 封包格式 ---
+PACKET_INPUT = b"I"  # type, epoch, start_tick, count, 之後 count 個位元組的輸入
+PACKET_PING = b"P"  # type, 送出時間
+PACKET_PONG = b"Q"  # type, 原本 ping 的送出時間
+PACKET_CONTROL = b"C"  # type, epoch, code, value
+_INPUT_HEADER = struct.Struct("!cBIB")
+_PING = struct.Struct("!cd")
+_CONTROL = struct.Struct("!cBBH")
+
+CONTROL_LOAD_LEVEL = 1  # value: 關卡索引
+
+
+# --- UDP 傳輸 (asyncio) ---
+class _PeerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, peer):
+        self.peer = peer
+
+    def datagram_received(self, data, addr):
+        peer = self.peer
+        if peer.remote_addr is not None and addr != peer.remote_addr:
+            return
+        if peer.remote_addr is None:
+            peer.remote_addr = addr  # 主機端在收到第一個封包時才知道對方位址
+        peer.packets_received += 1
+        kind = data[:1]
+        if kind == PACKET_PING:
+            _, sent_at = _PING.unpack_from(data)
+            peer._send_now(_PING.pack(PACKET_PONG, sent_at))
+        elif kind == PACKET_PONG:
+            _, sent_at = _PING.unpack_from(data)
+            peer.rtt_samples.append((time.perf_counter() - sent_at) * 1000.0)
+        else:
+            peer.inbox.put(data)
+
+
+class NetplayPeer:
+    """
+    在背景執行緒跑 asyncio 的 UDP 端點。遊戲執行緒只透過 send() 與 poll() 交換資料，永遠不會等待網路。
+    可以模擬延遲、抖動與封包遺失，方便在 localhost 測試。
+    Args:
+        local_port (int): 本機綁定的埠。
+        remote_addr (tuple): 對方的 (host, port)；主機端可為 None，收到第一個封包後自動設定。
+        latency_ms (float): 模擬的單向延遲。
+        jitter_ms (float): 模擬延遲的隨機變動範圍 (±)。
+        loss (float): 模擬的封包遺失率 (0~1)。
+        ping_interval (float): 量測來回時間的間隔 (秒)。
+        seed (int): 模擬網路用的隨機種子。
+    """
+
+    def __init__(self, local_port, remote_addr=None, latency_ms=0.0, jitter_ms=0.0, loss=0.0,
+                 ping_interval=0.25, seed=None, host="127.0.0.1"):
+        self.local_addr = (host, local_port)
+        if remote_addr is not None:
+            remote_addr = (socket.gethostbyname(remote_addr[0]), remote_addr[1])
+        self.remote_addr = remote_addr
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.ping_interval = ping_interval
+        self.inbox = queue.SimpleQueue()
+        self.rtt_samples = deque(maxlen=120)
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.packets_dropped = 0  # 模擬遺失而沒有送出的封包
+        self._rng = random.Random(seed)
+        self._loop = None
+        self._transport = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="netplay", daemon=True)
+        self._thread.start()
+        self._ready.wait(5.0)
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._open())
+        self._ready.set()
+        self._loop.run_forever()
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._loop.close()
+
+    async def _open(self):
+        self._transport, _ = await self._loop.create_datagram_endpoint(lambda: _PeerProtocol(self),
+                                                                       local_addr=self.local_addr)
+        self._loop.create_task(self._ping_loop())
+
+    async def _ping_loop(self):
+        while True:
+            if self.remote_addr is not None:
+                self._send_now(_PING.pack(PACKET_PING, time.perf_counter()))
+            await asyncio.sleep(self.ping_interval)
+
+    def _send_now(self, data):
+        # 只在 asyncio 執行緒中呼叫
+        if self._transport is None or self.remote_addr is None:
+            return
+        if self.loss and self._rng.random() < self.loss:
+            self.packets_dropped += 1
+            return
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay += self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        self.packets_sent += 1
+        if delay > 0:
+            self._loop.call_later(delay / 1000.0, self._transport.sendto, data, self.remote_addr)
+        else:
+            self._transport.sendto(data, self.remote_addr)
+
+    def send(self, data):
+        """從遊戲執行緒送出封包 (不會阻塞)。"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._send_now, data)
+
+    def poll(self):
+        """取出目前收到的所有封包。"""
+        packets = []
+        while True:
+            try:
+                packets.append(self.inbox.get_nowait())
+            except queue.Empty:
+                return packets
+
+    @property
+    def connected(self):
+        return bool(self.rtt_samples)
+
+    @property
+    def rtt_ms(self):
+        if not self.rtt_samples:
+            return 0.0
+        return sum(self.rtt_samples) / len(self.rtt_samples)
+
+    def close(self):
+        if self._loop is None:
+            return
+        def stop():
+            if self._transport is not None:
+                self._transport.close()
+            loop.stop()
+        loop = self._loop
+        loop.call_soon_threadsafe(stop)
+        self._thread.join(1.0)
+        self._loop = None
+
+
+# --- 預測與回滾 ---
+class RollbackSession:
+    """
+    本機輸入立刻套用 (零額外延遲)，對方輸入還沒到時用它最後一次確定的輸入預測。
+    收到的真實輸入與預測不同時，讀回那一個 tick 的快照並用正確輸入重新模擬到現在。
+    Args:
+        peer (NetplayPeer): 網路端點。
+        local_player (int): 本機玩家編號 (0 或 1)。
+        save_state (callable): save_state() -> 快照。
+        load_state (callable): load_state(快照)。
+        advance (callable): advance(inputs_by_player, resimulating) 前進一個 tick，
+            回傳值 (例如過關、遊戲結束) 在那個 tick 確定後由 poll_outcome() 取得。
+        max_rollback (int): 最多回滾的 tick 數，對方落後超過時本機暫停等待。
+        redundancy (int): 每個封包重複附帶最近幾個 tick 的輸入，抵抗封包遺失。
+    """
+
+    def __init__(self, peer, local_player, save_state, load_state, advance, max_rollback=12, redundancy=10):
+        self.peer = peer
+        self.local_player = local_player
+        self.remote_player = 1 - local_player
+        self.save_state = save_state
+        self.load_state = load_state
+        self.advance = advance
+        self.max_rollback = max_rollback
+        self.redundancy = redundancy
+        self.epoch = 0
+        self.corrections = 0  # 預測錯誤而回滾的次數
+        self.rollback_ticks = 0  # 回滾時重新模擬的 tick 總數
+        self.stalls = 0  # 對方落後太多而暫停的幀數
+        self.control_events = []  # 對方送來的 (code, value)
+        self._future_packets = []
+        self._previous_tail = None  # 上一段最後的輸入封包，換關後再重送一陣子，以免對方卡在等待
+        self._previous_tail_resends = 0
+        self._control_packet = None  # 控制指令也會重送一陣子
+        self._control_resends = 0
+        self.tick = -1
+        self.reset(0)
+
+    def reset(self, epoch):
+        """新的一段模擬 (例如換關) 開始，tick 從 0 重新計算。"""
+        if self.tick > 0:
+            self._previous_tail = self._input_packet()
+            self._previous_tail_resends = 120
+        self.epoch = epoch % 256
+        self.tick = 0
+        self.local_inputs = {}
+        self.remote_inputs = {}
+        self.remote_confirmed = -1  # 對方輸入已連續確定到這個 tick
+        self.predicted = {}
+        self.snapshots = {}
+        self.outcomes = {}
+        self._outcome_checked = -1
+        self._control_received = False
+        pending, self._future_packets = self._future_packets, []
+        self._handle_packets(pending)
+
+    def is_confirmed(self):
+        """目前模擬到的每個 tick 是否都已經用對方的真實輸入模擬過。"""
+        return self.remote_confirmed >= self.tick - 1
+
+    def poll_outcome(self):
+        """回傳第一個已確定的 tick 中 advance 傳回的非 None 結果，沒有則回傳 None。"""
+        last = min(self.remote_confirmed, self.tick - 1)
+        while self._outcome_checked < last:
+            self._outcome_checked += 1
+            outcome = self.outcomes.get(self._outcome_checked)
+            if outcome is not None:
+                return outcome
+        return None
+
+    def send_control(self, code, value=0):
+        """送出開始、重新開始等不屬於每 tick 輸入的指令。"""
+        self._control_packet = _CONTROL.pack(PACKET_CONTROL, self.epoch, code, value)
+        self._control_resends = 60
+        self.peer.send(self._control_packet)
+
+    def take_control_events(self):
+        events, self.control_events = self.control_events, []
+        return events
+
+    def _input_packet(self):
+        last = self.tick if self.tick in self.local_inputs else self.tick - 1
+        if last < 0:
+            return None
+        start = max(0, last - self.redundancy + 1)
+        bits = bytes(self.local_inputs.get(t, 0) for t in range(start, last + 1))
+        return _INPUT_HEADER.pack(PACKET_INPUT, self.epoch, start, len(bits)) + bits
+
+    def _send_inputs(self):
+        if self._control_resends > 0:
+            self._control_resends -= 1
+            self.peer.send(self._control_packet)
+        if self._previous_tail_resends > 0:
+            self._previous_tail_resends -= 1
+            if self._previous_tail is not None:
+                self.peer.send(self._previous_tail)
+        packet = self._input_packet()
+        if packet is not None:
+            self.peer.send(packet)
+
+    def _handle_packets(self, packets):
+        earliest_mismatch = None
+        for data in packets:
+            kind = data[:1]
+            if kind == PACKET_CONTROL:
+                _, epoch, code, value = _CONTROL.unpack_from(data)
+                if epoch == self.epoch and not self._control_received:
+                    self._control_received = True  # 重送的同一個指令只處理一次
+                    self.control_events.append((code, value))
+                continue
+            if kind != PACKET_INPUT:
+                continue
+            _, epoch, start, count = _INPUT_HEADER.unpack_from(data)
+            if epoch != self.epoch:
+                if (epoch - self.epoch) % 256 < 128:
+                    self._future_packets.append(data)  # 對方已經換關，先留著
+                continue
+            payload = data[_INPUT_HEADER.size:_INPUT_HEADER.size + count]
+            for i, bits in enumerate(payload):
+                t = start + i
+                if t <= self.remote_confirmed or t in self.remote_inputs:
+                    continue
+                self.remote_inputs[t] = bits
+                if t < self.tick and self.predicted.get(t) != bits:
+                    if earliest_mismatch is None or t < earliest_mismatch:
+                        earliest_mismatch = t
+        while self.remote_confirmed + 1 in self.remote_inputs:
+            self.remote_confirmed += 1
+        return earliest_mismatch
+
+    def _remote_input_for(self, t):
+        if t in self.remote_inputs:
+            return self.remote_inputs[t]
+        return self.remote_inputs.get(self.remote_confirmed, 0)  # 預測：沿用最後確定的輸入
+
+    def _inputs_for(self, t, remote_bits):
+        inputs = [0, 0]
+        inputs[self.local_player] = self.local_inputs[t]
+        inputs[self.remote_player] = remote_bits
+        return inputs
+
+    def _rollback(self, from_tick):
+        self.load_state(self.snapshots[from_tick])
+        self.corrections += 1
+        for t in range(from_tick, self.tick):
+            if t != from_tick:
+                self.snapshots[t] = self.save_state()
+            remote_bits = self._remote_input_for(t)
+            self.predicted[t] = remote_bits
+            self.outcomes[t] = self.advance(self._inputs_for(t, remote_bits), True)
+            self.rollback_ticks += 1
+
+    def sync(self):
+        """只收封包並修正預測，不前進 (例如等待換關或等待對方確認時)。"""
+        mismatch = self._handle_packets(self.peer.poll())
+        if mismatch is not None and mismatch in self.snapshots:
+            self._rollback(mismatch)
+        self._send_inputs()
+
+    def step(self, local_bits):
+        """
+        收網路封包、必要時回滾，然後用本機輸入前進一個 tick。
+        Returns:
+            bool: 這一幀是否有前進 (對方落後超過 max_rollback 時會暫停)。
+        """
+        mismatch = self._handle_packets(self.peer.poll())
+        if mismatch is not None and mismatch in self.snapshots:
+            self._rollback(mismatch)
+
+        if self.tick - (self.remote_confirmed + 1) >= self.max_rollback:
+            self.stalls += 1
+            self._send_inputs()  # 重送，以防對方一直沒收到
+            return False
+
+        self.local_inputs[self.tick] = local_bits
+        self._send_inputs()
+        self.snapshots[self.tick] = self.save_state()
+        remote_bits = self._remote_input_for(self.tick)
+        self.predicted[self.tick] = remote_bits
+        self.outcomes[self.tick] = self.advance(self._inputs_for(self.tick, remote_bits), False)
+        self.tick += 1
+
+        # 丟掉不可能再回滾到的舊資料
+        oldest = min(self.tick - self.max_rollback - 1, self.remote_confirmed, self._outcome_checked)
+        for table in (self.snapshots, self.predicted, self.local_inputs, self.outcomes):
+            for t in [t for t in table if t < oldest]:
+                del table[t]
+        for t in [t for t in self.remote_inputs if t < oldest - self.redundancy]:
+            del self.remote_inputs[t]
+        return True
+
+    def stats(self):
+        return {
+            "tick": self.tick,
+            "rtt_ms": self.peer.rtt_ms,
+            "corrections": self.corrections,
+            "rollback_ticks": self.rollback_ticks,
+            "stalls": self.stalls,
+            "packets_sent": self.peer.packets_sent,
+            "packets_received": self.peer.packets_received,
+            "packets_dropped": self.peer.packets_dropped,
+        }
+
+
+# --- localhost 自我測試 ---
+def _self_test(ticks=600, latency_ms=40.0, jitter_ms=10.0, loss=0.05, base_port=47100):
+    """
+    兩個 RollbackSession 在 localhost 上以模擬的延遲與遺失互連，跑一個確定性的小模擬，
+    最後比對兩邊的狀態是否一致，並印出量到的來回時間與修正次數。
+    """
+    def make_sim():
+        state = {"pos": [0, 0], "checksum": 0}
+
+        def advance(inputs, resimulating):
+            for player, bits in enumerate(inputs):
+                state["pos"][player] += (1 if bits & INPUT_RIGHT else 0) - (1 if bits & INPUT_LEFT else 0)
+            state["checksum"] = (state["checksum"] * 31 + state["pos"][0] * 7 + state["pos"][1]) % 1000000007
+
+        return state, (lambda: (list(state["pos"]), state["checksum"])), \
+            (lambda snap: state.update(pos=list(snap[0]), checksum=snap[1])), advance
+
+    peers = [NetplayPeer(base_port, ("127.0.0.1", base_port + 1), latency_ms, jitter_ms, loss, seed=1),
+             NetplayPeer(base_port + 1, ("127.0.0.1", base_port), latency_ms, jitter_ms, loss, seed=2)]
+    sessions = []
+    states = []
+    for player, peer in enumerate(peers):
+        peer.start()
+        state, save, load, advance = make_sim()
+        states.append(state)
+        sessions.append(RollbackSession(peer, player, save, load, advance))
+
+    rng = random.Random(0)
+    inputs = [[rng.choice((0, INPUT_LEFT, INPUT_RIGHT)) for _ in range(ticks)] for _ in range(2)]
+    frame = 1.0 / 60
+    while min(s.tick for s in sessions) < ticks:
+        start = time.perf_counter()
+        for player, session in enumerate(sessions):
+            if session.tick < ticks:
+                session.step(inputs[player][session.tick])
+        time.sleep(max(0.0, frame - (time.perf_counter() - start)))
+    # 等最後的輸入到齊並完成修正
+    deadline = time.perf_counter() + 3.0
+    while not all(s.is_confirmed() for s in sessions) and time.perf_counter() < deadline:
+        for session in sessions:
+            session.sync()
+        time.sleep(frame)
+
+    for player, session in enumerate(sessions):
+        print(f"P{player + 1}: {session.stats()}")
+    same = states[0] == states[1]
+    print("狀態一致" if same else f"狀態不一致: {states}")
+    for peer in peers:
+        peer.close()
+    return same
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="在 localhost 上測試預測與回滾")
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--latency", type=float, default=40.0, help="單向延遲 (毫秒)")
+    parser.add_argument("--jitter", type=float, default=10.0)
+    parser.add_argument("--loss", type=float, default=0.05)
+    args = parser.parse_args()
+    raise SystemExit(0 if _self_test(args.ticks, args.latency, args.jitter, args.loss) else 1)
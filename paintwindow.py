@@ -0,0 +1,122 @@
+import os
+import subprocess
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_RUNNING = 1
+_STOP = 0
+
+
+def _attach(name):
+    """子行程連上已經存在的共享記憶體，不讓子行程結束時把它刪掉。"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python 3.12 以前沒有 track 參數
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+# --- 共享記憶體塗鴉區 ---
+class SharedPaintCanvas:
+    """
+    P2 的塗鴉區放在共享記憶體裡的 (高, 寬, 3) BGR NumPy 陣列，由另一個行程的 OpenCV 視窗顯示與編輯。
+    遊戲只直接讀寫 pixels，cv2.imshow / cv2.waitKey 都在另一個行程，視窗怎麼卡都不會影響遊戲迴圈。
+    共享記憶體最後一個位元組是控制旗標，主行程把它設為 0 就會讓視窗行程結束。
+    Args:
+        width (int): 塗鴉區寬度。
+        height (int): 塗鴉區高度。
+        window_name (str): OpenCV 視窗標題。
+        fill (int): 初始的灰階底色。
+    """
+
+    def __init__(self, width, height, window_name, fill=200):
+        self.shape = (height, width, 3)
+        self.window_name = window_name
+        size = height * width * 3
+        self._shm = shared_memory.SharedMemory(create=True, size=size + 1)
+        self.pixels = np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf)
+        self.pixels[:] = fill
+        self._control = np.ndarray((1,), dtype=np.uint8, buffer=self._shm.buf, offset=size)
+        self._control[0] = _RUNNING
+        self._process = None
+
+    def start(self):
+        """用獨立的 Python 行程開啟視窗 (不是 fork 出遊戲本身，所以不會重新執行 main.py)。"""
+        if self._process is None:
+            self._process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), self._shm.name, str(self.shape[1]), str(self.shape[0]),
+                 self.window_name])
+        return self
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def close(self, timeout=1.0):
+        """請視窗行程結束並釋放共享記憶體。"""
+        if self._shm is None:
+            return
+        self._control[0] = _STOP
+        if self._process is not None:
+            try:
+                self._process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+        self.pixels = self._control = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # 還有別人拿著 pixels，映射等行程結束時才釋放
+        self._shm.unlink()
+        self._shm = None
+
+
+def run_window(shm_name, width, height, window_name, brush_radius=6, brush_color=(40, 40, 200), interval_ms=16):
+    """
+    視窗行程：顯示共享的塗鴉區，左鍵拖曳作畫，右鍵清除，Esc 或關閉視窗結束。
+    """
+    import cv2
+
+    shm = _attach(shm_name)
+    size = height * width * 3
+    pixels = np.ndarray((height, width, 3), dtype=np.uint8, buffer=shm.buf)
+    control = np.ndarray((1,), dtype=np.uint8, buffer=shm.buf, offset=size)
+    drawing = [False]
+    canvas = [pixels]  # 回呼只透過這裡拿共享記憶體，結束時清空，之後才到的滑鼠事件不會再碰它
+
+    def on_mouse(event, x, y, flags, param):
+        if not canvas:
+            return
+        if event == cv2.EVENT_LBUTTONDOWN:
+            drawing[0] = True
+        elif event == cv2.EVENT_LBUTTONUP:
+            drawing[0] = False
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            canvas[0][:] = 200
+        if drawing[0] and event in (cv2.EVENT_LBUTTONDOWN, cv2.EVENT_MOUSEMOVE):
+            cv2.circle(canvas[0], (x, y), brush_radius, brush_color, -1)
+
+    try:
+        cv2.namedWindow(window_name)
+        cv2.setMouseCallback(window_name, on_mouse)
+        while control[0] == _RUNNING:
+            cv2.imshow(window_name, pixels)
+            key = cv2.waitKey(interval_ms) & 0xFF
+            if key == 27 or cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) < 1:
+                break
+        cv2.setMouseCallback(window_name, lambda *args: None)
+        cv2.destroyWindow(window_name)
+    finally:
+        canvas.clear()
+        del pixels, control
+        shm.close()
+
+
+if __name__ == "__main__":
+    run_window(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4])
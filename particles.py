@@ -0,0 +1,102 @@
+import numpy as np
+import pygame
+
+
+# --- 粒子系統 ---
+class ParticleSystem:
+    """
+    以預先配置的 NumPy 陣列存放所有粒子 (位置、速度、壽命、顏色)，
+    更新與繪製都是向量化的批次運算，不會為每個粒子建立 Python 物件。
+    存活的粒子永遠緊密排在陣列的前 count 個位置。
+    Args:
+        capacity (int): 最多同時存在的粒子數，超出時新的粒子會被忽略。
+        drag (float): 每秒保留的速度比例 (0~1)。
+        size (int): 每個粒子畫成 size x size 的方塊。
+        seed (int): 隨機種子，可為 None。
+    """
+
+    def __init__(self, capacity=16384, drag=0.2, size=2, seed=None):
+        self.capacity = capacity
+        self.drag = drag
+        self.size = size
+        self.count = 0
+        self.density = 1.0  # 0~1，發射粒子數量的倍率
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.vel = np.zeros((capacity, 2), dtype=np.float32)
+        self.life = np.zeros(capacity, dtype=np.float32)
+        self.max_life = np.ones(capacity, dtype=np.float32)
+        self.color = np.zeros((capacity, 3), dtype=np.float32)
+        self._rng = np.random.default_rng(seed)
+
+    def emit(self, x, y, amount, color, speed=150.0, lifetime=0.6):
+        """
+        從 (x, y) 向四周發射一批粒子。
+        Args:
+            x (float): 發射點 x。
+            y (float): 發射點 y。
+            amount (int): 粒子數量 (會乘上 density)。
+            color (tuple): RGB 顏色。
+            speed (float): 最大初速 (像素/秒)。
+            lifetime (float): 最長壽命 (秒)，每個粒子在 50%~100% 之間隨機。
+        """
+        amount = min(int(amount * self.density), self.capacity - self.count)
+        if amount <= 0:
+            return
+        start, end = self.count, self.count + amount
+        rng = self._rng
+        angle = rng.uniform(0.0, 2.0 * np.pi, amount)
+        magnitude = rng.uniform(0.2, 1.0, amount) * speed
+        self.pos[start:end, 0] = x
+        self.pos[start:end, 1] = y
+        self.vel[start:end, 0] = np.cos(angle) * magnitude
+        self.vel[start:end, 1] = np.sin(angle) * magnitude
+        life = rng.uniform(0.5, 1.0, amount) * lifetime
+        self.life[start:end] = life
+        self.max_life[start:end] = life
+        self.color[start:end] = color
+        self.count = end
+
+    def update(self, dt):
+        n = self.count
+        if n == 0:
+            return
+        self.pos[:n] += self.vel[:n] * dt
+        self.vel[:n] *= self.drag ** dt
+        self.life[:n] -= dt
+        alive = self.life[:n] > 0
+        k = int(np.count_nonzero(alive))
+        if k < n:
+            # 把存活粒子壓縮到陣列前段
+            for array in (self.pos, self.vel, self.life, self.max_life, self.color):
+                array[:k] = array[:n][alive]
+            self.count = k
+
+    def clear(self):
+        self.count = 0
+
+    def draw(self, surface, offset=(0, 0), scale=1.0):
+        """
+        用 surfarray 一次把所有粒子寫進畫面，依剩餘壽命與底下的像素混合淡出。
+        offset 是攝影機左上角的世界座標，scale 是畫布相對於世界座標的比例。
+        """
+        n = self.count
+        if n == 0:
+            return
+        width, height = surface.get_size()
+        size = max(1, round(self.size * scale))
+        xs = ((self.pos[:n, 0] - offset[0]) * scale).astype(np.intp)
+        ys = ((self.pos[:n, 1] - offset[1]) * scale).astype(np.intp)
+        visible = (xs >= 0) & (xs < width - size) & (ys >= 0) & (ys < height - size)
+        if not visible.any():
+            return
+        xs = xs[visible]
+        ys = ys[visible]
+        fade = (self.life[:n] / self.max_life[:n])[visible][:, None]
+        colors = self.color[:n][visible] * fade
+        keep = 1.0 - fade
+        pixels = pygame.surfarray.pixels3d(surface)
+        for dx in range(size):
+            for dy in range(size):
+                px, py = xs + dx, ys + dy
+                pixels[px, py] = (pixels[px, py] * keep + colors).astype(np.uint8)
+        del pixels  # 解除 Surface 鎖定
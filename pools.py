@@ -0,0 +1,70 @@
+# --- 物件池 ---
+class SpritePool:
+    """
+    可重複使用的精靈物件池。物件被 kill() 後回到池中，下次生成時直接重設使用，
+    避免每次生成都配置新物件與新 Surface。
+    池中的物件需要實作 spawn(*args) 來重設狀態，並有一個 pool 屬性指回這個池。
+    Args:
+        factory (callable): 建立新物件的函式 (不帶參數)。
+        capacity (int): 池中最多保留的閒置物件數量，建立時會先預先配置這麼多個。
+    """
+
+    def __init__(self, factory, capacity=32):
+        self.factory = factory
+        self.capacity = capacity
+        self._free = []
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.allocations = 0  # 新建立的物件數
+        self.reuses = 0  # 從池中取出重用的次數
+        self.discarded = 0  # 池已滿而被丟棄的物件數
+        for _ in range(capacity):
+            self._free.append(self._create())
+
+    def _create(self):
+        obj = self.factory()
+        obj.pool = self
+        self.allocations += 1
+        return obj
+
+    def acquire(self, *args, **kwargs):
+        """取出一個物件並以 spawn(*args, **kwargs) 重設它。"""
+        if self._free:
+            obj = self._free.pop()
+            self.reuses += 1
+        else:
+            obj = self._create()
+        obj.spawn(*args, **kwargs)
+        self.in_use += 1
+        if self.in_use > self.peak_in_use:
+            self.peak_in_use = self.in_use
+        return obj
+
+    def release(self, obj):
+        """把物件還回池中。通常由物件自己的 kill() 呼叫。"""
+        self.in_use = max(0, self.in_use - 1)
+        if len(self._free) < self.capacity:
+            self._free.append(obj)
+        else:
+            self.discarded += 1
+
+    def release_group(self, group):
+        """把精靈群組中的物件全部 kill()，使它們回到各自的池中。"""
+        for sprite in group.sprites():
+            sprite.kill()
+
+    def stats(self):
+        """
+        回傳池的統計資料。
+        Returns:
+            dict: capacity, free, in_use, peak_in_use, allocations, reuses, discarded。
+        """
+        return {
+            "capacity": self.capacity,
+            "free": len(self._free),
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "allocations": self.allocations,
+            "reuses": self.reuses,
+            "discarded": self.discarded,
+        }
@@ -0,0 +1,92 @@
+import os
+
+import pygame
+
+SCALE_AUTO = "auto"  # 整數倍用最近鄰，非整數倍用平滑
+SCALE_NEAREST = "nearest"  # 只放大整數倍 (像素清晰)，多出的部分留黑邊
+SCALE_SMOOTH = "smooth"
+SCALE_GPU = "gpu"  # 交給 SDL 的 renderer (pygame.SCALED) 在顯示卡上放大，不經過 CPU
+SCALE_MODES = (SCALE_AUTO, SCALE_NEAREST, SCALE_SMOOTH, SCALE_GPU)
+
+
+# --- 畫布與視窗 ---
+class Presenter:
+    """
+    遊戲固定畫在 canvas_size 的畫布上，present 時一次縮放到視窗 (保持長寬比，左右或上下補黑邊)，
+    所以視窗大小、全螢幕都不必重新縮放任何素材。視窗與畫布一樣大時畫布就是視窗本身，沒有額外成本。
+    縮放直接寫進視窗的子 Surface，不經過中間的暫存 Surface。
+    Args:
+        canvas_size (tuple): 畫布大小 (遊戲的邏輯解析度)。
+        window_size (tuple): 視窗大小，None 表示與畫布相同 (全螢幕時為桌面大小)。
+        fullscreen (bool): 是否全螢幕。
+        mode (str): SCALE_* 其中之一。
+    """
+
+    def __init__(self, canvas_size, window_size=None, fullscreen=False, mode=SCALE_AUTO):
+        if mode not in SCALE_MODES:
+            raise ValueError(f"不支援的縮放方式: {mode}")
+        self.canvas_size = tuple(canvas_size)
+        self.mode = mode
+        self.fullscreen = fullscreen
+        self.window = None
+        self.canvas = None
+        self._target = None  # 視窗中放畫面的子 Surface
+        self._smooth = False
+        self.open(window_size)
+
+    def open(self, window_size=None):
+        """建立 (或依新的大小重新建立) 視窗。"""
+        flags = pygame.FULLSCREEN if self.fullscreen else 0
+        if self.mode == SCALE_GPU:
+            # 視窗 Surface 就是畫布大小，SDL 在顯示時用顯示卡放大 (最近鄰)
+            os.environ.setdefault("SDL_RENDER_SCALE_QUALITY", "0")
+            self.window = self.canvas = pygame.display.set_mode(self.canvas_size, flags | pygame.SCALED)
+            self._target = None
+            return
+        resizable = window_size is not None and not self.fullscreen
+        if window_size is None:
+            window_size = (0, 0) if self.fullscreen else self.canvas_size
+        if resizable:
+            flags |= pygame.RESIZABLE
+        self.window = pygame.display.set_mode(window_size, flags)
+        if not resizable and self.window.get_size() == self.canvas_size:
+            self.canvas = self.window
+            self._target = None
+            return
+        if self.canvas is None:  # 可以調整大小的視窗重建時沿用同一張畫布
+            self.canvas = pygame.Surface(self.canvas_size).convert()
+        self._layout()
+
+    def _layout(self):
+        window_w, window_h = self.window.get_size()
+        canvas_w, canvas_h = self.canvas_size
+        scale = min(window_w / canvas_w, window_h / canvas_h)
+        integer = scale >= 1 and scale == int(scale)
+        if self.mode == SCALE_NEAREST and scale >= 1:
+            scale = int(scale)
+            integer = True
+        self._smooth = self.mode == SCALE_SMOOTH or (self.mode == SCALE_AUTO and not integer)
+        size = (max(1, round(canvas_w * scale)), max(1, round(canvas_h * scale)))
+        rect = pygame.Rect((0, 0), size)
+        rect.center = (window_w // 2, window_h // 2)
+        self.window.fill((0, 0, 0))
+        self._target = self.window.subsurface(rect)
+
+    @property
+    def scaled(self):
+        return self._target is not None
+
+    def handle_event(self, event):
+        """視窗大小被使用者改變時重新計算縮放 (在主迴圈的事件處理中呼叫)。"""
+        if event.type == pygame.VIDEORESIZE and self.mode != SCALE_GPU and not self.fullscreen:
+            self._target = None
+            self.open(event.size)
+
+    def present(self):
+        """把畫布縮放到視窗並顯示。"""
+        if self._target is not None:
+            if self._smooth:
+                pygame.transform.smoothscale(self.canvas, self._target.get_size(), self._target)
+            else:
+                pygame.transform.scale(self.canvas, self._target.get_size(), self._target)
+        pygame.display.flip()
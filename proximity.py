@@ -0,0 +1,56 @@
+import numpy as np
+
+
+# --- 每個 tick 的距離資料 ---
+class ProximityContext:
+    """
+    每個 tick 算一次所有玩家與箱子、屍體之間的距離 (對所有箱子一次向量化計算)，
+    推箱、復活、HUD 與繪圖都讀這裡，不再各自呼叫 distance_to。建立後不會再更新，位置改變就重新建立。
+    Args:
+        players (list): 玩家 (需要 pos、is_alive、death_pos)。
+        boxes (iterable): 協力箱子 (需要 pos)。
+        push_radius (float): 距離小於這個值算是在推箱子。
+        revive_radius (float): 距離不超過這個值可以復活隊友。
+    """
+
+    def __init__(self, players, boxes, push_radius, revive_radius):
+        self.players = list(players)
+        self.boxes = list(boxes)
+        self._box_index = {box: index for index, box in enumerate(self.boxes)}
+        alive = np.array([player.is_alive for player in self.players], dtype=bool)
+        positions = np.array([(player.pos.x, player.pos.y) for player in self.players], dtype=np.float64)
+
+        box_positions = np.fromiter((value for box in self.boxes for value in box.pos), dtype=np.float64,
+                                    count=2 * len(self.boxes)).reshape(-1, 2)
+        self.box_distance = self._distances(positions, box_positions)  # (玩家, 箱子)
+        self.near_box = (self.box_distance < push_radius) & alive[:, None]
+        self.box_pushers = self.near_box.sum(axis=0)  # 每個箱子旁邊有幾個活著的玩家
+
+        # 屍體位置，沒有屍體的玩家是 NaN (任何比較都是 False)
+        corpses = np.array([(player.death_pos.x, player.death_pos.y)
+                            if not player.is_alive and player.death_pos else (np.nan, np.nan)
+                            for player in self.players], dtype=np.float64)
+        self.corpse_distance = self._distances(positions, corpses)  # (玩家, 屍體的主人)
+        self.in_revive_range = (self.corpse_distance <= revive_radius) & alive[:, None]
+
+    @staticmethod
+    def _distances(a, b):
+        delta = a[:, None, :] - b[None, :, :]
+        return np.sqrt(delta[..., 0] * delta[..., 0] + delta[..., 1] * delta[..., 1])
+
+    def pushers(self, box):
+        """箱子旁邊活著的玩家數 (不在這個 tick 的資料裡的箱子回傳 0)。"""
+        index = self._box_index.get(box)
+        return 0 if index is None else int(self.box_pushers[index])
+
+    def all_near(self, box):
+        """是否所有玩家都活著且都在箱子旁邊 (可以推動)。"""
+        return self.pushers(box) == len(self.players)
+
+    def is_near(self, player_id, box):
+        index = self._box_index.get(box)
+        return index is not None and bool(self.near_box[player_id, index])
+
+    def can_revive(self, player_id, target_id):
+        """player_id 活著、target_id 有屍體，而且在復活範圍內。"""
+        return bool(self.in_revive_range[player_id, target_id])
@@ -0,0 +1,131 @@
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import pygame
+
+
+# --- 背景錄影 ---
+class VideoRecorder:
+    """
+    在背景執行緒用 cv2.VideoWriter 把畫面編碼成影片。
+    主執行緒的 capture 透過 pygame.surfarray.pixels2d 直接看 Surface 的像素 (不經過轉換)，
+    複製進預先配置、記憶體排列與 Surface 相同的緩衝區 (一次連續複製)，再交給編碼執行緒。
+    緩衝區數量就是佇列上限：編碼跟不上、沒有空的緩衝區時直接丟掉這一幀，遊戲迴圈不會等待。
+    Args:
+        path (str): 輸出檔案路徑。
+        size (tuple): 畫面寬高，必須與之後 capture 的 Surface 相同。
+        fps (float): 影片的幀率。
+        queue_size (int): 最多排隊等待編碼的幀數。
+        fourcc (str): cv2.VideoWriter 的編碼器代號。
+    """
+
+    def __init__(self, path, size, fps, queue_size=8, fourcc="mp4v"):
+        self.path = path
+        self.size = tuple(size)
+        self.fps = fps
+        self.fourcc = fourcc
+        width, height = self.size
+        # Fortran 排列的 (寬, 高) 與 pixels2d 的 view 相同，複製時是一整塊連續記憶體
+        self._free = queue.Queue()
+        for _ in range(queue_size):
+            self._free.put(np.empty((width, height), dtype=np.uint32, order="F"))
+        self._frames = queue.Queue()
+        self._thread = None
+        self._conversion = None
+        self.error = None  # 編碼執行緒的錯誤訊息
+        self.started_at = 0.0
+        self.frames_captured = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.capture_ms = 0.0  # 主執行緒每幀花費的時間 (指數移動平均)
+        self.max_capture_ms = 0.0
+
+    @property
+    def recording(self):
+        return self._thread is not None
+
+    @property
+    def duration(self):
+        return self.frames_captured / self.fps
+
+    def start(self):
+        if self._thread is None:
+            self.started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+            self._thread.start()
+        return self
+
+    @staticmethod
+    def _color_conversion(surface):
+        """依 Surface 的像素格式決定轉成 BGR 的方式 (每個像素 4 個位元組)。"""
+        if surface.get_bytesize() != 4:
+            raise ValueError("錄影只支援 32 位元的畫面")
+        shifts = surface.get_shifts()[:3]
+        if sys.byteorder == "little":
+            order = tuple(shift // 8 for shift in shifts)
+        else:
+            order = tuple(3 - shift // 8 for shift in shifts)
+        if order == (2, 1, 0):
+            return cv2.COLOR_BGRA2BGR
+        if order == (0, 1, 2):
+            return cv2.COLOR_RGBA2BGR
+        raise ValueError(f"不支援的像素格式: {surface.get_masks()}")
+
+    def capture(self, surface):
+        """
+        把 surface 目前的內容排進編碼佇列 (在 display.flip 之後呼叫)。
+        Returns:
+            bool: 這一幀是否被收下 (False 表示被丟掉)。
+        """
+        if self._thread is None or self.error is not None:
+            return False
+        start = time.perf_counter()
+        if self._conversion is None:
+            try:
+                self._conversion = self._color_conversion(surface)
+            except ValueError as exc:
+                self.error = str(exc)  # 與編碼執行緒的錯誤一樣顯示在 HUD，不讓遊戲迴圈中斷
+                return False
+        try:
+            buffer = self._free.get_nowait()
+        except queue.Empty:
+            self.frames_dropped += 1
+            return False
+        pixels = pygame.surfarray.pixels2d(surface)
+        np.copyto(buffer, pixels)
+        del pixels  # 釋放 Surface 的鎖
+        self._frames.put(buffer)
+        self.frames_captured += 1
+        elapsed = (time.perf_counter() - start) * 1000.0
+        self.capture_ms += (elapsed - self.capture_ms) * 0.05
+        self.max_capture_ms = max(self.max_capture_ms, elapsed)
+        return True
+
+    def _run(self):
+        width, height = self.size
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+        if not writer.isOpened():
+            self.error = f"無法建立影片檔: {self.path}"
+        while True:
+            buffer = self._frames.get()
+            if buffer is None:
+                break
+            if self.error is None:
+                # (寬, 高) 的 Fortran 陣列轉置後就是 (高, 寬) 的一般陣列，每個像素 4 個位元組
+                frame = buffer.T.view(np.uint8).reshape(height, width, 4)
+                writer.write(cv2.cvtColor(frame, self._conversion))
+                self.frames_written += 1
+            self._free.put(buffer)
+        writer.release()
+
+    def stop(self):
+        """等已經排隊的幀編碼完再關閉檔案。"""
+        if self._thread is None:
+            return
+        self._frames.put(None)
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,136 @@
+import weakref
+
+import pygame
+
+
+# --- 批次繪圖佇列 ---
+class RenderQueue:
+    """
+    每幀從各個系統收集要畫的 (surface, dest, area)，依圖層排序後用 Surface.blits 一次送出，
+    不必每個精靈各呼叫一次 blit。同一圖層依加入的順序畫。
+    線條、surfarray 等不是 blit 的繪圖用 add_draw 排進圖層：它前後的 blit 各自合併成一次 blits，
+    所以只有夾在中間的繪圖會把批次切開。
+    畫布比邏輯畫面小 (scale < 1) 時，世界精靈 (add_sprites、add_scaled) 的位置乘上 scale，
+    圖片換成快取的縮小版本 (每張圖片只縮放一次，圖片被回收時快取自動消失)；add 的位置與圖片已經是畫布像素。
+    Args:
+        scale (float): 畫布相對於邏輯畫面 (攝影機範圍) 的比例。
+        track (callable): track(surface)，縮小的圖片交給它登記記憶體用量 (None 表示不登記)。
+    """
+
+    def __init__(self, scale=1.0, track=None):
+        self.scale = scale
+        self.track = track
+        self._layers = {}  # 圖層 -> [(surface, dest) / (surface, dest, area) / 繪圖函式]
+        self._scaled = weakref.WeakKeyDictionary()  # 原圖 -> 縮小的圖
+        self._used = set()  # 這一幀用到的原圖 id
+        self._previous_used = set()  # 上一幀用到的原圖 id (丟棄快取時保留這兩幀用到的)
+        self.blits_calls = 0  # 上一次 submit 呼叫 blits 的次數
+        self.blit_count = 0  # 上一次 submit 畫了幾個 Surface
+
+    def _layer(self, layer):
+        items = self._layers.get(layer)
+        if items is None:
+            items = self._layers[layer] = []
+        return items
+
+    def add(self, layer, surface, dest, area=None):
+        """加入已經是畫布像素的圖片 (例如用畫布大小的字型畫的文字)，dest 是畫布座標。"""
+        self._layer(layer).append((surface, dest) if area is None else (surface, dest, area))
+
+    def add_scaled(self, layer, surface, dest):
+        """加入邏輯大小的圖片，dest 是邏輯畫面座標 (世界座標減去攝影機左上角)。"""
+        if self.scale == 1:
+            self._layer(layer).append((surface, dest))
+        else:
+            self._layer(layer).append((self.scaled(surface), self.to_canvas(dest)))
+
+    def to_canvas(self, point):
+        """邏輯畫面座標 -> 畫布座標。"""
+        return (round(point[0] * self.scale), round(point[1] * self.scale))
+
+    def scaled(self, surface):
+        """surface 的畫布大小版本 (第一次用到時縮放並快取)。"""
+        if self.scale == 1:
+            return surface
+        self._used.add(id(surface))
+        result = self._scaled.get(surface)
+        if result is None:
+            width, height = surface.get_size()
+            size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+            if surface.get_bitsize() >= 24:
+                result = pygame.transform.smoothscale(surface, size)
+            else:
+                result = pygame.transform.scale(surface, size)
+            if self.track is not None:
+                self.track(result)
+            self._scaled[surface] = result
+        return result
+
+    def forget(self, surface):
+        """surface 的像素被直接修改過 (例如重新填色)，下次用到時重新縮放。"""
+        self._scaled.pop(surface, None)
+
+    def clear_scaled(self):
+        """丟掉最近沒有畫到的縮小圖片 (記憶體不足時使用；正在畫的留著，否則下一幀馬上又要重建)。回傳是否丟掉了東西。"""
+        used = self._used | self._previous_used
+        unused = [surface for surface in self._scaled.keys() if id(surface) not in used]
+        for surface in unused:
+            del self._scaled[surface]
+        return bool(unused)
+
+    def extend(self, layer, items):
+        """加入已經是 (surface, dest) 形式的項目 (例如 HUD 文字)。"""
+        self._layer(layer).extend(items)
+
+    def add_sprites(self, layer, sprites, view):
+        """
+        加入 view (世界座標) 範圍內的精靈，dest 轉成畫面座標。
+        Args:
+            layer (int): 圖層。
+            sprites (iterable): 有 image、rect 的精靈。
+            view (pygame.Rect): 攝影機在世界座標中的範圍。
+        """
+        items = self._layer(layer)
+        x, y = view.topleft
+        if self.scale == 1:
+            for sprite in sprites:
+                if view.colliderect(sprite.rect):
+                    items.append((sprite.image, sprite.rect.move(-x, -y)))
+            return
+        # 位置以世界座標取整數後再減去攝影機，與背景區塊的對齊方式相同，捲動時精靈不會相對背景抖動
+        scale = self.scale
+        origin_x, origin_y = round(x * scale), round(y * scale)
+        for sprite in sprites:
+            if view.colliderect(sprite.rect):
+                rect = sprite.rect
+                items.append((self.scaled(sprite.image),
+                              (round(rect.x * scale) - origin_x, round(rect.y * scale) - origin_y)))
+
+    def add_draw(self, layer, draw):
+        """加入不是 blit 的繪圖 (draw(surface))，依圖層順序在 blit 之間執行。"""
+        self._layer(layer).append(draw)
+
+    def submit(self, target):
+        """依圖層順序畫到 target，然後清空佇列。"""
+        self.blits_calls = 0
+        self.blit_count = 0
+        batch = []
+        for layer in sorted(self._layers):
+            for item in self._layers[layer]:
+                if callable(item):
+                    self._flush(target, batch)
+                    item(target)
+                else:
+                    batch.append(item)
+        self._flush(target, batch)
+        for items in self._layers.values():
+            items.clear()  # 保留每個圖層的列表，下一幀直接重用
+        self._previous_used = self._used
+        self._used = set()
+
+    def _flush(self, target, batch):
+        if batch:
+            target.blits(batch, doreturn=False)
+            self.blits_calls += 1
+            self.blit_count += len(batch)
+            batch.clear()
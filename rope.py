@@ -0,0 +1,151 @@
+import time
+
+import numpy as np
+import pygame
+
+
+# --- 多段繩索 (Verlet 鎖鏈) ---
+class VerletRope:
+    """
+    以 position-based Verlet 模擬的多段鎖鏈，所有節點存放在 NumPy 陣列中。
+    兩端固定在玩家(或屍體)位置，中間節點會與雷射牆壁、協力箱子碰撞。
+    Args:
+        segment_count (int): 繩索段數 (節點數 = 段數 + 1)。
+        max_length (float): 繩索總長度，通常等於 CHAIN_MAX_LENGTH。
+        iterations (int): 每幀約束求解的迭代次數。
+        damping (float): 速度阻尼，越小繩子越快靜止。
+        thickness (float): 碰撞時繩子的半寬，節點會被推到障礙物外這個距離。
+        budget_ms (float): 每幀的時間預算(毫秒)，超出時自動減少迭代次數。
+    """
+
+    def __init__(self, segment_count=32, max_length=400, iterations=6, damping=0.9,
+                 thickness=2.0, budget_ms=0.3):
+        self.max_length = float(max_length)
+        self.max_iterations = iterations
+        self.iterations = iterations
+        self.damping = damping
+        self.thickness = thickness
+        self.budget_ms = budget_ms
+        self.last_step_ms = 0.0
+        self.set_segment_count(segment_count)
+
+    def set_segment_count(self, segment_count):
+        """改變段數，並把現有繩索 (形狀與速度) 重新取樣到新的節點數。"""
+        segment_count = max(1, int(segment_count))
+        old_points = getattr(self, "points", None)
+        if old_points is not None and segment_count == self.segment_count:
+            return
+        self.segment_count = segment_count
+        self.rest_length = self.max_length / segment_count
+        if old_points is None:
+            self.points = np.zeros((segment_count + 1, 2), dtype=np.float64)
+            self.prev_points = np.zeros_like(self.points)
+            return
+        t_old = np.linspace(0.0, 1.0, len(old_points))
+        t_new = np.linspace(0.0, 1.0, segment_count + 1)
+        self.points = self._resample(old_points, t_old, t_new)
+        self.prev_points = self._resample(self.prev_points, t_old, t_new)
+
+    @staticmethod
+    def _resample(points, t_old, t_new):
+        return np.stack((np.interp(t_new, t_old, points[:, 0]), np.interp(t_new, t_old, points[:, 1])), axis=1)
+
+    def reset(self, start, end):
+        """把所有節點排成 start 到 end 的直線，並清除速度。"""
+        t = np.linspace(0.0, 1.0, self.segment_count + 1)[:, None]
+        start = np.asarray(start, dtype=np.float64)
+        end = np.asarray(end, dtype=np.float64)
+        self.points[:] = start + (end - start) * t
+        self.prev_points[:] = self.points
+
+    def step(self, start, end, obstacle_rects=None):
+        """
+        推進一幀：Verlet 積分、長度約束、障礙物碰撞。
+        Args:
+            start (tuple): 第一個端點位置 (x, y)。
+            end (tuple): 第二個端點位置 (x, y)。
+            obstacle_rects (np.ndarray): 形狀為 (M, 4) 的 (left, top, right, bottom) 陣列，可為 None。
+        """
+        t0 = time.perf_counter()
+        pts = self.points
+        # Verlet 積分 (只處理內部節點，兩端固定)
+        velocity = (pts[1:-1] - self.prev_points[1:-1]) * self.damping
+        self.prev_points[:] = pts
+        pts[1:-1] += velocity
+        pts[0] = start
+        pts[-1] = end
+
+        if obstacle_rects is not None and len(obstacle_rects):
+            grown = np.asarray(obstacle_rects, dtype=np.float64).copy()
+            grown[:, :2] -= self.thickness
+            grown[:, 2:] += self.thickness
+        else:
+            grown = None
+
+        for _ in range(self.iterations):
+            self._solve_lengths(pts)
+            pts[0] = start
+            pts[-1] = end
+            if grown is not None:
+                self._collide(pts, grown)
+
+        self.last_step_ms = (time.perf_counter() - t0) * 1000.0
+        # 超出預算就減少迭代次數，有餘裕時再慢慢恢復
+        if self.last_step_ms > self.budget_ms and self.iterations > 1:
+            self.iterations -= 1
+        elif self.last_step_ms < self.budget_ms * 0.5 and self.iterations < self.max_iterations:
+            self.iterations += 1
+
+    def _solve_lengths(self, pts):
+        # 向量化 Jacobi 解：只在段長超過靜止長度時拉回 (繩子可以鬆弛，不能拉長)
+        delta = pts[1:] - pts[:-1]
+        dist = np.hypot(delta[:, 0], delta[:, 1])
+        dist += 1e-9
+        stretch = np.maximum(dist - self.rest_length, 0.0)
+        stretch *= 0.5
+        stretch /= dist
+        delta *= stretch[:, None]
+        pts[:-1] += delta
+        pts[1:] -= delta
+
+    def _collide(self, pts, rects):
+        inner = pts[1:-1]
+        x = inner[:, 0:1]
+        y = inner[:, 1:2]
+        left, top, right, bottom = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+        inside = (x > left) & (x < right) & (y > top) & (y < bottom)  # (K, M)
+        if not inside.any():
+            return
+        hit_points = np.nonzero(inside.any(axis=1))[0]
+        hit_rects = inside[hit_points].argmax(axis=1)  # 每個節點只處理第一個重疊的障礙物
+        hx = inner[hit_points, 0]
+        hy = inner[hit_points, 1]
+        r = rects[hit_rects]
+        # 到四個邊的穿透深度，推向最近的邊
+        depths = np.stack((hx - r[:, 0], r[:, 2] - hx, hy - r[:, 1], r[:, 3] - hy), axis=1)
+        side = depths.argmin(axis=1)
+        hx = np.where(side == 0, r[:, 0], np.where(side == 1, r[:, 2], hx))
+        hy = np.where(side == 2, r[:, 1], np.where(side == 3, r[:, 3], hy))
+        inner[hit_points, 0] = hx
+        inner[hit_points, 1] = hy
+
+    def draw(self, surface, color, width=3, offset=(0, 0), scale=1.0):
+        """把繩索畫成折線，offset 是攝影機左上角的世界座標，scale 是畫布相對於世界座標的比例。"""
+        points = self.points - offset
+        if scale != 1:
+            points *= scale
+        pygame.draw.lines(surface, color, False, points.tolist(), width)
+
+
+def rects_to_array(rects):
+    """
+    把 pygame.Rect 列表轉成 (M, 4) 的 (left, top, right, bottom) 陣列，給 VerletRope 碰撞用。
+    Args:
+        rects (iterable): pygame.Rect 物件。
+    Returns:
+        np.ndarray: 形狀為 (M, 4) 的浮點陣列。
+    """
+    data = [(r.left, r.top, r.right, r.bottom) for r in rects]
+    if not data:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.array(data, dtype=np.float64)
@@ -0,0 +1,130 @@
+import os
+import time
+
+_MASK64 = (1 << 64) - 1
+
+
+# --- 模擬用亂數 ---
+class SimRandom:
+    """
+    狀態只有一個 64 位元整數的亂數產生器 (xorshift64*)。
+    遊戲規則用到的亂數都來自這裡，快照只需要 8 個位元組，不必複製 random 模組 2.5 KB 的狀態。
+    Args:
+        seed (int): 隨機種子，None 時用系統亂數。
+    """
+
+    def __init__(self, seed=None):
+        self.state = 1
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), "little")
+        # splitmix64 打散種子，讓相鄰的種子也得到差很多的序列
+        z = (seed + 0x9E3779B97F4A7C15) & _MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        self.state = (z ^ (z >> 31)) or 1
+
+    def _next(self):
+        x = self.state
+        x ^= x >> 12
+        x ^= (x << 25) & _MASK64
+        x ^= x >> 27
+        self.state = x
+        return (x * 0x2545F4914F6CDD1D) & _MASK64
+
+    def random(self):
+        """[0, 1) 的浮點數。"""
+        return (self._next() >> 11) * (1.0 / 9007199254740992.0)
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.random()
+
+    def randint(self, a, b):
+        """[a, b] 的整數。"""
+        return a + self._next() % (b - a + 1)
+
+
+# --- 快照環形緩衝區 ---
+class SnapshotRing:
+    """
+    預先配置 capacity 個固定大小欄位的環形緩衝區，每個 tick 把遊戲狀態直接寫進下一格，
+    滿了就覆蓋最舊的一格，記憶體固定為 capacity * record_size 位元組。
+    寫入與讀回都透過 callback 直接操作緩衝區，並記錄花費的時間 (微秒)。
+    Args:
+        capacity (int): 最多保留的快照數。
+        record_size (int): 每個快照最大的位元組數。
+    """
+
+    def __init__(self, capacity, record_size=0):
+        self.capacity = capacity
+        self.record_size = -1
+        self._sizes = [0] * capacity
+        self.save_us = 0.0  # 平均 (指數移動平均)
+        self.restore_us = 0.0
+        self.max_save_us = 0.0
+        self.max_restore_us = 0.0
+        self.reset(record_size)
+
+    def reset(self, record_size):
+        """清空；record_size 改變時重新配置緩衝區。"""
+        if record_size != self.record_size:
+            self.record_size = record_size
+            self._buffer = bytearray(self.capacity * record_size)
+            self._view = memoryview(self._buffer)
+        self._head = 0
+        self._count = 0
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        return len(self._buffer)
+
+    def push(self, write):
+        """
+        寫入一個新快照。
+        Args:
+            write (callable): write(buffer, offset) -> 結束位置，把狀態寫進 buffer[offset:]。
+        """
+        start = time.perf_counter()
+        offset = self._head * self.record_size
+        self._sizes[self._head] = write(self._view, offset) - offset
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        elapsed = (time.perf_counter() - start) * 1e6
+        self.save_us += (elapsed - self.save_us) * 0.05
+        self.max_save_us = max(self.max_save_us, elapsed)
+
+    def pop(self, read):
+        """
+        讀回最新的快照並把它從緩衝區移除 (倒轉)。
+        Args:
+            read (callable): read(buffer, offset)。
+        Returns:
+            bool: 是否還有快照可讀。
+        """
+        if not self._count:
+            return False
+        self._head = (self._head - 1) % self.capacity
+        self._count -= 1
+        start = time.perf_counter()
+        read(self._view, self._head * self.record_size)
+        elapsed = (time.perf_counter() - start) * 1e6
+        self.restore_us += (elapsed - self.restore_us) * 0.05
+        self.max_restore_us = max(self.max_restore_us, elapsed)
+        return True
+
+    def latest(self):
+        """最新快照的位元組內容 (複製一份，例如存檔用)，沒有時回傳 None。"""
+        if not self._count:
+            return None
+        index = (self._head - 1) % self.capacity
+        offset = index * self.record_size
+        return bytes(self._view[offset:offset + self._sizes[index]])
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+# --- 地刺排程器 ---
+class SpikeScheduler:
+    """
+    把一關所有地刺的時間參數放在 NumPy 陣列中，每個 tick 用一次向量化運算算出全部地刺的狀態，
+    只回傳真的切換了狀態的地刺，讓碰撞旗標與重畫只處理這些地刺。
+    地刺狀態由關卡時間直接算出：((phase_offset + t) mod (out_time + in_time)) < out_time。
+    Args:
+        spike_table (np.ndarray): (K, 7) 的 x, y, w, h, out_time, in_time, phase_offset (見 CompiledLevel)。
+        traps (list): 對應的 SpikeTrap 物件，狀態切換時會更新它們的 active 旗標，可為 None。
+    """
+
+    def __init__(self, spike_table, traps=None):
+        table = np.asarray(spike_table, dtype=np.float64).reshape(-1, 7)
+        self.rects = table[:, :4].astype(np.int64)
+        self.out_time = table[:, 4].copy()
+        self.phase_offset = table[:, 6].copy()
+        self.cycle_time = table[:, 4] + table[:, 5]
+        self.traps = traps
+        self.state = np.zeros(len(table), dtype=bool)
+        # 預先配置的暫存陣列，tick 時不必配置新記憶體
+        self._phase = np.zeros(len(table), dtype=np.float64)
+        self._next_state = np.zeros(len(table), dtype=bool)
+        self._state_bytes = memoryview(self.state.view(np.uint8))  # 快照直接複製這段記憶體
+        self._no_change = np.zeros(0, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.state)
+
+    def reset(self):
+        """回到關卡開始時的狀態 (全部縮回)。"""
+        self.state[:] = False
+        if self.traps:
+            for trap in self.traps:
+                trap.reset()
+
+    @property
+    def state_size(self):
+        """pack_state 寫入的位元組數 (每個地刺一個位元組)。"""
+        return len(self.state)
+
+    def pack_state(self, buffer, offset):
+        """把所有地刺的狀態寫進 buffer[offset:]，回傳結束位置。直接複製記憶體，不經過 NumPy 運算。"""
+        end = offset + len(self.state)
+        buffer[offset:end] = self._state_bytes
+        return end
+
+    def unpack_state(self, buffer, offset):
+        """
+        從 buffer[offset:] 讀回所有地刺的狀態 (回滾、倒轉時使用)。
+        Returns:
+            tuple: (結束位置, 狀態有改變的地刺索引)。
+        """
+        end = offset + len(self.state)
+        saved = buffer[offset:end]
+        if saved == self._state_bytes:
+            return end, self._no_change
+        self._next_state.view(np.uint8)[:] = np.frombuffer(saved, np.uint8)
+        changed = np.flatnonzero(self._next_state != self.state)
+        self.state[changed] = self._next_state[changed]
+        if self.traps:
+            for i in changed.tolist():
+                self.traps[i].active = bool(self.state[i])
+        return end, changed
+
+    def states_at(self, level_time):
+        """回傳 level_time 時所有地刺的狀態 (不改變排程器本身)。"""
+        return np.fmod(self.phase_offset + level_time, self.cycle_time) < self.out_time
+
+    def tick(self, level_time):
+        """
+        更新到 level_time。
+        Args:
+            level_time (float): 關卡開始後經過的秒數。
+        Returns:
+            np.ndarray: 這次切換狀態的地刺索引。
+        """
+        if not len(self.state):
+            return self._no_change
+        np.add(self.phase_offset, level_time, out=self._phase)
+        np.fmod(self._phase, self.cycle_time, out=self._phase)
+        np.less(self._phase, self.out_time, out=self._next_state)
+        changed = np.flatnonzero(self._next_state != self.state)
+        if changed.size:
+            self.state[changed] = self._next_state[changed]
+            if self.traps:
+                for i in changed.tolist():
+                    trap = self.traps[i]
+                    trap.active = bool(self.state[i])
+                    trap.timer = self._phase[i]
+        return changed
@@ -0,0 +1,103 @@
+import threading
+import weakref
+
+
+# --- Surface 記憶體統計 ---
+def surface_bytes(surface):
+    """Surface 像素實際佔用的位元組 (subsurface 與母圖共用像素，算 0)。"""
+    if surface.get_parent() is not None:
+        return 0
+    return surface.get_pitch() * surface.get_height()
+
+
+class SurfaceMemory:
+    """
+    依類別統計 Surface 佔用的記憶體：建立 Surface 的地方呼叫 track(surface, 類別)，
+    Surface 被回收時用 weakref.finalize 自動扣掉，所以總量永遠是目前還活著的 Surface。
+    可以登記「可丟棄的衍生快取」(縮放快取、背景區塊、其他關卡的精靈等)，
+    超過預算時 enforce() 依登記順序呼叫它們釋放記憶體，直到回到預算內。
+    Args:
+        budget (int): 記憶體預算 (位元組)，None 表示不限制、只統計。
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.total = 0
+        self.peak = 0
+        self.categories = {}  # 類別 -> [目前位元組, 最高位元組, 目前數量]
+        self.evictions = 0  # enforce 實際釋放記憶體的次數
+        self.evicted = {}  # 快取名稱 -> 累計釋放的位元組
+        self._evictors = []  # [(名稱, evict())]，evict 回傳 True 表示可能還有東西可以丟
+        self._lock = threading.RLock()  # 背景執行緒解碼的圖片也會被統計，回收可能發生在任何執行緒
+
+    def track(self, surface, category):
+        """登記 surface 屬於 category，回傳 surface 本身 (可以直接包住建立 Surface 的運算式)。"""
+        size = surface_bytes(surface)
+        if not size:
+            return surface
+        with self._lock:
+            stats = self.categories.get(category)
+            if stats is None:
+                stats = self.categories[category] = [0, 0, 0]
+            stats[0] += size
+            stats[1] = max(stats[1], stats[0])
+            stats[2] += 1
+            self.total += size
+            self.peak = max(self.peak, self.total)
+        weakref.finalize(surface, self._release, category, size)
+        return surface
+
+    def track_all(self, surfaces, category):
+        for surface in surfaces:
+            self.track(surface, category)
+        return surfaces
+
+    def tracker(self, category):
+        """回傳 track(surface) 的單參數版本，給只接受回呼的元件使用 (例如背景區塊)。"""
+        return lambda surface: self.track(surface, category)
+
+    def _release(self, category, size):
+        with self._lock:
+            stats = self.categories[category]
+            stats[0] -= size
+            stats[2] -= 1
+            self.total -= size
+
+    def add_evictor(self, name, evict):
+        """登記可丟棄的快取，先登記的先丟 (應該把重建最便宜、最不會馬上用到的放前面)。"""
+        self._evictors.append((name, evict))
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.total > self.budget
+
+    def enforce(self):
+        """超過預算時依序丟棄快取，直到回到預算內或沒有東西可以丟。回傳釋放的位元組。"""
+        if not self.over_budget:
+            return 0
+        before = self.total
+        for name, evict in self._evictors:
+            start = self.total
+            while self.over_budget and evict():
+                pass
+            if start > self.total:
+                self.evicted[name] = self.evicted.get(name, 0) + start - self.total
+            if not self.over_budget:
+                break
+        freed = before - self.total
+        if freed > 0:
+            self.evictions += 1
+        return freed
+
+    def report(self):
+        """依佔用大小排列的各類別統計 (MB)。"""
+        mb = 1024 * 1024
+        budget = "" if self.budget is None else f"，預算 {self.budget / mb:.1f}MB，丟棄快取 {self.evictions} 次"
+        lines = [f"Surface 記憶體 {self.total / mb:.1f}MB (最高 {self.peak / mb:.1f}MB{budget})"]
+        with self._lock:
+            rows = sorted(self.categories.items(), key=lambda item: -item[1][1])
+        for category, (current, peak, count) in rows:
+            lines.append(f"  {category:<12} {current / mb:7.2f}MB  最高 {peak / mb:7.2f}MB  {count} 張")
+        for name, size in self.evicted.items():
+            lines.append(f"  丟棄 {name}: {size / mb:.2f}MB")
+        return "\n".join(lines)
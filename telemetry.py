@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+from gamerules import SCREEN_WIDTH, SCREEN_HEIGHT, COOP_BOX_SIZE, GOAL_SIZE, FRUIT_RADIUS
+from levels import compile_level, load_level_file
+
+# --- 事件格式 ---
+# 每筆事件固定 24 個位元組。遊戲中先寫進預先配置的區塊，區塊滿了才交給背景執行緒，
+# 依欄位分開附加到各自的檔案 (columnar)：讀取時每個欄位都是一個 np.fromfile，不需要解析。
+EVENT_DTYPE = np.dtype([
+    ("run", "<u4"),  # 第幾次開始關卡 (同一個工作階段內遞增，重新開始也算一次)
+    ("time", "<f4"),  # 關卡時間 (秒)
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("level", "<u4"),  # 關卡編號，對應 meta.json 的 levels
+    ("kind", "u1"),
+    ("player", "u1"),
+    ("detail", "u1"),  # 死因、果實種類或關卡結果
+    ("actor", "u1"),  # 復活時是救人的玩家，其他事件是 NO_ACTOR
+])
+
+EVENT_MOVE = 0  # 定時取樣的玩家位置
+EVENT_DEATH = 1
+EVENT_REVIVE_START = 2  # 開始復活某位玩家 (換目標時重新計時)
+EVENT_REVIVE = 3  # 復活完成
+EVENT_FRUIT = 4
+EVENT_LEVEL_END = 5
+EVENT_NAMES = ("move", "death", "revive_start", "revive", "fruit", "level_end")
+
+CAUSE_UNKNOWN = 0
+CAUSE_LASER = 1
+CAUSE_SPIKE = 2
+CAUSE_METEOR = 3
+CAUSE_NAMES = ("unknown", "laser", "spike", "meteor")
+
+FRUIT_TYPES = ("mirror", "invisible_wall", "volcano")
+OUTCOME_NAMES = ("unknown", "complete", "game_over")
+NO_ACTOR = 255
+
+TELEMETRY_BLOCK_SIZE = 4096  # 每個區塊的事件數 (約 96KB)
+TELEMETRY_BLOCKS = 4  # 預先配置的區塊數，寫入跟不上、沒有空區塊時丟掉整個區塊
+META_FILE = "meta.json"
+
+
+# --- 事件記錄 ---
+class TelemetryRecorder:
+    """
+    遊戲中記錄事件：record() 只把欄位寫進目前的區塊 (預先配置的結構陣列)，不配置記憶體也不碰檔案。
+    區塊滿了或呼叫 flush() 時交給背景執行緒，每個欄位用 tofile 附加到 <欄位>.bin，
+    並更新 meta.json (關卡路徑與筆數)。程式中途結束時已寫入的區塊仍然可以讀取。
+    Args:
+        directory (str): 這個工作階段的輸出資料夾 (會自動建立)。
+        block_size (int): 每個區塊的事件數。
+        blocks (int): 預先配置的區塊數。
+    """
+
+    def __init__(self, directory, block_size=TELEMETRY_BLOCK_SIZE, blocks=TELEMETRY_BLOCKS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._free = queue.Queue()
+        for _ in range(blocks - 1):
+            self._free.put(np.zeros(block_size, dtype=EVENT_DTYPE))
+        self._block = np.zeros(block_size, dtype=EVENT_DTYPE)
+        self._count = 0
+        self._pending = queue.Queue()
+        self._levels = {}  # 關卡編號 -> 路徑 (只在主執行緒修改，交給寫入執行緒時複製)
+        self.run = 0
+        self.level = 0
+        self.records = 0
+        self.dropped = 0
+        self.written = 0
+        self.error = None  # 寫入執行緒的錯誤訊息
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def begin_run(self, level_index, path):
+        """開始 (或重新開始) 一個關卡，之後的事件都屬於這一次。"""
+        self.run += 1
+        self.level = level_index
+        self._levels[level_index] = path
+
+    def record(self, kind, player, time_, x, y, detail=0, actor=NO_ACTOR):
+        if self._block is None:
+            self.flush()  # 寫入執行緒可能已經還回空區塊
+            if self._block is None:
+                self.dropped += 1
+                return
+        block = self._block
+        block[self._count] = (self.run, time_, x, y, self.level, kind, player, detail, actor)
+        self._count += 1
+        self.records += 1
+        if self._count == len(block):
+            self.flush()
+
+    def flush(self):
+        """把目前的區塊交給寫入執行緒 (不等待寫完)。沒有空區塊時丟掉之後的事件，直到寫入執行緒跟上。"""
+        if self._block is not None and self._count:
+            self._pending.put((self._block, self._count, dict(self._levels)))
+            self._block = None
+        if self._block is None:
+            try:
+                self._block = self._free.get_nowait()
+            except queue.Empty:
+                return
+            self._count = 0
+
+    def close(self):
+        self.flush()
+        self._pending.put(None)
+        self._thread.join()
+
+    def _run(self):
+        columns = {}
+        try:
+            for name in EVENT_DTYPE.names:
+                columns[name] = open(os.path.join(self.directory, f"{name}.bin"), "ab")
+            while True:
+                item = self._pending.get()
+                if item is None:
+                    break
+                block, count, levels = item
+                for name, column in columns.items():
+                    block[name][:count].tofile(column)
+                    column.flush()
+                self.written += count
+                self._free.put(block)
+                self._write_meta(levels)
+        except OSError as error:
+            self.error = f"遙測寫入失敗: {error}"
+        finally:
+            for column in columns.values():
+                column.close()
+
+    def _write_meta(self, levels):
+        meta = {"dtype": [[name, EVENT_DTYPE[name].str] for name in EVENT_DTYPE.names],
+                "records": self.written, "levels": {str(index): path for index, path in levels.items()}}
+        temp_path = os.path.join(self.directory, META_FILE + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, os.path.join(self.directory, META_FILE))
+
+
+# --- 讀取 ---
+def find_sessions(paths):
+    """展開輸入路徑：包含 meta.json 的資料夾本身是一個工作階段，否則找它下一層的工作階段。"""
+    sessions = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, META_FILE)):
+            sessions.append(path)
+        elif os.path.isdir(path):
+            sessions += sorted(os.path.join(path, name) for name in os.listdir(path)
+                               if os.path.exists(os.path.join(path, name, META_FILE)))
+    return sessions
+
+
+def load_events(paths):
+    """
+    讀入所有工作階段的事件。run 會加上偏移，讓不同工作階段的 run 不重複；
+    level 重新對應到回傳的關卡路徑清單 (同一個關卡檔在不同工作階段的編號可能不同)。
+    Returns:
+        tuple: (事件結構陣列, 關卡路徑清單)
+    """
+    parts = []
+    level_paths = []
+    run_offset = 0
+    for session in find_sessions(paths):
+        with open(os.path.join(session, META_FILE), encoding="utf-8") as file:
+            meta = json.load(file)
+        columns = {}
+        for name, dtype in meta["dtype"]:
+            column_path = os.path.join(session, f"{name}.bin")
+            columns[name] = np.fromfile(column_path, dtype=dtype) if os.path.exists(column_path) else np.zeros(0)
+        count = min(len(column) for column in columns.values())  # 寫到一半結束時以最短的欄位為準
+        events = np.empty(count, dtype=EVENT_DTYPE)
+        for name in EVENT_DTYPE.names:
+            events[name] = columns[name][:count] if name in columns else 0
+        remap = np.zeros(max([int(index) for index in meta["levels"]] + [0]) + 1, dtype=np.uint32)
+        for index, path in meta["levels"].items():
+            path = os.path.normpath(path)
+            if path not in level_paths:
+                level_paths.append(path)
+            remap[int(index)] = level_paths.index(path)
+        events["level"] = remap[np.minimum(events["level"], len(remap) - 1)]
+        events["run"] += run_offset
+        if count:
+            run_offset = int(events["run"].max()) + 1
+        parts.append(events)
+    events = np.concatenate(parts) if parts else np.zeros(0, dtype=EVENT_DTYPE)
+    return events, level_paths
+
+
+def revive_times(events):
+    """
+    每次復活的倒地時間與救援時間 (秒)：倒地時間從死亡到復活，救援時間從最後一次開始復活到完成。
+    同一個 run 中同一位玩家的事件依時間排序後配對 (全部向量化，不逐筆迴圈)。
+    Returns:
+        tuple: (復活事件, 倒地時間, 救援時間)，找不到對應事件時是 NaN。
+    """
+    keep = np.isin(events["kind"], (EVENT_DEATH, EVENT_REVIVE_START, EVENT_REVIVE))
+    subset = events[keep]
+    order = np.lexsort((subset["kind"] == EVENT_REVIVE, subset["time"], subset["player"], subset["run"]))
+    subset = subset[order]
+    same_owner = np.r_[False, (subset["run"][1:] == subset["run"][:-1]) &
+                       (subset["player"][1:] == subset["player"][:-1])]
+    index = np.arange(len(subset))
+    # 每一筆事件之前 (含) 最近一次死亡 / 開始復活的位置，換人或換 run 時重設
+    group_start = np.maximum.accumulate(np.where(~same_owner, index, 0))
+    last_death = np.maximum.accumulate(np.where(subset["kind"] == EVENT_DEATH, index, -1))
+    last_start = np.maximum.accumulate(np.where(subset["kind"] == EVENT_REVIVE_START, index, -1))
+    revived = np.flatnonzero(subset["kind"] == EVENT_REVIVE)
+    times = subset["time"].astype(np.float64)
+    death = last_death[revived]
+    start = last_start[revived]
+    down = np.where(death >= group_start[revived], times[revived] - times[np.maximum(death, 0)], np.nan)
+    # 開始復活必須在這次死亡之後，否則是上一次倒地留下的
+    valid_start = (start >= group_start[revived]) & (start > death)
+    rescue = np.where(valid_start, times[revived] - times[np.maximum(start, 0)], np.nan)
+    return subset[revived], down, rescue
+
+
+# --- 熱度圖 ---
+def heatmap(events, world_size, cell_size):
+    """把事件位置累加到格子上 (一次 bincount，幾百萬筆也很快)。回傳 (rows, cols) 的計數。"""
+    width, height = world_size
+    cols = (width + cell_size - 1) // cell_size
+    rows = (height + cell_size - 1) // cell_size
+    col = np.clip((events["x"] // cell_size).astype(np.intp), 0, cols - 1)
+    row = np.clip((events["y"] // cell_size).astype(np.intp), 0, rows - 1)
+    return np.bincount(row * cols + col, minlength=rows * cols).reshape(rows, cols)
+
+
+def blur(grid, radius):
+    """兩次方框模糊 (累加和，成本與半徑無關)，讓稀疏的死亡點看得出區域。"""
+    result = grid.astype(np.float64)
+    for axis in (0, 1):
+        for _ in range(2):
+            padded = np.pad(result, [(radius + 1, radius) if a == axis else (0, 0) for a in range(2)], mode="constant")
+            summed = np.cumsum(padded, axis=axis)
+            upper = np.take(summed, np.arange(2 * radius + 1, summed.shape[axis]), axis=axis)
+            lower = np.take(summed, np.arange(0, summed.shape[axis] - 2 * radius - 1), axis=axis)
+            result = (upper - lower) / (2 * radius + 1)
+    return result
+
+
+def render_level(compiled):
+    """不需要視窗的關卡示意圖：牆壁、地刺、箱子起點、果實。"""
+    surface = pygame.Surface((compiled.world_width, compiled.world_height))
+    surface.fill((20, 20, 24))
+    for row in compiled.spike_table.astype(int):
+        pygame.draw.rect(surface, (90, 90, 100), pygame.Rect(*row[:4]))
+    for rect in compiled.wall_rects:
+        pygame.draw.rect(surface, (200, 40, 40), rect)
+    for x, y in compiled.box_starts:
+        box_rect = pygame.Rect(0, 0, COOP_BOX_SIZE, COOP_BOX_SIZE)
+        box_rect.center = (x, y)
+        pygame.draw.rect(surface, (160, 110, 60), box_rect, 2)
+    for x, y, _ in compiled.fruits:
+        pygame.draw.circle(surface, (240, 240, 240), (int(x), int(y)), 8, 2)
+    return surface
+
+
+def overlay_heatmap(surface, grid, opacity=0.75):
+    """
+    把熱度圖疊在 surface 上：對數縮放後由藍經黃到白，沒有事件的格子保持透明。
+    格子放大到畫面大小用 np.repeat (每格一個純色方塊，看得出格子邊界)。
+    """
+    if not grid.any():
+        return surface
+    value = np.log1p(grid) / np.log1p(grid.max())
+    ramp = np.array([[0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 255, 255]], dtype=np.float64)
+    position = value * (len(ramp) - 1)
+    low = np.minimum(position.astype(np.intp), len(ramp) - 2)
+    fraction = (position - low)[..., None]
+    colors = ramp[low] * (1 - fraction) + ramp[low + 1] * fraction
+    alpha = np.where(grid > 0, opacity * np.clip(value * 2, 0.3, 1.0), 0.0)[..., None]
+
+    width, height = surface.get_size()
+    scale_y = -(-height // grid.shape[0])
+    scale_x = -(-width // grid.shape[1])
+    colors = np.repeat(np.repeat(colors, scale_y, axis=0), scale_x, axis=1)[:height, :width]
+    alpha = np.repeat(np.repeat(alpha, scale_y, axis=0), scale_x, axis=1)[:height, :width]
+    pixels = pygame.surfarray.pixels3d(surface)  # (寬, 高, 3)
+    blended = pixels * (1 - alpha.transpose(1, 0, 2)) + colors.transpose(1, 0, 2) * alpha.transpose(1, 0, 2)
+    pixels[...] = blended.astype(np.uint8)
+    del pixels
+    return surface
+
+
+def select_events(events, kind, cause=None, fruit=None, player=None):
+    mask = events["kind"] == EVENT_NAMES.index(kind)
+    if cause is not None:
+        mask &= events["detail"] == CAUSE_NAMES.index(cause)
+    if fruit is not None:
+        mask &= events["detail"] == FRUIT_TYPES.index(fruit)
+    if player is not None:
+        mask &= events["player"] == player
+    return events[mask]
+
+
+def format_summary(events, level_paths):
+    lines = [f"{len(events)} 筆事件，{len(np.unique(events['run']))} 次遊玩"]
+    revived, down, rescue = revive_times(events)
+    for index, path in enumerate(level_paths):
+        level_events = events[events["level"] == index]
+        kinds = np.bincount(level_events["kind"], minlength=len(EVENT_NAMES))
+        deaths = level_events[level_events["kind"] == EVENT_DEATH]
+        causes = np.bincount(deaths["detail"], minlength=len(CAUSE_NAMES))
+        fruits = level_events[level_events["kind"] == EVENT_FRUIT]
+        picked = np.bincount(fruits["detail"], minlength=len(FRUIT_TYPES))
+        ends = level_events[level_events["kind"] == EVENT_LEVEL_END]
+        outcomes = np.bincount(ends["detail"], minlength=len(OUTCOME_NAMES))
+        lines.append(f"{path}:")
+        lines.append("  死亡 " + "  ".join(f"{CAUSE_NAMES[i]} {causes[i]}" for i in range(1, len(CAUSE_NAMES))) +
+                     f"  (共 {kinds[EVENT_DEATH]})")
+        lines.append("  果實 " + "  ".join(f"{name} {picked[i]}" for i, name in enumerate(FRUIT_TYPES)))
+        lines.append(f"  過關 {outcomes[1]}  全滅 {outcomes[2]}")
+        level_down = down[revived["level"] == index]
+        level_rescue = rescue[revived["level"] == index]
+        if len(level_down):
+            lines.append(f"  復活 {len(level_down)} 次  倒地時間 p50 {np.nanpercentile(level_down, 50):.1f}s "
+                         f"p95 {np.nanpercentile(level_down, 95):.1f}s  救援時間 p50 "
+                         f"{np.nanpercentile(level_rescue, 50):.2f}s")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="彙整遙測事件：印出統計並把熱度圖疊在關卡示意圖上")
+    parser.add_argument("paths", nargs="+", help="遙測工作階段資料夾 (或包含多個工作階段的資料夾)")
+    parser.add_argument("--level", help="要畫熱度圖的關卡檔 (沒有指定時只印統計)")
+    parser.add_argument("--kind", choices=EVENT_NAMES, default="death", help="要畫的事件種類")
+    parser.add_argument("--cause", choices=CAUSE_NAMES[1:], help="只看這個死因")
+    parser.add_argument("--fruit", choices=FRUIT_TYPES, help="只看這種果實")
+    parser.add_argument("--player", type=int, help="只看這位玩家 (從 0 開始)")
+    parser.add_argument("--cell", type=int, default=20, help="熱度圖格子大小 (像素)")
+    parser.add_argument("--blur", type=int, default=1, help="模糊半徑 (格)")
+    parser.add_argument("--out", default="heatmap.png", help="輸出圖片")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    events, level_paths = load_events(args.paths)
+    print(format_summary(events, level_paths))
+    if args.level:
+        level_path = os.path.normpath(args.level)
+        if level_path not in level_paths:
+            print(f"遙測資料中沒有 {args.level} 的事件", file=sys.stderr)
+            return 1
+        compiled = compile_level(load_level_file(level_path), level_path, SCREEN_WIDTH, SCREEN_HEIGHT, FRUIT_RADIUS,
+                                 COOP_BOX_SIZE, GOAL_SIZE)
+        selected = select_events(events[events["level"] == level_paths.index(level_path)], args.kind,
+                                 args.cause, args.fruit, args.player)
+        grid = heatmap(selected, (compiled.world_width, compiled.world_height), args.cell)
+        if args.blur > 0:
+            grid = blur(grid, args.blur)
+        surface = overlay_heatmap(render_level(compiled), grid)
+        pygame.image.save(surface, args.out)
+        print(f"{len(selected)} 筆 {args.kind} 事件 -> {args.out}")
+    print(f"({time.perf_counter() - started:.2f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
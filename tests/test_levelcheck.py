@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from levelcheck import check_level_data
+from levels import LEVELS_DIR
+
+
+def open_level(player1_start, player2_start):
+    """level_02 只留下外圍的四面牆、沒有箱子，兩位玩家的起點由參數指定。"""
+    with open(os.path.join(LEVELS_DIR, "level_02.json"), encoding="utf-8") as file:
+        level = json.load(file)
+    level["laser_walls"] = level["laser_walls"][:4]
+    level["coop_box_start"] = []
+    level["player1_start"] = player1_start
+    level["player2_start"] = player2_start
+    return level
+
+
+def test_spawn_flush_against_wall_is_completable():
+    # 騎士 (120x120) 的碰撞框剛好貼著左上角的牆，起點所在的格子會被當成碰到牆
+    report = check_level_data(open_level([80, 80], [200, 90]))
+    assert report["goal_reachable"] == [True, True]
+    assert report["completable"]
+
+
+def test_spawn_near_wall_is_completable():
+    report = check_level_data(open_level([90, 90], [200, 90]))
+    assert report["completable"]
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+
+# --- 攝影機 ---
+class Camera:
+    """
+    跟隨玩家的攝影機。rect 是攝影機在世界座標中看到的範圍，
+    畫圖時把世界座標減去 rect.topleft 轉成畫面座標。
+    Args:
+        view_width (int): 畫面寬度。
+        view_height (int): 畫面高度。
+    """
+
+    def __init__(self, view_width, view_height):
+        self.rect = pygame.Rect(0, 0, view_width, view_height)
+        self.world_rect = pygame.Rect(0, 0, view_width, view_height)
+
+    def set_world(self, world_width, world_height):
+        self.world_rect = pygame.Rect(0, 0, world_width, world_height)
+        self.rect.clamp_ip(self.world_rect)
+
+    def follow(self, target):
+        """把攝影機中心移到 target (世界座標)，不超出世界邊界。"""
+        self.rect.center = (int(target[0]), int(target[1]))
+        self.rect.clamp_ip(self.world_rect)
+
+    def keep_in_view(self, bounds):
+        """用最小的移動讓 bounds (世界座標) 整個在畫面上，bounds 比畫面大時對準它的中心，不超出世界邊界。"""
+        view = self.rect
+        if bounds.width > view.width:
+            view.centerx = bounds.centerx
+        else:
+            view.x = min(max(view.x, bounds.right - view.width), bounds.left)
+        if bounds.height > view.height:
+            view.centery = bounds.centery
+        else:
+            view.y = min(max(view.y, bounds.bottom - view.height), bounds.top)
+        view.clamp_ip(self.world_rect)
+
+    @property
+    def offset(self):
+        return self.rect.topleft
+
+    def apply(self, rect):
+        """世界座標的 Rect 轉成畫面座標。"""
+        return rect.move(-self.rect.x, -self.rect.y)
+
+    def apply_point(self, pos):
+        """世界座標的點轉成畫面座標。"""
+        return (pos[0] - self.rect.x, pos[1] - self.rect.y)
+
+
+# --- 區塊索引 ---
+class ChunkIndex:
+    """
+    把世界切成 chunk_size x chunk_size 的區塊，記錄每個區塊裡有哪些物件，
+    查詢某個範圍時只看相交的區塊，成本跟查詢範圍大小有關，而不是整個世界。
+    Args:
+        chunk_size (int): 區塊邊長 (像素)。
+    """
+
+    def __init__(self, chunk_size=512):
+        self.chunk_size = chunk_size
+        self._chunks = {}  # (cx, cy) -> list of objects
+        self._object_chunks = {}  # id(obj) -> list of (cx, cy)
+
+    def chunks_for_rect(self, rect):
+        size = self.chunk_size
+        for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+            for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+                yield (cx, cy)
+
+    def insert(self, obj, rect):
+        keys = list(self.chunks_for_rect(rect))
+        for key in keys:
+            self._chunks.setdefault(key, []).append(obj)
+        self._object_chunks[id(obj)] = keys
+
+    def remove(self, obj):
+        for key in self._object_chunks.pop(id(obj), ()):
+            bucket = self._chunks.get(key)
+            if bucket and obj in bucket:
+                bucket.remove(obj)
+
+    def query(self, rect):
+        """回傳與 rect 所在區塊重疊的物件 (不重複，保持插入順序)。"""
+        found = {}
+        for key in self.chunks_for_rect(rect):
+            for obj in self._chunks.get(key, ()):
+                found[id(obj)] = obj
+        return list(found.values())
+
+
+# --- 區塊背景 ---
+class ChunkedBackground:
+    """
+    只在需要時才畫出的分塊背景，超出 max_chunks 時丟掉最久沒用到的區塊，
+    記憶體只跟畫面附近的區塊數有關，不會隨世界大小增加。
+    Args:
+        world_width (int): 世界寬度。
+        world_height (int): 世界高度。
+        render_chunk (callable): render_chunk(surface, chunk_rect)，把 chunk_rect 範圍的靜態內容畫到 surface。
+        chunk_size (int): 區塊邊長 (像素)。
+        max_chunks (int): 最多保留的區塊數。
+        track (callable): track(surface)，新建的區塊交給它登記記憶體用量 (None 表示不登記)。
+        scale (float): 畫布相對於世界座標的比例。小於 1 時區塊以世界大小畫好後縮小保存，
+            位置以世界座標乘上 scale 後取整數，相鄰區塊剛好接上。
+    """
+
+    def __init__(self, world_width, world_height, render_chunk, chunk_size=512, max_chunks=24, track=None,
+                 scale=1.0):
+        self.world_rect = pygame.Rect(0, 0, world_width, world_height)
+        self.render_chunk = render_chunk
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.track = track
+        self.scale = scale
+        self._surfaces = OrderedDict()  # (cx, cy) -> Surface
+
+    def _to_canvas(self, rect):
+        """世界座標的 Rect -> 縮放後的 Rect (兩端各自取整數，所以相鄰的範圍不會有縫或重疊)。"""
+        scale = self.scale
+        left, top = round(rect.left * scale), round(rect.top * scale)
+        return pygame.Rect(left, top, round(rect.right * scale) - left, round(rect.bottom * scale) - top)
+
+    def _render(self, surface, world_rect):
+        """把 world_rect 範圍畫到 surface (大小是 world_rect 縮放後的大小)。"""
+        if self.scale == 1:
+            self.render_chunk(surface, world_rect)
+            return
+        full = pygame.Surface(world_rect.size).convert()
+        self.render_chunk(full, world_rect)
+        pygame.transform.smoothscale(full, surface.get_size(), surface)
+
+    def _get_chunk(self, key):
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            return surface
+        size = self.chunk_size
+        chunk_rect = pygame.Rect(key[0] * size, key[1] * size, size, size).clip(self.world_rect)
+        surface = pygame.Surface(self._to_canvas(chunk_rect).size).convert()
+        if self.track is not None:
+            self.track(surface)
+        self._render(surface, chunk_rect)
+        self._surfaces[key] = surface
+        while len(self._surfaces) > self.max_chunks:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def invalidate(self):
+        self._surfaces.clear()
+
+    def trim(self, keep):
+        """丟掉最久沒用到的區塊，只保留 keep 個 (記憶體不足時使用)。回傳是否丟掉了區塊。"""
+        trimmed = len(self._surfaces) > keep
+        while len(self._surfaces) > keep:
+            self._surfaces.popitem(last=False)
+        return trimmed
+
+    def redraw_rects(self, rects):
+        """
+        只重畫已快取區塊中的部分範圍 (例如切換狀態的地刺)。不在快取中的區塊下次用到時自然會重畫。
+        Args:
+            rects (np.ndarray): (K, 4) 的 x, y, w, h 世界座標陣列。
+        """
+        if not self._surfaces or not len(rects):
+            return
+        size = self.chunk_size
+        rects = np.asarray(rects)
+        keys = np.array(list(self._surfaces.keys()))  # (R, 2)
+        cx0 = rects[:, 0:1] // size
+        cy0 = rects[:, 1:2] // size
+        cx1 = (rects[:, 0:1] + rects[:, 2:3] - 1) // size
+        cy1 = (rects[:, 1:2] + rects[:, 3:4] - 1) // size
+        # (K, R)：哪些範圍碰到哪些已快取的區塊
+        hits = (keys[:, 0] >= cx0) & (keys[:, 0] <= cx1) & (keys[:, 1] >= cy0) & (keys[:, 1] <= cy1)
+        for rect_i, key_i in zip(*np.nonzero(hits)):
+            key = (int(keys[key_i, 0]), int(keys[key_i, 1]))
+            surface = self._surfaces[key]
+            chunk_rect = pygame.Rect(key[0] * size, key[1] * size, size, size).clip(self.world_rect)
+            dirty = pygame.Rect(*(int(v) for v in rects[rect_i])).clip(chunk_rect)
+            if dirty.width <= 0 or dirty.height <= 0:
+                continue
+            if self.scale != 1:
+                # 多畫一圈，縮小時邊緣取樣到的也是新的內容
+                dirty = dirty.inflate(4, 4).clip(chunk_rect)
+            origin = self._to_canvas(chunk_rect).topleft
+            target = self._to_canvas(dirty).move(-origin[0], -origin[1]).clip(surface.get_rect())
+            if target.width > 0 and target.height > 0:
+                self._render(surface.subsurface(target), dirty)
+
+    def draw(self, surface, camera):
+        size = self.chunk_size
+        view = camera.rect.clip(self.world_rect)
+        if view.width <= 0 or view.height <= 0:
+            return
+        origin_x, origin_y = round(camera.rect.x * self.scale), round(camera.rect.y * self.scale)
+        for cy in range(view.top // size, (view.bottom - 1) // size + 1):
+            for cx in range(view.left // size, (view.right - 1) // size + 1):
+                surface.blit(self._get_chunk((cx, cy)),
+                             (round(cx * size * self.scale) - origin_x, round(cy * size * self.scale) - origin_y))